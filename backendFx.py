@@ -0,0 +1,112 @@
+# ----------------------------------------------------------------------------------------
+# backendFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# Lazy loading of arcpy and its Spatial Analyst module, and checks that the library modules import quickly and without arcpy.
+
+# Usage Tips:
+# Modules use the arcpy and sa objects defined here instead of importing arcpy themselves:
+#    from backendFx import arcpy, sa
+# arcpy is then only imported the first time one of its attributes is used, and the Spatial Analyst license is only checked out the first time a Spatial Analyst tool is called. Importing the library, or opening the toolbox, costs neither, and the library can be imported on machines without ArcGIS as long as no arcpy function is called.
+# importTimes() measures how long modules take to import in a fresh interpreter, and whether doing so loaded arcpy; checkImportBudget() reports any over importBudget seconds. Run "python backendFx.py" to check the library modules.
+
+# Dependencies:
+# Python standard library only. The arcpy and sa objects require arcpy, and sa the Spatial Analyst extension.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, sys, importlib, subprocess
+
+# Import time allowed for each library module, in seconds
+importBudget = 1.0
+
+# Library modules checked against the budget
+libraryModules = ['scuFX', 'libConSiteFx', 'd8Fx', 'gridFx', 'zonalFx', 'rankFx', 'geomFx', 'cacheFx', 'profileFx', 'writerFx', 'prefetchFx', 'coverFx', 'batchFx']
+
+class LazyModule(object):
+   '''Stands in for a module that is imported the first time one of its attributes is used. onLoad, if given, is called with the module once it has been imported.'''
+   def __init__(self, name, onLoad = None):
+      self.__dict__['_name'] = name
+      self.__dict__['_onLoad'] = onLoad
+      self.__dict__['_module'] = None
+
+   def _load(self):
+      if self._module is None:
+         module = importlib.import_module(self._name)
+         if self._onLoad is not None:
+            self._onLoad(module)
+         self.__dict__['_module'] = module
+      return self._module
+
+   @property
+   def loaded(self):
+      return self._module is not None
+
+   def __getattr__(self, attr):
+      return getattr(self._load(), attr)
+
+   def __setattr__(self, attr, value):
+      setattr(self._load(), attr, value)
+
+   def __repr__(self):
+      return '<lazy module %s (%s)>' % (self._name, 'loaded' if self.loaded else 'not loaded')
+
+def _setupArcpy(module):
+   '''Settings applied when arcpy is first loaded'''
+   # Set overwrite option so that existing data may be overwritten
+   module.env.overwriteOutput = True
+
+def _checkOutSpatial(module):
+   '''Checks out the Spatial Analyst license when arcpy.sa is first used'''
+   arcpy.CheckOutExtension("Spatial")
+
+arcpy = LazyModule('arcpy', _setupArcpy)
+sa = LazyModule('arcpy.sa', _checkOutSpatial)
+
+def importTimes(modules = None, folder = None):
+   '''Imports each module in a fresh interpreter, with folder (by default, the folder of this module) as the working directory. Returns a dictionary of module name -> (seconds taken, whether arcpy was loaded), with seconds None if the import failed.'''
+   folder = folder or os.path.dirname(os.path.abspath(__file__))
+   code = "import sys, time; sys.path.insert(0, ''); t0 = time.time(); import %s; print('%%s %%s' %% (time.time() - t0, 'arcpy' in sys.modules))"
+   times = {}
+   for mod in modules or libraryModules:
+      proc = subprocess.Popen([sys.executable, '-c', code % mod], cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+      out, err = proc.communicate()
+      if proc.returncode != 0:
+         times[mod] = (None, False)
+      else:
+         secs, loaded = out.decode().split()[-2:]
+         times[mod] = (float(secs), loaded == 'True')
+   return times
+
+def checkImportBudget(modules = None, budget = None, times = None):
+   '''Measures import times (see importTimes), unless already given as times, and returns a list of problems: modules over budget seconds (importBudget by default), modules loading arcpy, and modules that fail to import'''
+   budget = importBudget if budget is None else budget
+   times = times or importTimes(modules)
+   problems = []
+   for mod, (secs, loaded) in sorted(times.items()):
+      if secs is None:
+         problems.append('%s failed to import' % mod)
+         continue
+      if secs > budget:
+         problems.append('%s took %.2f s to import (budget %.2f s)' % (mod, secs, budget))
+      if loaded:
+         problems.append('%s loads arcpy on import' % mod)
+   return problems
+
+def main():
+   times = importTimes()
+   for mod, (secs, loaded) in sorted(times.items()):
+      if secs is None:
+         print('%-14s failed to import' % mod)
+      else:
+         print('%-14s %6.3f s%s' % (mod, secs, '  (loads arcpy)' if loaded else ''))
+   problems = checkImportBudget(times=times)
+   for p in problems:
+      print('Problem: %s' % p)
+   return 1 if problems else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
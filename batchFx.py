@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------------------------
+# batchFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# Job manifests and throughput reports for running many delineation and prioritization scenarios against the same flow direction raster in one warm batch (see scuFX.runBatch).
+
+# Usage Tips:
+# A manifest is a JSON file naming the flow direction raster shared by all jobs, default arguments, and the jobs themselves. Each job gives the tool to run ("delineate" for delineatePolyCatchments, "prioritize" for prioritizeSCUs) and the arguments that differ from the defaults, by name. "where" optionally selects a subset of the input SCUs:
+#    {"in_FlowDir": "C:/data/hydro.gdb/fdir",
+#     "numWorkers": 4,
+#     "warm": {"loadGrid": false, "useIndex": false},
+#     "defaults": {"tool": "delineate", "in_Feats": "C:/data/scu.gdb/scus", "fld_ID": "lngID", "backend": "numpy"},
+#     "jobs": [{"name": "b1_500", "where": "BIODIV_SIG = 'B1'", "maxDist": "500 METERS", "out_Catch": "C:/out/b1_500.gpkg"},
+#              {"name": "all_1000", "maxDist": "1000 METERS", "out_Catch": "C:/out/all_1000.gpkg"}]}
+# Run it from the command line with "python batchFx.py manifest.json", optionally with --workers and --report (a .json file for the per-job results).
+# The flow direction raster's properties, and its upstream index if "useIndex" is set, are loaded once per worker, before the first delineation job it runs, and shared by all the jobs it runs after; workers that only run prioritization jobs load nothing. "loadGrid" also loads the whole grid, which takes as much memory as the raster has cells: with several workers, it is copied once to a temporary file that all of them memory-map. Leave it off for statewide rasters unless memory is plentiful; windows are then read from the raster as needed.
+# The report gives each job's time and throughput, and estimates the time saved against running every delineation job cold, from the time the workers took to load the raster.
+
+# Dependencies:
+# Python standard library only. Running the jobs requires arcpy (through scuFX).
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import sys, json, argparse
+
+# Tools a job can run, with the arguments each requires
+jobTools = {'delineate': ('in_Feats', 'fld_ID', 'out_Catch'), 'prioritize': ('in_SCU', 'in_Catch', 'fld_ID', 'fld_BRANK', 'lo_BRANK', 'in_Integrity', 'in_ConsPriority', 'in_Vulnerability', 'out_SCU')}
+
+def loadManifest(manifest):
+   '''Reads a job manifest from a JSON file, or takes one already loaded as a dictionary. Fills each job in from the defaults, names unnamed jobs by their position, and checks that every job names a known tool and has the arguments it needs. Returns the manifest with its jobs filled in.'''
+   if not isinstance(manifest, dict):
+      with open(manifest) as f:
+         manifest = json.load(f)
+   manifest = dict(manifest)
+   if not manifest.get('in_FlowDir'):
+      raise ValueError('The manifest does not name a flow direction raster (in_FlowDir)')
+   defaults = manifest.get('defaults', {})
+   jobs = []
+   for i, job in enumerate(manifest.get('jobs', [])):
+      full = dict(defaults)
+      full.update(job)
+      full.setdefault('name', 'job%s' % (i + 1))
+      full.setdefault('tool', 'delineate')
+      if full['tool'] not in jobTools:
+         raise ValueError('Job %s: unrecognized tool %s' % (full['name'], full['tool']))
+      missing = [a for a in jobTools[full['tool']] if a not in full]
+      if missing:
+         raise ValueError('Job %s: missing %s' % (full['name'], ', '.join(missing)))
+      jobs.append(full)
+   names = [j['name'] for j in jobs]
+   if len(set(names)) < len(names):
+      raise ValueError('Job names must be unique')
+   manifest['jobs'] = jobs
+   manifest.setdefault('numWorkers', 1)
+   manifest.setdefault('warm', {})
+   return manifest
+
+def summarize(results, wallSec, sharedSec = 0.0):
+   '''Summarizes the results of a batch: a list of dictionaries, one per job, with its name, tool, seconds, number of features, and the process ID of the worker that ran it and the seconds it spent warming that worker up (see scuFX.runBatch). wallSec is the time the whole batch took, warm-up included, and sharedSec the time spent preparing a grid shared by the workers, counted as warm-up.
+   Only delineation jobs load the raster, each worker before the first it runs. A cold run would have loaded the raster for every delineation job, so the time saved is estimated as the mean warm-up time for every delineation job, less the warm-up time actually spent.'''
+   warmups = [r['warmSec'] for r in results if r.get('warmSec')]
+   meanWarm = (sum(warmups) + sharedSec) / len(warmups) if warmups else 0.0
+   warmSec = sum(warmups) + sharedSec
+   numDelineate = len([r for r in results if r['tool'] == 'delineate'])
+   jobSec = sum(r['seconds'] for r in results)
+   done = [r for r in results if not r.get('error')]
+   feats = sum(r['features'] or 0 for r in done)
+   return {'jobs': len(results), 'failed': len(results) - len(done), 'workers': len(set(r['pid'] for r in results)), 'wallSec': wallSec, 'jobSec': jobSec, 'warmSec': warmSec, 'features': feats, 'featsPerSec': feats / jobSec if jobSec > 0 else None, 'coldSec': jobSec + meanWarm * numDelineate, 'savedSec': meanWarm * numDelineate - warmSec}
+
+def reportTable(results, summary):
+   '''Returns the per-job results and the batch summary as a plain text table'''
+   lines = ['%-20s %-10s %8s %10s %12s  %s' % ('Job', 'Tool', 'Features', 'Time (s)', 'Features/s', 'Status')]
+   for r in results:
+      rate = '%.1f' % (r['features'] / r['seconds']) if r['features'] and r['seconds'] > 0 else '-'
+      lines.append('%-20s %-10s %8s %10.2f %12s  %s' % (r['name'], r['tool'], r['features'] if r['features'] is not None else '-', r['seconds'], rate, 'failed: %s' % r['error'] if r.get('error') else 'ok'))
+   s = summary
+   lines.append('%s jobs (%s failed) on %s workers in %.1f s wall time; %.1f s in jobs, %.1f features/s' % (s['jobs'], s['failed'], s['workers'], s['wallSec'], s['jobSec'], s['featsPerSec'] or 0.0))
+   lines.append('Loading the flow direction raster took %.1f s in all; run cold, the jobs would have taken about %.1f s, so warming saved about %.1f s' % (s['warmSec'], s['coldSec'], s['savedSec']))
+   return '\n'.join(lines)
+
+def saveReport(path, results, summary):
+   '''Saves the per-job results and the summary to a JSON file'''
+   with open(path, 'w') as f:
+      json.dump({'jobs': results, 'summary': summary}, f, indent=1)
+
+def main():
+   parser = argparse.ArgumentParser(description='Runs the delineation and prioritization jobs in a manifest against one flow direction raster, loaded once per worker.')
+   parser.add_argument('manifest', help='path of the JSON job manifest')
+   parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: numWorkers in the manifest, or 1)')
+   parser.add_argument('--report', default=None, help='optional path of a JSON file for the per-job results')
+   args = parser.parse_args()
+
+   # scuFX is only imported here, so that manifests can be checked without it
+   import scuFX
+   results, summary = scuFX.runBatch(args.manifest, args.workers, args.report)
+   return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
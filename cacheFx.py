@@ -0,0 +1,119 @@
+# ----------------------------------------------------------------------------------------
+# cacheFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A persistent, content-addressed cache for per-feature results such as catchment geometries, so that re-runs only recompute features that are new or have changed.
+
+# Usage Tips:
+# Entries are keyed by a hash of everything the result depends on (see catchmentKey). A changed feature, distance, cell size, or flow direction raster simply produces a new key, so stale entries are never served; they age out through size-based eviction, oldest-used first.
+# Several processes may share one cache folder. Entries are written to a temporary file and renamed into place, so a reader never sees a partial entry.
+
+# Dependencies:
+# Python standard library only. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, hashlib, pickle, tempfile
+
+def catchmentKey(geomBytes, maxDist, cellSize, fdirFingerprint, *extra):
+   '''Returns the cache key for a catchment: a SHA-1 hash of the feature geometry (as WKB or other bytes), the maximum distance, the cell size, a fingerprint of the flow direction raster, and any further settings the result depends on'''
+   h = hashlib.sha1()
+   h.update(bytes(geomBytes))
+   for item in (maxDist, cellSize, fdirFingerprint) + extra:
+      h.update(b'|')
+      h.update(str(item).encode('utf-8'))
+   return h.hexdigest()
+
+class ResultCache(object):
+   '''Persistent cache of picklable values in a folder, one file per entry, with size-based least-recently-used eviction and hit/miss counters'''
+   suffix = '.entry'
+
+   def __init__(self, cacheDir, maxBytes = 2 * 2**30):
+      self.cacheDir = cacheDir
+      self.maxBytes = maxBytes
+      if not os.path.isdir(cacheDir):
+         os.makedirs(cacheDir)
+      self.hits = 0
+      self.misses = 0
+      self.stored = 0
+      self.evicted = 0
+      self.nbytes = sum(os.path.getsize(p) for p in self._entries())
+
+   def _entries(self):
+      return [os.path.join(self.cacheDir, f) for f in os.listdir(self.cacheDir) if f.endswith(self.suffix)]
+
+   def _path(self, key):
+      return os.path.join(self.cacheDir, key + self.suffix)
+
+   def get(self, key):
+      '''Returns the value stored under key, or None'''
+      path = self._path(key)
+      try:
+         with open(path, 'rb') as f:
+            value = pickle.load(f)
+      except (IOError, OSError, EOFError, pickle.UnpicklingError):
+         self.misses += 1
+         return None
+      # Touch the entry so that eviction sees it as recently used
+      try:
+         os.utime(path, None)
+      except OSError:
+         pass
+      self.hits += 1
+      return value
+
+   def put(self, key, value):
+      '''Stores a value under key, then evicts the least recently used entries if the cache is over its size limit'''
+      path = self._path(key)
+      fd, tmp = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+         pickle.dump(value, f, 2)
+      size = os.path.getsize(tmp)
+      # An entry stored before under the same key is replaced, so its size no longer counts
+      try:
+         oldSize = os.path.getsize(path)
+      except OSError:
+         oldSize = 0
+      try:
+         if oldSize:
+            os.remove(path)
+         os.rename(tmp, path)
+      except OSError:
+         # Another process stored the same entry first
+         os.remove(tmp)
+         return
+      self.nbytes += size - oldSize
+      self.stored += 1
+      if self.nbytes > self.maxBytes:
+         self.evict()
+
+   def evict(self):
+      '''Deletes least recently used entries until the cache is within 90% of its size limit'''
+      entries = []
+      for p in self._entries():
+         try:
+            st = os.stat(p)
+         except OSError:
+            continue
+         entries.append((st.st_mtime, st.st_size, p))
+      entries.sort()
+      self.nbytes = sum(e[1] for e in entries)
+      target = 0.9 * self.maxBytes
+      for mtime, size, p in entries:
+         if self.nbytes <= target:
+            break
+         try:
+            os.remove(p)
+         except OSError:
+            continue
+         self.nbytes -= size
+         self.evicted += 1
+
+   def report(self):
+      '''Returns a one-line summary of cache activity'''
+      total = self.hits + self.misses
+      rate = 100.0 * self.hits / total if total else 0.0
+      return 'Cache %s: %s hits, %s misses (hit rate %.1f%%), %s stored, %s evicted, %.1f MB in use' % (self.cacheDir, self.hits, self.misses, rate, self.stored, self.evicted, self.nbytes / 2.0**20)
@@ -0,0 +1,241 @@
+# ----------------------------------------------------------------------------------------
+# coverFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of NumPy functions for measuring how Stream Conservation Unit (SCU) catchments overlap, and for choosing a portfolio of SCUs that together cover the most distinct cells, with catchments held as compact cell sets over the flow direction grid rather than as polygons.
+
+# Usage Tips:
+# Build a CoverageIndex from the catchment cells of each SCU (e.g. the cells of a zonalFx.ZoneMembership, kept only where integrity is high), then:
+#    idx = coverFx.CoverageIndex.fromCellSets(cellSets, cellArea)
+#    picks, gains = idx.greedy(budget, costs)   # portfolio covering the most distinct area within the budget
+#    i, j, shared = idx.overlaps()              # cells shared by every pair of overlapping catchments
+# Each catchment is stored as in a roaring bitmap: its cells are split into chunks of 65536 consecutive flat indices, each held as a sorted array of 16-bit offsets or, once it has more than 4096 cells, as an 8 KB bitmap. A catchment costs at most 2 bytes per cell, and set operations work a chunk at a time.
+# The selection is the greedy algorithm for budgeted maximum coverage, with lazy evaluation of marginal gains: gains only shrink as cells are covered, so a candidate's stale gain kept in a priority queue is an upper bound, and it only needs recomputing when it reaches the top. The result covers at least (1 - 1/e)/2 of the best possible area under a budget, and (1 - 1/e) of it with unit costs.
+
+# Dependencies:
+# numpy 1.7 or later, as shipped with ArcGIS 10.3.1. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import heapq
+import numpy as np
+
+# Cells per chunk, and the number of cells above which a chunk is held as a bitmap rather than an array
+chunkBits = 16
+chunkSize = 1 << chunkBits
+arrayMax = 4096
+
+# Catchments expanded at once when computing overlaps within a chunk
+blockRows = 128
+
+_popTable = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+def popcount(bitmap):
+   '''Returns the number of set bits in a bitmap held as an array of bytes'''
+   return int(_popTable[bitmap].sum())
+
+def _toBitmap(offsets):
+   '''Packs an array of offsets within a chunk into a bitmap of chunkSize bits'''
+   dense = np.zeros(chunkSize, dtype=bool)
+   dense[offsets] = True
+   return np.packbits(dense)
+
+def _inBitmap(bitmap, offsets):
+   '''Returns a boolean array telling which offsets are set in a bitmap'''
+   return ((bitmap[offsets >> 3] >> (7 - (offsets & 7)).astype(np.uint8)) & 1).astype(bool)
+
+class CellSet(object):
+   '''Compact set of flat cell indices over a grid, split into chunks of chunkSize cells as in a roaring bitmap. keys holds the chunk numbers in order, and containers the matching contents of each chunk: a sorted array of 16-bit offsets, or a bitmap of bytes for chunks with more than arrayMax cells.'''
+   def __init__(self, keys, containers, size):
+      self.keys = keys
+      self.containers = containers
+      self.size = size
+
+   @classmethod
+   def fromCells(cls, cells):
+      '''Builds the set from an array of flat cell indices, in any order and with any repeats'''
+      cells = np.unique(np.asarray(cells, dtype=np.int64))
+      hi = cells >> chunkBits
+      lo = (cells & (chunkSize - 1)).astype(np.uint16)
+      bounds = np.nonzero(np.diff(hi))[0] + 1
+      keys = hi[np.concatenate([[0], bounds])] if len(cells) else np.zeros(0, dtype=np.int64)
+      containers = []
+      for offsets in np.split(lo, bounds) if len(cells) else []:
+         if len(offsets) > arrayMax:
+            containers.append(_toBitmap(offsets))
+         else:
+            containers.append(offsets)
+      return cls(keys, containers, len(cells))
+
+   def __len__(self):
+      return self.size
+
+   @property
+   def nbytes(self):
+      '''Memory held by the containers, in bytes'''
+      return self.keys.nbytes + sum(c.nbytes for c in self.containers)
+
+   def chunks(self):
+      '''Yields (chunk number, offsets) for every chunk, with offsets as an array of 16-bit integers'''
+      for key, c in zip(self.keys, self.containers):
+         if c.dtype == np.uint8:
+            yield int(key), np.nonzero(np.unpackbits(c))[0].astype(np.uint16)
+         else:
+            yield int(key), c
+
+   def cells(self):
+      '''Returns the flat cell indices in the set, in order'''
+      parts = [(np.int64(key) << chunkBits) + offsets.astype(np.int64) for key, offsets in self.chunks()]
+      return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+class Coverage(object):
+   '''The union of the cell sets added so far, held as a bitmap for every chunk touched'''
+   def __init__(self):
+      self.bitmaps = {}
+      self.size = 0
+
+   def uncovered(self, cellSet):
+      '''Returns the number of cells of cellSet not yet covered'''
+      count = 0
+      for key, c in zip(cellSet.keys, cellSet.containers):
+         bm = self.bitmaps.get(int(key))
+         if bm is None:
+            count += popcount(c) if c.dtype == np.uint8 else len(c)
+         elif c.dtype == np.uint8:
+            count += popcount(c & ~bm)
+         else:
+            count += len(c) - int(_inBitmap(bm, c).sum())
+      return count
+
+   def add(self, cellSet):
+      '''Adds the cells of cellSet to the coverage'''
+      for key, c in zip(cellSet.keys, cellSet.containers):
+         key = int(key)
+         if c.dtype != np.uint8:
+            c = _toBitmap(c)
+         if key in self.bitmaps:
+            self.size -= popcount(self.bitmaps[key])
+            self.bitmaps[key] = self.bitmaps[key] | c
+         else:
+            self.bitmaps[key] = c.copy()
+         self.size += popcount(self.bitmaps[key])
+
+class CoverageIndex(object):
+   '''Catchment cell sets of a list of SCUs, for overlap and coverage queries. cellArea converts cell counts to areas.'''
+   def __init__(self, ids, sets, cellArea = 1.0):
+      self.ids = list(ids)
+      self.sets = list(sets)
+      self.cellArea = float(cellArea)
+
+   @classmethod
+   def fromCellSets(cls, cellSets, cellArea = 1.0):
+      '''Builds the index from a dictionary of SCU ID -> flat cell indices'''
+      ids = list(cellSets.keys())
+      return cls(ids, [CellSet.fromCells(cellSets[i]) for i in ids], cellArea)
+
+   @classmethod
+   def fromPairs(cls, ids, cells, zones, cellArea = 1.0):
+      '''Builds the index from parallel arrays of cells and zone numbers (indices into ids), as held by a zonalFx.ZoneMembership'''
+      order = np.argsort(zones, kind='mergesort')
+      cells, zones = np.asarray(cells)[order], np.asarray(zones)[order]
+      bounds = np.searchsorted(zones, np.arange(len(ids) + 1))
+      return cls(ids, [CellSet.fromCells(cells[bounds[k]:bounds[k + 1]]) for k in range(len(ids))], cellArea)
+
+   def __len__(self):
+      return len(self.ids)
+
+   @property
+   def nbytes(self):
+      return sum(s.nbytes for s in self.sets)
+
+   def areas(self):
+      '''Returns the area of each catchment'''
+      return np.array([len(s) for s in self.sets], dtype=float) * self.cellArea
+
+   def overlaps(self):
+      '''Returns the overlap of every pair of catchments sharing cells, as parallel arrays of SCU positions i and j (i < j, indices into ids) and the number of cells they share.
+      Catchments are grouped by chunk. Within a chunk touched by several catchments, their cells are expanded, blockRows catchments at a time, to rows of a 0/1 matrix with one column per cell of the chunk that any of them covers, and the shared cells of every pair come from products of blocks of that matrix with their transposes. Only two blocks are expanded at any time, so chunks touched by very many catchments stay within memory.'''
+      byChunk = {}
+      for k, s in enumerate(self.sets):
+         for key, offsets in s.chunks():
+            byChunk.setdefault(key, []).append((k, offsets))
+      pairKeys, pairCounts = [], []
+      n = len(self.sets)
+      for key, members in byChunk.items():
+         if len(members) < 2:
+            continue
+         ks = np.array([m[0] for m in members], dtype=np.int64)
+         # Number the cells covered within the chunk, so that the matrix has no empty columns
+         used = np.unique(np.concatenate([m[1] for m in members]))
+         columns = [np.searchsorted(used, m[1]) for m in members]
+         def expand(b0):
+            dense = np.zeros((min(blockRows, len(members) - b0), len(used)), dtype=np.float32)
+            for row, cols in enumerate(columns[b0:b0 + blockRows]):
+               dense[row, cols] = 1.0
+            return dense
+         for a0 in range(0, len(members), blockRows):
+            denseA = expand(a0)
+            for b0 in range(a0, len(members), blockRows):
+               denseB = denseA if b0 == a0 else expand(b0)
+               shared = denseA.dot(denseB.T)
+               a, b = np.nonzero(shared)
+               keep = a + a0 < b + b0
+               a, b = a[keep], b[keep]
+               if len(a):
+                  pairKeys.append(ks[a + a0] * n + ks[b + b0])
+                  pairCounts.append(shared[a, b].astype(np.int64))
+      if not pairKeys:
+         return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+      # Sets are added to each chunk in order, so i < j already; sum the counts of each pair over chunks
+      keys, inv = np.unique(np.concatenate(pairKeys), return_inverse=True)
+      counts = np.bincount(inv, weights=np.concatenate(pairCounts)).astype(np.int64)
+      return keys // n, keys % n, counts
+
+   def overlapMatrix(self):
+      '''Returns the n x n matrix of cells shared by every pair of catchments, with the size of each catchment on the diagonal. Memory grows with the square of the number of SCUs; use overlaps for large sets.'''
+      n = len(self.sets)
+      mat = np.zeros((n, n), dtype=np.int64)
+      i, j, counts = self.overlaps()
+      mat[i, j] = counts
+      mat[j, i] = counts
+      mat[np.arange(n), np.arange(n)] = [len(s) for s in self.sets]
+      return mat
+
+   def greedy(self, budget = None, costs = None):
+      '''Chooses a portfolio of SCUs covering the most distinct cells, with total cost within budget. costs defaults to 1 for every SCU, making budget the number of SCUs to choose; without a budget, SCUs are added until nothing more can be covered.
+      At each step the SCU adding the most uncovered cells per unit cost is chosen. Candidates wait in a priority queue keyed by their last computed gain, which can only have shrunk since, so only the candidate at the top is re-evaluated, and it is chosen if its fresh gain still leads (lazy greedy). With costs, the single affordable SCU covering the most cells is chosen instead if it beats the whole greedy portfolio.
+      Returns the positions (indices into ids) of the chosen SCUs in the order chosen, and the area each one added.'''
+      n = len(self.sets)
+      costs = np.ones(n) if costs is None else np.asarray(costs, dtype=float)
+      budget = float('inf') if budget is None else float(budget)
+      # Queue entries are (-gain per unit cost, position, step at which the gain was computed)
+      queue = [(-len(s) / max(costs[k], 1e-12), k, 0) for k, s in enumerate(self.sets) if len(s) and costs[k] <= budget]
+      heapq.heapify(queue)
+      cover = Coverage()
+      picks, gains = [], []
+      spent = 0.0
+      while queue:
+         negRatio, k, step = heapq.heappop(queue)
+         if spent + costs[k] > budget:
+            continue
+         if step == len(picks):
+            # Gain is fresh: nothing has been chosen since it was computed
+            picks.append(k)
+            gains.append(cover.uncovered(self.sets[k]))
+            cover.add(self.sets[k])
+            spent += costs[k]
+            continue
+         gain = cover.uncovered(self.sets[k])
+         if gain:
+            heapq.heappush(queue, (-gain / max(costs[k], 1e-12), k, len(picks)))
+
+      # The ratio rule alone can do arbitrarily badly with costs, but not together with the best single choice
+      affordable = [k for k in range(n) if costs[k] <= budget]
+      if affordable:
+         best = max(affordable, key=lambda k: len(self.sets[k]))
+         if len(self.sets[best]) > sum(gains):
+            picks, gains = [best], [len(self.sets[best])]
+      return picks, np.array(gains, dtype=float) * self.cellArea
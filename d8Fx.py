@@ -0,0 +1,524 @@
+# ----------------------------------------------------------------------------------------
+# d8Fx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of NumPy functions for tracing flow over a D8 flow direction grid held in memory. Used as an in-process alternative to Spatial Analyst's Watershed tool for catchment delineation.
+
+# Usage Tips:
+# Flow direction codes follow the ESRI convention: 1=E, 2=SE, 4=S, 8=SW, 16=W, 32=NW, 64=N, 128=NE. Any other value (including NoData, read as 0) is treated as a sink.
+# Arrays are north-up with row 0 at the top, as returned by arcpy.RasterToNumPyArray. Cells are referenced by flat (row-major) index.
+# For repeated runs against the same flow direction raster, build an UpstreamIndex once and save it; later runs load it memory-mapped and answer upstream queries without reading or reversing the flow grid again.
+# For flow direction rasters too large to hold in memory, traceTiled walks upstream one tile at a time through a gridFx.TileCache, passing catchments on across tile boundaries.
+
+# Dependencies:
+# numpy 1.7 or later, as shipped with ArcGIS 10.3.1. Does not require arcpy, so these functions can be run and checked on machines without ArcGIS.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, json, math
+import numpy as np
+import gridFx
+
+# D8 codes, with the row and column offsets to the downstream neighbour for each
+d8Codes = (1, 2, 4, 8, 16, 32, 64, 128)
+d8RowOff = (0, 1, 1, 1, 0, -1, -1, -1)
+d8ColOff = (1, 1, 0, -1, -1, -1, 0, 1)
+
+def downstreamIndex(fdir):
+   '''Given a 2D D8 flow direction array, returns a flat array holding the flat index of each cell's downstream neighbour. Sinks, NoData cells, and cells flowing off the grid point to themselves.'''
+   nrows, ncols = fdir.shape
+   flat = fdir.ravel()
+   down = np.arange(nrows * ncols, dtype=np.int64)
+   for code, dr, dc in zip(d8Codes, d8RowOff, d8ColOff):
+      sel = np.nonzero(flat == code)[0]
+      if len(sel) == 0:
+         continue
+      r = sel // ncols + dr
+      c = sel % ncols + dc
+      ok = (r >= 0) & (r < nrows) & (c >= 0) & (c < ncols)
+      down[sel[ok]] = r[ok] * ncols + c[ok]
+   return down
+
+def resolveTerminals(down, stops = None):
+   '''Follows every cell downstream until it reaches a stop cell, a sink, or the grid edge, and returns the flat index of the cell where each path ends. All cells are resolved together by pointer jumping, so the number of passes grows only with the log of the longest flow path. Cells caught in a flow loop are given -1.'''
+   term = down.copy()
+   if stops is not None:
+      s = np.nonzero(stops)[0]
+      term[s] = s
+   maxPass = int(np.ceil(np.log2(max(len(term), 2)))) + 1
+   for i in range(maxPass):
+      nxt = term[term]
+      if np.array_equal(nxt, term):
+         break
+      term = nxt
+   looped = term[term] != term
+   if looped.any():
+      term[looped] = -1
+   return term
+
+def watershedLabels(fdir, src):
+   '''Labels every cell with the value of the first source cell it drains to, as the Spatial Analyst Watershed tool does for a source raster with several zones. Source cells keep their own value; cells that do not drain to a source get 0.'''
+   srcFlat = np.asarray(src).ravel()
+   term = resolveTerminals(downstreamIndex(fdir), srcFlat > 0)
+   lab = np.zeros(len(srcFlat), dtype=srcFlat.dtype)
+   ok = term >= 0
+   lab[ok] = srcFlat[term[ok]]
+   return lab.reshape(fdir.shape)
+
+def upstreamSets(fdir, sources, windows = None):
+   '''Returns a dictionary mapping each source ID to the sorted flat indices of its catchment, i.e. the source cells plus every cell draining to them. Each source is treated independently, exactly as if Watershed were run once per source: catchments may overlap and sources may share cells.
+
+   sources: dictionary of source ID -> flat indices of the source cells
+   windows: optional dictionary of source ID -> (row0, row1, col0, col1). If given, each catchment is limited to cells inside its window, and the search does not follow flow paths through other sources lying outside it, much as if the flow direction raster had been clipped to the window.
+
+   All sources are resolved in a single traversal of the grid. Every cell is first assigned to the nearest source cell downstream of it (its "zone"); the source cells then form a forest in which each source cell's parent is the next source cell downstream. A source's catchment is the union of the zones of its own cells and of all their descendants in that forest.'''
+   nrows, ncols = fdir.shape
+   n = nrows * ncols
+   down = downstreamIndex(fdir)
+
+   # Collect source cells, remembering which IDs each one belongs to
+   ids = list(sources.keys())
+   idCells = [np.unique(np.asarray(sources[i], dtype=np.int64)) for i in ids]
+   isSrc = np.zeros(n, dtype=bool)
+   for cells in idCells:
+      isSrc[cells] = True
+   srcCells = np.nonzero(isSrc)[0]
+   if len(srcCells) == 0:
+      return dict((i, np.zeros(0, dtype=np.int64)) for i in ids)
+
+   # One traversal: assign each cell to its zone (the first source cell downstream)
+   term = resolveTerminals(down, isSrc)
+   member = np.nonzero(term >= 0)[0]
+   member = member[isSrc[term[member]]]
+   zone = term[member]
+   order = np.argsort(zone, kind='mergesort')
+   member, zone = member[order], zone[order]
+   zStart = np.searchsorted(zone, srcCells, 'left')
+   zEnd = np.searchsorted(zone, srcCells, 'right')
+
+   # Source forest: the parent of a source cell is the zone its downstream neighbour belongs to
+   d0 = down[srcCells]
+   hasParent = d0 != srcCells
+   parentCell = np.where(hasParent, term[d0], -1)
+   hasParent &= parentCell >= 0
+   hasParent[hasParent] = isSrc[parentCell[hasParent]]
+   child = np.nonzero(hasParent)[0]
+   parent = np.searchsorted(srcCells, parentCell[child])
+   corder = np.argsort(parent, kind='mergesort')
+   child, parent = child[corder], parent[corder]
+   cStart = np.searchsorted(parent, np.arange(len(srcCells)), 'left')
+   cEnd = np.searchsorted(parent, np.arange(len(srcCells)), 'right')
+
+   result = {}
+   for i, cells in zip(ids, idCells):
+      win = windows.get(i) if windows else None
+      # Walk down the forest from this source's own cells
+      stack = list(np.searchsorted(srcCells, cells))
+      visited = set(stack)
+      pieces = []
+      while stack:
+         k = stack.pop()
+         pieces.append(member[zStart[k]:zEnd[k]])
+         for ch in child[cStart[k]:cEnd[k]]:
+            if ch in visited:
+               continue
+            if win is not None:
+               r, c = divmod(int(srcCells[ch]), ncols)
+               if not (win[0] <= r < win[1] and win[2] <= c < win[3]):
+                  continue
+            visited.add(ch)
+            stack.append(ch)
+      catch = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int64)
+      if win is not None:
+         r = catch // ncols
+         c = catch % ncols
+         catch = catch[(r >= win[0]) & (r < win[1]) & (c >= win[2]) & (c < win[3])]
+      catch.sort()
+      result[i] = catch
+   return result
+
+def flowLengthUpstream(fdir, srcCells, maxDist, cellSize, allowed = None):
+   '''Walks upstream from a set of source cells, measuring the flow length from each cell down to the first source cell it reaches, and stops as soon as that length passes maxDist (None for no limit). Returns the flat indices of the cells reached (sources included, at length 0) and their flow lengths, sorted by cell. Lengths are measured between cell centers, with diagonal steps counted as cellSize * sqrt(2), as in the FlowLength tool.
+   allowed: optional function taking an array of flat indices and returning a boolean array; the walk only enters cells for which it is True, as if the flow directions of all other cells were NoData (see gridFx.bufferTest)
+
+   Only cells within maxDist are ever visited, so the work grows with the size of the truncated catchment rather than with the size of the grid.'''
+   nrows, ncols = fdir.shape
+   flat = fdir.ravel()
+   srcCells = np.unique(np.asarray(srcCells, dtype=np.int64))
+   seen = np.zeros(nrows * ncols, dtype=bool)
+   seen[srcCells] = True
+   steps = [cellSize * np.hypot(dr, dc) for dr, dc in zip(d8RowOff, d8ColOff)]
+
+   cells = [srcCells]
+   dists = [np.zeros(len(srcCells))]
+   front, frontDist = srcCells, dists[0]
+   while len(front) > 0:
+      r = front // ncols
+      c = front % ncols
+      newCells, newDists = [], []
+      for code, dr, dc, step in zip(d8Codes, d8RowOff, d8ColOff, steps):
+         # A neighbour drains into a front cell if it lies one step against this direction and carries this code
+         ur = r - dr
+         uc = c - dc
+         ok = (ur >= 0) & (ur < nrows) & (uc >= 0) & (uc < ncols)
+         u = ur[ok] * ncols + uc[ok]
+         d = frontDist[ok] + step
+         ok = flat[u] == code
+         if maxDist is not None:
+            ok &= d <= maxDist
+         u, d = u[ok], d[ok]
+         ok = ~seen[u]
+         u, d = u[ok], d[ok]
+         seen[u] = True
+         newCells.append(u)
+         newDists.append(d)
+      front = np.concatenate(newCells)
+      frontDist = np.concatenate(newDists)
+      if allowed is not None and len(front):
+         ok = allowed(front)
+         front, frontDist = front[ok], frontDist[ok]
+      cells.append(front)
+      dists.append(frontDist)
+
+   cells = np.concatenate(cells)
+   dists = np.concatenate(dists)
+   order = np.argsort(cells)
+   return cells[order], dists[order]
+
+class UpstreamIndex(object):
+   '''Reversed D8 flow graph of a grid: for every cell, the cells draining directly into it, in compressed sparse row (CSR) form. The upstream neighbours of cell i are indices[indptr[i]:indptr[i + 1]]. Optionally holds the flow length from every cell down to its outlet (the sink or edge cell its flow path ends at; NaN for cells caught in flow loops).
+   Saved indexes are loaded memory-mapped, so only the parts touched by a query are read from disk.'''
+   version = 1
+   arrays = ('indptr', 'indices', 'outletDist')
+
+   def __init__(self, grid, indptr, indices, outletDist = None, fingerprint = None):
+      self.grid = grid
+      self.indptr = indptr
+      self.indices = indices
+      self.outletDist = outletDist
+      self.fingerprint = fingerprint
+
+   @classmethod
+   def build(cls, fdir, grid, withDist = False, fingerprint = None):
+      '''Builds the index from a flow direction array covering grid'''
+      down = downstreamIndex(fdir)
+      n = len(down)
+      # Indices fit in 32 bits for any grid of fewer than 2**31 cells, halving the size of the index
+      itype = np.int32 if n < 2**31 else np.int64
+      src = np.nonzero(down != np.arange(n))[0]
+      dst = down[src]
+      del down
+      indices = src[np.argsort(dst, kind='mergesort')].astype(itype)
+      indptr = np.zeros(n + 1, dtype=itype)
+      np.cumsum(np.bincount(dst, minlength=n), out=indptr[1:])
+      index = cls(grid, indptr, indices, None, fingerprint)
+      if withDist:
+         # Walk upstream from the outlets, one step at a time
+         outlets = np.setdiff1d(np.arange(n), src)
+         dist = np.empty(n, dtype=np.float32)
+         dist.fill(np.nan)
+         dist[outlets] = 0
+         front = outlets
+         while len(front):
+            up, pos = index._children(front)
+            dist[up] = dist[front[pos]] + index._stepLengths(up, front[pos])
+            front = up
+         index.outletDist = dist
+      return index
+
+   def _children(self, cells):
+      '''Returns the upstream neighbours of a set of cells, and for each, the position in cells of the cell it drains into'''
+      start = self.indptr[cells].astype(np.int64)
+      count = self.indptr[cells + 1].astype(np.int64) - start
+      total = int(count.sum())
+      if total == 0:
+         e = np.zeros(0, dtype=np.int64)
+         return e, e
+      offs = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+      return self.indices[np.repeat(start, count) + offs].astype(np.int64), np.repeat(np.arange(len(cells)), count)
+
+   def _stepLengths(self, cells, downCells):
+      ncols = self.grid.ncols
+      diag = (cells // ncols != downCells // ncols) & (cells % ncols != downCells % ncols)
+      return np.where(diag, self.grid.cellSize * np.sqrt(2.0), self.grid.cellSize)
+
+   def upstream(self, srcCells, maxDist = None, window = None, allowed = None):
+      '''Walks upstream from a set of source cells, as flowLengthUpstream does. Returns the flat indices of the cells reached (sources included, at length 0) and their flow lengths down to the first source cell reached, sorted by cell.
+      maxDist: if given, the walk stops once the flow length passes it
+      window: optional (row0, row1, col0, col1); the walk does not leave it, much as if the flow direction raster had been clipped to it
+      allowed: optional function of flat indices returning a boolean array; the walk only enters cells for which it is True (see flowLengthUpstream)'''
+      ncols = self.grid.ncols
+      srcCells = np.unique(np.asarray(srcCells, dtype=np.int64))
+      cells = [srcCells]
+      dists = [np.zeros(len(srcCells))]
+      front, frontDist = srcCells, dists[0]
+      while len(front):
+         up, pos = self._children(front)
+         d = frontDist[pos] + self._stepLengths(up, front[pos])
+         # Every cell has one downstream neighbour, so the walk can only come back to a cell that is itself a source
+         ok = np.ones(len(up), dtype=bool)
+         if len(srcCells):
+            k = np.minimum(np.searchsorted(srcCells, up), len(srcCells) - 1)
+            ok = srcCells[k] != up
+         if maxDist is not None:
+            ok &= d <= maxDist
+         if window is not None:
+            r, c = up // ncols, up % ncols
+            ok &= (r >= window[0]) & (r < window[1]) & (c >= window[2]) & (c < window[3])
+         front, frontDist = up[ok], d[ok]
+         if allowed is not None and len(front):
+            ok = allowed(front)
+            front, frontDist = front[ok], frontDist[ok]
+         cells.append(front)
+         dists.append(frontDist)
+      cells = np.concatenate(cells)
+      dists = np.concatenate(dists)
+      order = np.argsort(cells)
+      return cells[order], dists[order]
+
+   def save(self, folder):
+      '''Saves the index to a folder of .npy files, with its grid and fingerprint in index.json'''
+      if not os.path.isdir(folder):
+         os.makedirs(folder)
+      for name in self.arrays:
+         arr = getattr(self, name)
+         path = os.path.join(folder, name + '.npy')
+         if arr is not None:
+            np.save(path, arr)
+         elif os.path.exists(path):
+            os.remove(path)
+      g = self.grid
+      meta = {'version': self.version, 'fingerprint': self.fingerprint, 'xmin': g.xmin, 'ymax': g.ymax, 'cellSize': g.cellSize, 'nrows': g.nrows, 'ncols': g.ncols}
+      # The metadata is written last, so that an interrupted save is never taken for a complete index
+      tmp = os.path.join(folder, 'index.json.tmp')
+      with open(tmp, 'w') as f:
+         json.dump(meta, f)
+      if os.path.exists(os.path.join(folder, 'index.json')):
+         os.remove(os.path.join(folder, 'index.json'))
+      os.rename(tmp, os.path.join(folder, 'index.json'))
+
+   @classmethod
+   def load(cls, folder, fingerprint = None):
+      '''Loads a saved index, memory-mapped. Returns None if there is no complete index in folder, or if fingerprint is given and does not match the one the index was saved with.'''
+      try:
+         with open(os.path.join(folder, 'index.json')) as f:
+            meta = json.load(f)
+      except (IOError, OSError, ValueError):
+         return None
+      if meta.get('version') != cls.version:
+         return None
+      if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+         return None
+      grid = gridFx.GridSpec(meta['xmin'], meta['ymax'], meta['cellSize'], meta['nrows'], meta['ncols'])
+      arrs = {}
+      for name in cls.arrays:
+         path = os.path.join(folder, name + '.npy')
+         arrs[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+      return cls(grid, arrs['indptr'], arrs['indices'], arrs['outletDist'], meta.get('fingerprint'))
+
+def traceTiled(tileCache, sources, maxDist = None, windows = None, allowed = None):
+   '''Out-of-core upstream tracing for many sources at once, one tile of the flow direction grid at a time, so that memory is bounded by the tile cache rather than by the size of the grid. Gives the same result as UpstreamIndex.upstream for each source.
+
+   tileCache: gridFx.TileCache over the full flow direction grid. Its tiles are the processing tiles, and its memory limit bounds the flow directions held at once.
+   sources: dictionary of source ID -> flat indices (in the full grid) of the source cells
+   maxDist: if given, each walk stops once the flow length passes it
+   windows: optional dictionary of source ID -> (row0, row1, col0, col1); each walk does not leave its window, as if the flow direction raster had been clipped to it
+   allowed: optional dictionary of source ID -> function of flat indices (in the full grid) returning a boolean array; each walk only enters cells for which its function is True (see flowLengthUpstream)
+
+   Each tile is read with a halo of one cell. All sources with cells in a tile are walked upstream together within it, as (cell, source) pairs. Cells in the halo found to drain into a catchment are not followed further; they are passed, with their source label and flow length, to the tile holding them as inflow seeds, and the walk continues there. Tiles are processed until no seeds are left, so catchments crossing tile boundaries are stitched together exactly.
+
+   Returns a dictionary of source ID -> (flat indices of the cells reached, their flow lengths), sorted by cell.'''
+   grid = tileCache.grid
+   ts = tileCache.tileSize
+   nrows, ncols = grid.nrows, grid.ncols
+   n = nrows * ncols
+   ids = list(sources.keys())
+   steps = [grid.cellSize * np.hypot(dr, dc) for dr, dc in zip(d8RowOff, d8ColOff)]
+
+   # Source cells of every source, as sorted keys of (source, cell), so that walks can skip them
+   srcCells = [np.unique(np.asarray(sources[i], dtype=np.int64)) for i in ids]
+   srcKeys = np.sort(np.concatenate([k * n + c for k, c in enumerate(srcCells)] + [np.zeros(0, dtype=np.int64)]))
+   if windows:
+      win = np.array([windows.get(i, (0, nrows, 0, ncols)) for i in ids], dtype=np.int64).reshape(-1, 4)
+   else:
+      win = None
+   tests = [allowed.get(i) for i in ids] if allowed else []
+
+   # Seeds waiting in each tile, as (cells, source numbers, flow lengths); to start with, the source cells at length 0
+   pending = {}
+   def addSeeds(cells, labs, dists):
+      tiles = (cells // ncols // ts) * ((ncols - 1) // ts + 1) + (cells % ncols) // ts
+      order = np.argsort(tiles, kind='mergesort')
+      cells, labs, dists, tiles = cells[order], labs[order], dists[order], tiles[order]
+      bounds = np.nonzero(np.diff(tiles))[0] + 1
+      for c, l, d, t in zip(np.split(cells, bounds), np.split(labs, bounds), np.split(dists, bounds), np.split(tiles, bounds)):
+         if len(c):
+            pending.setdefault(int(t[0]), []).append((c, l, d))
+   addSeeds(np.concatenate(srcCells + [np.zeros(0, dtype=np.int64)]), np.concatenate([np.zeros(len(c), dtype=np.int64) + k for k, c in enumerate(srcCells)] + [np.zeros(0, dtype=np.int64)]), np.zeros(sum(len(c) for c in srcCells)))
+
+   outCells, outLabs, outDists = [], [], []
+   tilesPerRow = (ncols - 1) // ts + 1
+   while pending:
+      t = min(pending)
+      seeds = pending.pop(t)
+      r0, c0 = (t // tilesPerRow) * ts, (t % tilesPerRow) * ts
+      r1, c1 = min(r0 + ts, nrows), min(c0 + ts, ncols)
+      # Block holding the tile and its halo; parts off the grid read as NoData, which drains nowhere
+      block = tileCache.read(r0 - 1, r1 + 1, c0 - 1, c1 + 1)
+      flat = block.ravel()
+      bnc = block.shape[1]
+
+      cells = np.concatenate([s[0] for s in seeds])
+      labs = np.concatenate([s[1] for s in seeds])
+      dists = np.concatenate([s[2] for s in seeds])
+      outCells.append(cells)
+      outLabs.append(labs)
+      outDists.append(dists)
+      inflow = []
+      front = (cells // ncols - r0 + 1) * bnc + (cells % ncols - c0 + 1)
+      while len(front):
+         r = front // bnc
+         c = front % bnc
+         newCells, newLabs, newDists = [], [], []
+         for code, dr, dc, step in zip(d8Codes, d8RowOff, d8ColOff, steps):
+            # A neighbour drains into a front cell if it lies one step against this direction and carries this code
+            u = (r - dr) * bnc + (c - dc)
+            ok = flat[u] == code
+            u, l, d = u[ok], labs[ok], dists[ok] + step
+            ur, uc = u // bnc + r0 - 1, u % bnc + c0 - 1
+            ok = np.ones(len(u), dtype=bool)
+            if maxDist is not None:
+               ok &= d <= maxDist
+            if win is not None:
+               w = win[l]
+               ok &= (ur >= w[:,0]) & (ur < w[:,1]) & (uc >= w[:,2]) & (uc < w[:,3])
+            g = ur * ncols + uc
+            # Every cell has one downstream neighbour, so a walk can only come back to a cell that is one of its own sources
+            if len(srcKeys):
+               key = l * n + g
+               ok &= srcKeys[np.minimum(np.searchsorted(srcKeys, key), len(srcKeys) - 1)] != key
+            newCells.append(u[ok])
+            newLabs.append(l[ok])
+            newDists.append(d[ok])
+         front = np.concatenate(newCells)
+         labs = np.concatenate(newLabs)
+         dists = np.concatenate(newDists)
+         fr, fc = front // bnc, front % bnc
+         g = (fr + r0 - 1) * ncols + (fc + c0 - 1)
+         if any(tests) and len(front):
+            ok = np.ones(len(front), dtype=bool)
+            for k in np.unique(labs):
+               if tests[k] is not None:
+                  sel = np.nonzero(labs == k)[0]
+                  ok[sel] = tests[k](g[sel])
+            front, labs, dists, g, fr, fc = front[ok], labs[ok], dists[ok], g[ok], fr[ok], fc[ok]
+         if len(front) == 0:
+            break
+         # Cells in the halo belong to other tiles, and become their seeds
+         inTile = (fr >= 1) & (fr <= r1 - r0) & (fc >= 1) & (fc <= c1 - c0)
+         if not inTile.all():
+            out = ~inTile
+            inflow.append((g[out], labs[out], dists[out]))
+            front, labs, dists, g = front[inTile], labs[inTile], dists[inTile], g[inTile]
+         outCells.append(g)
+         outLabs.append(labs)
+         outDists.append(dists)
+      for c, l, d in inflow:
+         addSeeds(c, l, d)
+
+   # Gather the cells reached by each source
+   cells = np.concatenate(outCells) if outCells else np.zeros(0, dtype=np.int64)
+   labs = np.concatenate(outLabs) if outLabs else np.zeros(0, dtype=np.int64)
+   dists = np.concatenate(outDists) if outDists else np.zeros(0)
+   order = np.lexsort((cells, labs))
+   cells, labs, dists = cells[order], labs[order], dists[order]
+   bounds = np.searchsorted(labs, np.arange(len(ids) + 1))
+   return dict((i, (cells[bounds[k]:bounds[k + 1]], dists[bounds[k]:bounds[k + 1]])) for k, i in enumerate(ids))
+
+def traceCatchments(fdir, grid, featRings, searchDist, truncation = 'buffer', withLengths = False):
+   '''Delineates the catchments of a set of polygon features on a flow direction window. This is the in-memory engine behind the numpy backend of scuFX.delineatePolyCatchments.
+
+   fdir: flow direction array covering grid, which must extend at least searchDist, plus one cell, beyond every feature
+   featRings: dictionary of feature ID -> polygon rings, in the coordinates of grid
+   truncation: "buffer" traces each catchment within searchDist of its feature, as if the flow direction raster had been clipped to a buffer of the feature by searchDist (cells are kept by their centers, as Clip does); "flowdist" keeps only cells whose flow length down to the feature is within searchDist
+   withLengths: if True and truncation is "flowdist", the flow length of each cell is returned along with it, so that catchments for shorter distances can be cut from it (see nestedCatchments)
+
+   Each feature is traced on its own, on the part of fdir within searchDist of its extent, so the work and memory needed grow with the size of each feature's window rather than with the size of fdir.
+   Returns a dictionary of feature ID -> sorted flat indices of the catchment cells, or of feature ID -> (cells, flow lengths) if withLengths is set.'''
+   # All features are burned into one label grid, in a single pass
+   sources = gridFx.rasterizeLabels(featRings, grid).zoneCells()
+   result = {}
+   for myID, src in sources.items():
+      rings = featRings[myID]
+      rows, cols = grid.flatToRowCol(src)
+      if truncation == 'flowdist' and len(src):
+         # A flow length of searchDist moves at most that far along rows and columns from the source cells
+         reach = int(math.ceil(searchDist / grid.cellSize))
+         r0, r1 = max(rows.min() - reach, 0), min(rows.max() + reach + 1, grid.nrows)
+         c0, c1 = max(cols.min() - reach, 0), min(cols.max() + reach + 1, grid.ncols)
+      else:
+         e = gridFx.ringsExtent(rings)
+         r0, r1, c0, c1 = grid.window(e[0] - searchDist, e[1] - searchDist, e[2] + searchDist, e[3] + searchDist)
+         if len(src):
+            r0, r1 = min(r0, rows.min()), max(r1, rows.max() + 1)
+            c0, c1 = min(c0, cols.min()), max(c1, cols.max() + 1)
+      winGrid = grid.subGrid(r0, r1, c0, c1)
+      winSrc = (rows - r0) * winGrid.ncols + (cols - c0)
+      if truncation == 'flowdist':
+         # Flow length can never be shorter than straight-line distance, so the window holds every cell needed
+         cells, lengths = flowLengthUpstream(fdir[r0:r1, c0:c1], winSrc, searchDist, grid.cellSize)
+      else:
+         # Cells outside the buffer are made sinks, as clipping the flow direction raster to the buffer does, and the catchment is everything still draining to the feature
+         inBuffer = gridFx.bufferMask(rings, winGrid, searchDist)
+         cells = upstreamSets(np.where(inBuffer, fdir[r0:r1, c0:c1], 0), {myID: winSrc})[myID]
+      rows, cols = winGrid.flatToRowCol(cells)
+      cells = (rows + r0) * grid.ncols + (cols + c0)
+      if truncation == 'flowdist' and withLengths:
+         result[myID] = (cells, lengths)
+      else:
+         result[myID] = cells
+   return result
+
+def nestedCatchments(cells, lengths, maxDists):
+   '''Cuts a catchment traced by flow length out to the largest of maxDists (see flowLengthUpstream) into one catchment per distance in maxDists, holding the cells whose flow length is within that distance. A cell within a given flow length of the feature is reached by a path of no more than that length, all of whose cells are within it too, so each result is exactly what tracing to that distance would give, and each is nested within those for longer distances.
+
+   Returns a list of sorted flat index arrays, ordered as maxDists.'''
+   cells = np.asarray(cells)
+   lengths = np.asarray(lengths)
+   return [cells[lengths <= d] for d in maxDists]
+
+def finishCatchment(cells, grid, srcRings = None, clipDist = None, minFrac = 0.1):
+   '''Finishes a traced catchment in raster space, as an alternative to polygonizing it and running Clip, EliminatePolygonPart and Coalesce on the polygon.
+
+   cells: sorted flat indices of the catchment cells in grid
+   srcRings, clipDist: if given, cells whose centers lie more than clipDist from the source polygon are dropped, as clipping to a buffer of the polygon does. Cells with centers inside the polygon are always kept.
+   minFrac: parts smaller than this fraction of the catchment's outer area are removed, and holes smaller than it are filled (EliminatePolygonPart with PERCENT = 10 and ANY)
+
+   Returns the finished cells, and the number of parts left after a closing by one cell (the Coalesce check; more than one means the output is suspect).'''
+   cells = np.asarray(cells, dtype=np.int64)
+   if len(cells) == 0:
+      return cells, 0
+   if srcRings is not None and clipDist is not None:
+      rows, cols = grid.flatToRowCol(cells)
+      xs = grid.xmin + (cols + 0.5) * grid.cellSize
+      ys = grid.ymax - (rows + 0.5) * grid.cellSize
+      srcCells = gridFx.rasterizeRings(srcRings, grid, False)
+      pos = np.minimum(np.searchsorted(srcCells, cells), max(len(srcCells) - 1, 0))
+      inside = srcCells[pos] == cells if len(srcCells) else np.zeros(len(cells), dtype=bool)
+      cells = cells[inside | (gridFx.distanceToRings(xs, ys, srcRings) <= clipDist)]
+      if len(cells) == 0:
+         return cells, 0
+
+   # Work in the window holding the catchment
+   rows, cols = grid.flatToRowCol(cells)
+   r0, c0 = rows.min(), cols.min()
+   mask = np.zeros((rows.max() - r0 + 1, cols.max() - c0 + 1), dtype=bool)
+   mask[rows - r0, cols - c0] = True
+
+   mask = gridFx.eliminateParts(mask, minFrac)
+   numParts = gridFx.labelComponents(gridFx.close(mask), 8)[1]
+   wr, wc = np.nonzero(mask)
+   return np.sort((wr + r0) * grid.ncols + (wc + c0)), numParts
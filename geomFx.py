@@ -0,0 +1,210 @@
+# ----------------------------------------------------------------------------------------
+# geomFx.py
+# Version:  ArcGIS Pro / Python 3
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of in-memory geometry functions that operate on whole arrays of polygons at once, as an alternative to running a chain of geoprocessing tools (each writing a scratch dataset) once per feature.
+
+# Usage Tips:
+# Functions take and return NumPy arrays of shapely geometries, usually with a parallel array of group numbers saying which input feature each geometry came from. Use fromWKB/toWKB to move geometries to and from arcpy (Geometry.WKB and arcpy.FromWKB).
+# Distances are in the units of the coordinate system, and buffers are planar with round ends, as in the Coalesce tool.
+
+# Dependencies:
+# numpy and shapely 2.0 or later (ArcGIS Pro / Python 3). Does not require arcpy. The module imports without shapely, but its functions will raise ImportError.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import numpy as np
+try:
+   import shapely
+   if int(shapely.__version__.split('.')[0]) < 2:
+      shapely = None
+except ImportError:
+   shapely = None
+
+def requireShapely():
+   '''Raises ImportError if shapely 2 is not available'''
+   if shapely is None:
+      raise ImportError('The shapely geometry backend requires shapely 2.0 or later')
+
+def fromWKB(wkbList):
+   '''Converts a list of WKB byte strings (e.g. Geometry.WKB from arcpy) to an array of shapely geometries. None stays None.'''
+   requireShapely()
+   return shapely.from_wkb(np.array([None if w is None else bytes(w) for w in wkbList], dtype=object))
+
+def toWKB(geoms):
+   '''Converts an array of shapely geometries to a list of WKB byte strings'''
+   requireShapely()
+   return list(shapely.to_wkb(geoms))
+
+class RepairStats(object):
+   '''Counts of what geometry repair did: features read, repaired (invalid on input), exploded (multipart on input), dropped (null, empty, or collapsed by repair), and single-part features written'''
+   def __init__(self):
+      self.read = 0
+      self.repaired = 0
+      self.exploded = 0
+      self.dropped = 0
+      self.written = 0
+
+   def __str__(self):
+      return '%s features read, %s repaired, %s exploded, %s dropped, %s written' % (self.read, self.repaired, self.exploded, self.dropped, self.written)
+
+def repairArray(geoms, stats = None):
+   '''Makes every geometry valid and drops empty or null geometries. Returns the repaired geometries and the indices of the inputs they came from. If a RepairStats is given, its counts are updated.'''
+   requireShapely()
+   geoms = np.asarray(geoms, dtype=object)
+   keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+   idx = np.nonzero(keep)[0]
+   geoms = geoms[idx]
+   invalid = ~shapely.is_valid(geoms)
+   fixed = geoms.copy()
+   fixed[invalid] = shapely.make_valid(geoms[invalid])
+   # make_valid can return collections holding lines or points alongside the polygons; keep only the polygonal parts
+   fixed = shapely.buffer(fixed, 0)
+   ok = ~shapely.is_empty(fixed)
+   if stats is not None:
+      stats.read += len(keep)
+      stats.repaired += int(invalid.sum())
+      stats.dropped += len(keep) - int(ok.sum())
+   return fixed[ok], idx[ok]
+
+def explodeArray(geoms, groups = None):
+   '''Splits multipart geometries into single parts. Returns the parts and, for each part, the group of the geometry it came from (or the index of that geometry if no groups are given).'''
+   requireShapely()
+   parts, idx = shapely.get_parts(np.asarray(geoms, dtype=object), return_index=True)
+   if groups is not None:
+      idx = np.asarray(groups)[idx]
+   return parts, idx
+
+def dissolveGroups(geoms, groups, numGroups = None):
+   '''Unions the geometries of each group. Returns one geometry per group, ordered by group number; groups with no geometry get None.'''
+   requireShapely()
+   geoms = np.asarray(geoms, dtype=object)
+   groups = np.asarray(groups)
+   if numGroups is None:
+      numGroups = int(groups.max()) + 1 if len(groups) else 0
+   out = np.empty(numGroups, dtype=object)
+   counts = np.bincount(groups, minlength=numGroups)
+   # Groups with a single member need no union
+   single = np.nonzero(counts[groups] == 1)[0]
+   out[groups[single]] = geoms[single]
+   multi = np.nonzero(counts > 1)[0]
+   if len(multi):
+      order = np.argsort(groups, kind='mergesort')
+      sortedGroups = groups[order]
+      for g in multi:
+         a, b = np.searchsorted(sortedGroups, [g, g + 1])
+         out[g] = shapely.union_all(geoms[order[a:b]])
+   return out
+
+def coalesceArray(geoms, groups, dilDist, simplifyTol = 0.1):
+   '''Coalesces polygons, group by group, in one pass over the whole array. Equivalent to running libConSiteFx.Coalesce on each group: for a positive dilation distance, each group is buffered outward and dissolved, cleaned, simplified, then buffered back inward; for a negative distance, features are shrunk first, then expanded and dissolved.
+   Returns the resulting single-part polygons and the group each belongs to. Counting parts per group (np.bincount) gives the number of features Coalesce would output.'''
+   requireShapely()
+   if dilDist == 0:
+      raise ValueError('You need to enter a non-zero value for the dilation distance')
+   geoms = np.asarray(geoms, dtype=object)
+   groups = np.asarray(groups)
+   numGroups = int(groups.max()) + 1 if len(groups) else 0
+
+   # Buffer out (or in), dissolving each group when expanding
+   buff1 = shapely.buffer(geoms, dilDist)
+   if dilDist > 0:
+      buff1 = dissolveGroups(buff1, groups, numGroups)
+      groups1 = np.arange(numGroups)
+   else:
+      groups1 = groups
+
+   # Clean, explode and simplify
+   buff1, idx = repairArray(buff1)
+   parts, partGroups = explodeArray(buff1, groups1[idx])
+   parts = shapely.simplify(parts, simplifyTol)
+
+   # Buffer back, dissolving each group when that was not done on the way out
+   buff2 = shapely.buffer(parts, -dilDist)
+   if dilDist < 0:
+      buff2 = dissolveGroups(buff2, partGroups, numGroups)
+      partGroups = np.arange(numGroups)
+
+   # Clean and explode to get the final features
+   buff2, idx = repairArray(buff2)
+   return explodeArray(buff2, partGroups[idx])
+
+def repairStream(rows, stats = None, chunkSize = 1024):
+   '''Repairs and explodes a stream of features in one pass. rows is any iterable of (geometry, attributes) pairs, the geometry as WKB bytes, a shapely geometry, or None. Yields a (polygon, attributes) pair for every valid single part, so that features can be written as they are produced. Features are processed in chunks of chunkSize, and nothing is retried: a feature either repairs to a polygon or is dropped and counted. If a RepairStats is given, its counts are updated as the stream is consumed.'''
+   requireShapely()
+   if stats is None:
+      stats = RepairStats()
+   chunk = []
+   for row in rows:
+      chunk.append(row)
+      if len(chunk) >= chunkSize:
+         for out in _repairChunk(chunk, stats):
+            yield out
+         chunk = []
+   for out in _repairChunk(chunk, stats):
+      yield out
+
+def _repairChunk(chunk, stats):
+   if not chunk:
+      return []
+   geoms = np.empty(len(chunk), dtype=object)
+   geoms[:] = [g for g, attrs in chunk]
+   isWKB = np.array([isinstance(g, (bytes, bytearray, memoryview)) for g in geoms], dtype=bool)
+   if isWKB.any():
+      geoms[isWKB] = fromWKB(geoms[isWKB])
+   fixed, idx = repairArray(geoms, stats)
+   parts, partIdx = explodeArray(fixed, idx)
+   stats.exploded += int((np.bincount(partIdx, minlength=len(chunk)) > 1).sum())
+   stats.written += len(parts)
+   return [(p, chunk[i][1]) for p, i in zip(parts, partIdx)]
+
+def fillHoles(geoms):
+   '''Removes the holes from an array of single-part polygons'''
+   requireShapely()
+   return shapely.polygons(shapely.get_exterior_ring(geoms))
+
+def intersectingPairs(queryGeoms, geoms):
+   '''Finds every pair of intersecting geometries between two arrays, using a spatial index bulk-loaded once over geoms: candidates by bounding box, then an exact intersects test. Returns parallel arrays of indices into queryGeoms and geoms.'''
+   requireShapely()
+   tree = shapely.STRtree(np.asarray(geoms, dtype=object))
+   pairs = tree.query(np.asarray(queryGeoms, dtype=object), predicate='intersects')
+   return pairs[0], pairs[1]
+
+def shrinkWrapArray(geoms, dilDist, smthDist, simplifyTol = 0.1, report = None):
+   '''Equivalent to libConSiteFx.ShrinkWrap, on the whole array at once. Features are cleaned and dissolved; the dissolved features within dilDist of each other are grouped; each group is coalesced by smthDist, and its gaps are filled. Returns the resulting single-part polygons.
+   report: optional function taking a progress message, such as arcpy.AddMessage, called as each step starts'''
+   requireShapely()
+   if dilDist <= 0:
+      raise ValueError('You need to enter a positive, non-zero value for the dilation distance')
+   report = report or (lambda msg: None)
+
+   # Clean, then dissolve adjacent features into single parts and simplify
+   report('Cleaning %s input features...' % len(geoms))
+   geoms, idx = repairArray(geoms)
+   parts, idx = explodeArray(geoms)
+   report('Dissolving adjacent features...')
+   dissFeats, idx = explodeArray([shapely.union_all(parts)])
+   report('Simplifying features...')
+   dissFeats = shapely.simplify(dissFeats, simplifyTol)
+
+   # Buffer and dissolve; each part of the result is one wrap
+   report('Buffering features...')
+   wraps, idx = explodeArray([shapely.union_all(shapely.buffer(dissFeats, dilDist))])
+   report('There are %s features after consolidation' % len(wraps))
+
+   # Group the dissolved features by the wrap they fall in
+   wrapIdx, dissIdx = intersectingPairs(wraps, dissFeats)
+   if len(dissIdx) == 0:
+      return np.empty(0, dtype=object)
+
+   # Coalesce each group, fill its gaps, and dissolve what overlaps
+   report('Coalescing %s dissolved features in %s groups...' % (len(dissIdx), len(wraps)))
+   coalFeats, groups = coalesceArray(dissFeats[dissIdx], wrapIdx, smthDist, simplifyTol)
+   report('Filling gaps...')
+   filled = dissolveGroups(fillHoles(coalFeats), groups, len(wraps))
+   filled, idx = repairArray(filled)
+   parts, idx = explodeArray(filled)
+   return parts
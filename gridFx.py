@@ -0,0 +1,696 @@
+# ----------------------------------------------------------------------------------------
+# gridFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of NumPy functions for moving between vector features and in-memory grids: describing grid windows, burning polygons into cells, and tracing cells back out to polygon rings.
+
+# Usage Tips:
+# Grids are north-up, with row 0 at the top, as returned by arcpy.RasterToNumPyArray. Cells are referenced by flat (row-major) index within a grid.
+# Polygons are passed around as lists of rings, each ring a sequence of (x, y) tuples. Outer rings are clockwise and holes counterclockwise, as in ArcGIS.
+
+# Dependencies:
+# numpy 1.7 or later, as shipped with ArcGIS 10.3.1. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import math, collections, threading
+import numpy as np
+
+class GridSpec(object):
+   '''Describes the georeferencing of a north-up grid: upper left corner, cell size, and number of rows and columns'''
+   def __init__(self, xmin, ymax, cellSize, nrows, ncols):
+      self.xmin = float(xmin)
+      self.ymax = float(ymax)
+      self.cellSize = float(cellSize)
+      self.nrows = int(nrows)
+      self.ncols = int(ncols)
+
+   def __repr__(self):
+      return 'GridSpec(%s, %s, %s, %s, %s)' % (self.xmin, self.ymax, self.cellSize, self.nrows, self.ncols)
+
+   @property
+   def shape(self):
+      return (self.nrows, self.ncols)
+
+   @property
+   def xmax(self):
+      return self.xmin + self.ncols * self.cellSize
+
+   @property
+   def ymin(self):
+      return self.ymax - self.nrows * self.cellSize
+
+   def window(self, xmin, ymin, xmax, ymax):
+      '''Returns the (row0, row1, col0, col1) window of cells touching the given extent, snapped outward to cell edges and limited to the grid'''
+      cs = self.cellSize
+      c0 = int(math.floor((xmin - self.xmin) / cs))
+      c1 = int(math.ceil((xmax - self.xmin) / cs))
+      r0 = int(math.floor((self.ymax - ymax) / cs))
+      r1 = int(math.ceil((self.ymax - ymin) / cs))
+      c0, c1 = max(c0, 0), min(c1, self.ncols)
+      r0, r1 = max(r0, 0), min(r1, self.nrows)
+      return (r0, max(r1, r0), c0, max(c1, c0))
+
+   def subGrid(self, r0, r1, c0, c1):
+      '''Returns the GridSpec of a window of this grid'''
+      cs = self.cellSize
+      return GridSpec(self.xmin + c0 * cs, self.ymax - r0 * cs, cs, r1 - r0, c1 - c0)
+
+   def flatToRowCol(self, cells):
+      '''Converts flat cell indices to row and column arrays'''
+      cells = np.asarray(cells, dtype=np.int64)
+      return cells // self.ncols, cells % self.ncols
+
+def ringsExtent(rings):
+   '''Returns the (xmin, ymin, xmax, ymax) extent of a list of rings'''
+   xy = np.concatenate([np.asarray(r, dtype=float).reshape(-1, 2) for r in rings])
+   return (xy[:,0].min(), xy[:,1].min(), xy[:,0].max(), xy[:,1].max())
+
+def ringArea(ring):
+   '''Returns the signed area of a ring; negative for clockwise rings'''
+   xy = np.asarray(ring, dtype=float).reshape(-1, 2)
+   x, y = xy[:,0], xy[:,1]
+   return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+def _ringEdges(rings):
+   '''Stacks the edges of all rings into arrays of start and end coordinates'''
+   x0, y0, x1, y1 = [], [], [], []
+   for r in rings:
+      xy = np.asarray(r, dtype=float).reshape(-1, 2)
+      if len(xy) < 2:
+         continue
+      if xy[0,0] != xy[-1,0] or xy[0,1] != xy[-1,1]:
+         xy = np.vstack([xy, xy[:1]])
+      x0.append(xy[:-1,0]); y0.append(xy[:-1,1])
+      x1.append(xy[1:,0]); y1.append(xy[1:,1])
+   if not x0:
+      e = np.zeros(0)
+      return e, e, e, e
+   return np.concatenate(x0), np.concatenate(y0), np.concatenate(x1), np.concatenate(y1)
+
+def rasterizeRings(rings, grid, allTouched = True):
+   '''Returns the sorted flat indices of grid cells covered by a polygon given as a list of rings. Cells whose centers fall inside the polygon (even-odd rule) are always included. If allTouched is True, cells crossed by the polygon boundary are also included, matching the MAXIMUM_COMBINED_AREA rule of PolygonToRaster for a lone feature.'''
+   x0, y0, x1, y1 = _ringEdges(rings)
+   return _rasterizeEdges(x0, y0, x1, y1, np.zeros(len(x0), dtype=np.int64), grid, allTouched)[0]
+
+def _rasterizeEdges(x0, y0, x1, y1, feat, grid, allTouched):
+   '''Burns the polygons formed by a set of edges, each tagged with the number of the feature it belongs to, into a grid. Returns the unique (cell, feature) pairs covered, as two arrays sorted by cell.'''
+   cs = grid.cellSize
+   cellParts, featParts = [], []
+
+   # Scanline fill of cell centers. Each non-horizontal edge crosses the row centers in a half-open y range.
+   # Row r has its center at y = ymax - (r + 0.5) * cs
+   lo = np.minimum(y0, y1)
+   hi = np.maximum(y0, y1)
+   rFirst = np.ceil((grid.ymax - hi) / cs - 0.5).astype(np.int64)
+   rLast = np.ceil((grid.ymax - lo) / cs - 0.5).astype(np.int64) - 1
+   rFirst = np.maximum(rFirst, 0)
+   rLast = np.minimum(rLast, grid.nrows - 1)
+   nCross = np.maximum(rLast - rFirst + 1, 0)
+   nCross[y0 == y1] = 0
+   if nCross.sum() > 0:
+      e = np.repeat(np.arange(len(x0)), nCross)
+      offs = np.arange(nCross.sum()) - np.repeat(np.cumsum(nCross) - nCross, nCross)
+      rows = rFirst[e] + offs
+      yc = grid.ymax - (rows + 0.5) * cs
+      xc = x0[e] + (yc - y0[e]) * (x1[e] - x0[e]) / (y1[e] - y0[e])
+      order = np.lexsort((xc, rows, feat[e]))
+      rows, xc, fc = rows[order], xc[order], feat[e][order]
+      # Crossings pair up along each row of each feature; columns whose centers lie in [xa, xb) are inside
+      rows, fc = rows[0::2], fc[0::2]
+      xa, xb = xc[0::2], xc[1::2]
+      ca = np.ceil((xa - grid.xmin) / cs - 0.5).astype(np.int64)
+      cb = np.ceil((xb - grid.xmin) / cs - 0.5).astype(np.int64)
+      ca = np.maximum(ca, 0)
+      cb = np.minimum(cb, grid.ncols)
+      n = np.maximum(cb - ca, 0)
+      if n.sum() > 0:
+         start = np.repeat(rows * grid.ncols + ca, n)
+         offs = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+         cellParts.append(start + offs)
+         featParts.append(np.repeat(fc, n))
+
+   # Boundary cells, found by sampling every edge at a quarter of the cell size
+   if allTouched and len(x0) > 0:
+      length = np.hypot(x1 - x0, y1 - y0)
+      nStep = np.ceil(length / (0.25 * cs)).astype(np.int64) + 1
+      e = np.repeat(np.arange(len(x0)), nStep)
+      offs = np.arange(nStep.sum()) - np.repeat(np.cumsum(nStep) - nStep, nStep)
+      f = offs / np.maximum(nStep[e] - 1, 1).astype(float)
+      xs = x0[e] + f * (x1[e] - x0[e])
+      ys = y0[e] + f * (y1[e] - y0[e])
+      cols = np.floor((xs - grid.xmin) / cs).astype(np.int64)
+      rows = np.floor((grid.ymax - ys) / cs).astype(np.int64)
+      ok = (rows >= 0) & (rows < grid.nrows) & (cols >= 0) & (cols < grid.ncols)
+      cellParts.append(rows[ok] * grid.ncols + cols[ok])
+      featParts.append(feat[e][ok])
+
+   if not cellParts:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+   # Drop duplicate pairs, leaving them sorted by cell, then feature
+   cells = np.concatenate(cellParts)
+   feats = np.concatenate(featParts).astype(np.int64)
+   m = int(feats.max()) + 1
+   key = np.unique(cells * m + feats)
+   return key // m, key % m
+
+def rasterizeLabels(featRings, grid, allTouched = True):
+   '''Burns a set of polygons into one label grid in a single pass, instead of rasterizing them one at a time. featRings is a dictionary of feature ID -> list of rings; cells are assigned as in rasterizeRings. Returns a LabelGrid.'''
+   ids = list(featRings.keys())
+   if not ids:
+      return LabelGrid(grid, [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+   edges = []
+   for i, myID in enumerate(ids):
+      x0, y0, x1, y1 = _ringEdges(featRings[myID])
+      edges.append((x0, y0, x1, y1, np.zeros(len(x0), dtype=np.int64) + i))
+   x0, y0, x1, y1, feat = [np.concatenate(col) for col in zip(*edges)]
+   cells, zones = _rasterizeEdges(x0, y0, x1, y1, feat, grid, allTouched)
+   return LabelGrid(grid, ids, cells, zones)
+
+class LabelGrid(object):
+   '''Sparse label grid of features burned into a grid. Each covered cell holds a label: the number of the one feature covering it (an index into ids), or -1 if several features cover it. Cells covered by several features are listed in a compact side table (overlapCells, with the features of overlapCells[i] in overlapZones[overlapStart[i]:overlapStart[i + 1]]).'''
+   def __init__(self, grid, ids, cells, zones):
+      '''Builds the label grid from (cell, feature number) pairs, sorted by cell'''
+      self.grid = grid
+      self.ids = list(ids)
+      cells = np.asarray(cells, dtype=np.int64)
+      zones = np.asarray(zones, dtype=np.int64)
+      # Runs of equal cells, found from the sorted cells directly
+      first = np.concatenate([[0], np.nonzero(np.diff(cells))[0] + 1]).astype(np.int64) if len(cells) else np.zeros(0, dtype=np.int64)
+      counts = np.diff(np.append(first, len(cells)))
+      self.cells = cells[first]
+      self.labels = zones[first].astype(np.int32)
+      multi = counts > 1
+      self.labels[multi] = -1
+      self.overlapCells = self.cells[multi]
+      inOverlap = np.repeat(multi, counts)
+      self.overlapZones = zones[inOverlap].astype(np.int32)
+      self.overlapStart = np.concatenate([[0], np.cumsum(counts[multi])]).astype(np.int64)
+
+   def __len__(self):
+      return len(self.cells)
+
+   def pairs(self):
+      '''Returns every (cell, feature number) membership as two arrays sorted by cell'''
+      single = self.labels >= 0
+      counts = np.diff(self.overlapStart)
+      cells = np.concatenate([self.cells[single], np.repeat(self.overlapCells, counts)])
+      zones = np.concatenate([self.labels[single], self.overlapZones]).astype(np.int64)
+      order = np.lexsort((zones, cells))
+      return cells[order], zones[order]
+
+   def zoneCells(self):
+      '''Returns a dictionary of feature ID -> sorted flat indices of the cells it covers'''
+      cells, zones = self.pairs()
+      order = np.argsort(zones, kind='mergesort')
+      cells, zones = cells[order], zones[order]
+      bounds = np.searchsorted(zones, np.arange(len(self.ids) + 1))
+      return dict((myID, cells[bounds[i]:bounds[i + 1]]) for i, myID in enumerate(self.ids))
+
+   def array(self, r0 = 0, r1 = None, c0 = 0, c1 = None):
+      '''Returns a dense window of the label grid, holding feature number + 1 (0 where no feature, -1 where several overlap)'''
+      r1 = self.grid.nrows if r1 is None else r1
+      c1 = self.grid.ncols if c1 is None else c1
+      out = np.zeros((r1 - r0, c1 - c0), dtype=np.int32)
+      rows, cols = self.grid.flatToRowCol(self.cells)
+      ok = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+      lab = self.labels[ok]
+      out[rows[ok] - r0, cols[ok] - c0] = np.where(lab >= 0, lab + 1, -1)
+      return out
+
+def _traceEdges(mask):
+   '''Traces the boundary of the True cells of a 2D mask into closed rings of (row, col) corner coordinates. Outer rings run clockwise on the map and holes counterclockwise. Cells touching only at a corner are kept in separate rings.'''
+   nrows, ncols = mask.shape
+   p = np.zeros((nrows + 2, ncols + 2), dtype=bool)
+   p[1:-1,1:-1] = mask
+   inner = p[1:-1,1:-1]
+   W = ncols + 1 # number of corner columns
+
+   # Directed unit edges with the filled cell on the right-hand side. Direction codes: 0=east, 1=south, 2=west, 3=north
+   sr, sc, dr = [], [], []
+   r, c = np.nonzero(inner & ~p[:-2,1:-1]) # top edges, heading east
+   sr.append(r); sc.append(c); dr.append(np.zeros(len(r), dtype=np.int8))
+   r, c = np.nonzero(inner & ~p[1:-1,2:]) # right edges, heading south
+   sr.append(r); sc.append(c + 1); dr.append(np.ones(len(r), dtype=np.int8))
+   r, c = np.nonzero(inner & ~p[2:,1:-1]) # bottom edges, heading west
+   sr.append(r + 1); sc.append(c + 1); dr.append(np.zeros(len(r), dtype=np.int8) + 2)
+   r, c = np.nonzero(inner & ~p[1:-1,:-2]) # left edges, heading north
+   sr.append(r + 1); sc.append(c); dr.append(np.zeros(len(r), dtype=np.int8) + 3)
+   sr = np.concatenate(sr).astype(np.int64)
+   sc = np.concatenate(sc).astype(np.int64)
+   dr = np.concatenate(dr)
+   if len(sr) == 0:
+      return []
+   stepR = np.array([0, 1, 0, -1])[dr]
+   stepC = np.array([1, 0, -1, 0])[dr]
+   startKey = sr * W + sc
+   endKey = (sr + stepR) * W + (sc + stepC)
+
+   # Link each edge to the edge leaving its end corner. At corners shared by two diagonal cells there are two candidates;
+   # taking the right turn keeps the diagonal cells apart.
+   order = np.argsort(startKey * 4 + dr, kind='mergesort')
+   keys = startKey[order]
+   first = np.searchsorted(keys, endKey, 'left')
+   count = np.searchsorted(keys, endKey, 'right') - first
+   nxt = order[np.minimum(first, len(order) - 1)]
+   pinch = np.nonzero(count == 2)[0]
+   if len(pinch):
+      rightTurn = (dr[pinch] + 1) % 4
+      a = order[first[pinch]]
+      b = order[first[pinch] + 1]
+      nxt[pinch] = np.where(dr[a] == rightTurn, a, b)
+
+   # Walk the cycles, keeping only the corners where the direction changes
+   rings = []
+   seen = np.zeros(len(sr), dtype=bool)
+   for e0 in range(len(sr)):
+      if seen[e0]:
+         continue
+      ring = []
+      e = e0
+      while not seen[e]:
+         seen[e] = True
+         n = nxt[e]
+         if dr[n] != dr[e]:
+            ring.append((sr[n], sc[n]))
+         e = n
+      ring.append(ring[0])
+      rings.append(ring)
+   return rings
+
+def cellsToRegions(cells, grid):
+   '''Traces a set of cells (flat indices into grid) out to polygons. Returns a list of regions, one per group of edge-connected cells, in the order their first cells are met scanning the grid. Each region is a list of rings in map coordinates, the outer ring first followed by any holes.'''
+   cells = np.asarray(cells, dtype=np.int64)
+   if len(cells) == 0:
+      return []
+   rows, cols = grid.flatToRowCol(cells)
+   r0, c0 = rows.min(), cols.min()
+   mask = np.zeros((rows.max() - r0 + 1, cols.max() - c0 + 1), dtype=bool)
+   mask[rows - r0, cols - c0] = True
+   cs = grid.cellSize
+   x0 = grid.xmin + c0 * cs
+   y0 = grid.ymax - r0 * cs
+
+   outers, holes = [], []
+   for ring in _traceEdges(mask):
+      xy = [(x0 + c * cs, y0 - r * cs) for (r, c) in ring]
+      # The top-left corner of each outer ring is the top-left corner of its first cell in scan order
+      key = min(ring)
+      if ringArea(xy) < 0:
+         outers.append((key, xy))
+      else:
+         holes.append(xy)
+   outers.sort(key=lambda o: o[0])
+   regions = [[xy] for key, xy in outers]
+
+   # Assign each hole to the smallest outer ring containing it, testing a point just inside the hole
+   if holes:
+      areas = [abs(ringArea(reg[0])) for reg in regions]
+      for h in holes:
+         (xa, ya), (xb, yb) = h[0], h[1]
+         d = math.hypot(xb - xa, yb - ya)
+         px = 0.5 * (xa + xb) - 0.25 * cs * (yb - ya) / d
+         py = 0.5 * (ya + yb) + 0.25 * cs * (xb - xa) / d
+         best = None
+         for i, reg in enumerate(regions):
+            if _pointInRing(px, py, reg[0]) and (best is None or areas[i] < areas[best]):
+               best = i
+         if best is not None:
+            regions[best].append(h)
+   return regions
+
+def _pointInRing(x, y, ring):
+   '''Even-odd test of a point against a single ring'''
+   xy = np.asarray(ring, dtype=float)
+   xa, ya = xy[:-1,0], xy[:-1,1]
+   xb, yb = xy[1:,0], xy[1:,1]
+   cross = (ya > y) != (yb > y)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      xi = xa + (y - ya) * (xb - xa) / (yb - ya)
+   return bool(np.count_nonzero(cross & (x < xi)) % 2)
+
+class TileCache(object):
+   '''Serves windows of a large grid from fixed-size square tiles, which are read on demand and kept in a least-recently-used cache of bounded size. Neighbouring windows share tiles, so after the first read most of a window usually comes from memory.
+
+   readTile: function (row0, row1, col0, col1) -> 2D array, reading that block of the grid from its source
+   grid: GridSpec of the full grid
+   tileSize: number of rows and columns per tile
+   maxBytes: upper limit on the memory held by cached tiles
+   nodata: value used for parts of a window falling outside the grid
+   dtype: data type of the windows returned. By default, that of the tiles read, learned from the first one.
+   threadSafe: whether readTile may be called from a thread other than the main one. arcpy functions, such as RasterToNumPyArray, may not.
+
+   Tile lookups are serialized by a lock, so that the cache itself may be used from several threads; windows should only be requested from other threads (e.g. by a prefetchFx.Prefetcher) if threadSafe is True.'''
+   def __init__(self, readTile, grid, tileSize = 512, maxBytes = 256 * 2**20, nodata = 0, threadSafe = True, dtype = None):
+      self.readTile = readTile
+      self.grid = grid
+      self.tileSize = int(tileSize)
+      self.maxBytes = maxBytes
+      self.nodata = nodata
+      self.threadSafe = threadSafe
+      self.dtype = np.dtype(dtype) if dtype is not None else None
+      self.tiles = collections.OrderedDict()
+      self.nbytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      self.lock = threading.RLock()
+
+   def getTile(self, tr, tc):
+      '''Returns tile (tr, tc), reading it from the source if it is not cached'''
+      key = (tr, tc)
+      with self.lock:
+         tile = self.tiles.pop(key, None)
+         if tile is not None:
+            self.hits += 1
+         else:
+            self.misses += 1
+            ts = self.tileSize
+            r0, c0 = tr * ts, tc * ts
+            tile = np.asarray(self.readTile(r0, min(r0 + ts, self.grid.nrows), c0, min(c0 + ts, self.grid.ncols)))
+            if self.dtype is None:
+               self.dtype = tile.dtype
+            self.nbytes += tile.nbytes
+            while self.tiles and self.nbytes > self.maxBytes:
+               oldKey, oldTile = self.tiles.popitem(last=False)
+               self.nbytes -= oldTile.nbytes
+               self.evictions += 1
+         self.tiles[key] = tile
+      return tile
+
+   def read(self, r0, r1, c0, c1):
+      '''Returns the block of rows r0:r1 and columns c0:c1 of the grid, assembled from cached tiles. Parts outside the grid are filled with nodata.'''
+      ts = self.tileSize
+      out = None
+      rr0, rr1 = max(r0, 0), min(r1, self.grid.nrows)
+      cc0, cc1 = max(c0, 0), min(c1, self.grid.ncols)
+      for tr in range(rr0 // ts, (rr1 - 1) // ts + 1 if rr1 > rr0 else rr0 // ts):
+         for tc in range(cc0 // ts, (cc1 - 1) // ts + 1 if cc1 > cc0 else cc0 // ts):
+            tile = self.getTile(tr, tc)
+            if out is None:
+               out = np.empty((r1 - r0, c1 - c0), dtype=self.dtype)
+               out.fill(self.nodata)
+            # Overlap of this tile with the requested block
+            a0, a1 = max(rr0, tr * ts), min(rr1, tr * ts + tile.shape[0])
+            b0, b1 = max(cc0, tc * ts), min(cc1, tc * ts + tile.shape[1])
+            out[a0 - r0:a1 - r0, b0 - c0:b1 - c0] = tile[a0 - tr * ts:a1 - tr * ts, b0 - tc * ts:b1 - tc * ts]
+      if out is None:
+         # Nothing of the grid falls in the block; its type still has to match the grid's, so learn it from a tile if no tile has been read yet
+         if self.dtype is None and self.grid.nrows > 0 and self.grid.ncols > 0:
+            self.getTile(0, 0)
+         out = np.empty((max(r1 - r0, 0), max(c1 - c0, 0)), dtype=self.dtype)
+         out.fill(self.nodata)
+      return out
+
+   def readExtent(self, xmin, ymin, xmax, ymax):
+      '''Returns the block of the grid covering an extent, and its GridSpec'''
+      r0, r1, c0, c1 = self.grid.window(xmin, ymin, xmax, ymax)
+      return self.read(r0, r1, c0, c1), self.grid.subGrid(r0, r1, c0, c1)
+
+   def stats(self):
+      '''Returns a dictionary of cache counters'''
+      total = self.hits + self.misses
+      return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'tiles': len(self.tiles), 'bytes': self.nbytes, 'hitRate': self.hits / float(total) if total else 0.0}
+
+def npyTileReader(path):
+   '''Returns a tile reading function for a grid stored as a .npy file, which is memory-mapped rather than loaded'''
+   arr = np.load(path, mmap_mode='r')
+   def readTile(r0, r1, c0, c1):
+      return np.array(arr[r0:r1, c0:c1])
+   return readTile
+
+def hilbertIndex(x, y, bits = 16):
+   '''Returns the position along a Hilbert curve of integer coordinates x and y, each in the range 0 to 2**bits - 1'''
+   x = np.array(x, dtype=np.int64)
+   y = np.array(y, dtype=np.int64)
+   d = np.zeros(x.shape, dtype=np.int64)
+   s = 1 << (bits - 1)
+   while s > 0:
+      rx = (x & s) > 0
+      ry = (y & s) > 0
+      d += s * s * ((3 * rx) ^ ry)
+      # Rotate the quadrant so that the curve is continuous
+      flip = ~ry
+      swapX = np.where(flip & rx, s - 1 - x, x)
+      swapY = np.where(flip & rx, s - 1 - y, y)
+      x = np.where(flip, swapY, x)
+      y = np.where(flip, swapX, y)
+      s >>= 1
+   return d
+
+def hilbertOrder(xs, ys, bits = 16):
+   '''Returns the indices that sort points (xs, ys) along a Hilbert curve, so that points near each other in space are mostly near each other in the ordering'''
+   xs = np.asarray(xs, dtype=float)
+   ys = np.asarray(ys, dtype=float)
+   if len(xs) == 0:
+      return np.zeros(0, dtype=np.int64)
+   n = (1 << bits) - 1
+   spanX = max(xs.max() - xs.min(), 1e-9)
+   spanY = max(ys.max() - ys.min(), 1e-9)
+   ix = np.round((xs - xs.min()) / spanX * n).astype(np.int64)
+   iy = np.round((ys - ys.min()) / spanY * n).astype(np.int64)
+   return np.argsort(hilbertIndex(ix, iy, bits), kind='mergesort')
+
+class STRIndex(object):
+   '''Static R-tree over bounding boxes, bulk-loaded with the Sort-Tile-Recursive method. Build it once over a set of features; each query then only tests the boxes in nodes overlapping the query box, instead of every feature.'''
+   def __init__(self, boxes, nodeSize = 16):
+      '''boxes is a sequence of (xmin, ymin, xmax, ymax) tuples, one per feature'''
+      boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+      self.nodeSize = nodeSize
+      n = len(boxes)
+
+      # Sort-Tile-Recursive packing: cut into vertical slices by x center, then sort each slice by y center
+      numLeaves = int(math.ceil(n / float(nodeSize)))
+      numSlices = max(int(math.ceil(math.sqrt(numLeaves))), 1)
+      cx = (boxes[:,0] + boxes[:,2]) / 2
+      cy = (boxes[:,1] + boxes[:,3]) / 2
+      order = np.argsort(cx, kind='mergesort')
+      sliceSize = numSlices * nodeSize
+      for s in range(0, n, sliceSize):
+         run = order[s:s + sliceSize]
+         order[s:s + sliceSize] = run[np.argsort(cy[run], kind='mergesort')]
+      self.order = order
+
+      # Levels of node boxes, from the items up to a single root
+      self.levels = [boxes[order]]
+      while len(self.levels[-1]) > 1:
+         self.levels.append(self._parentBoxes(self.levels[-1]))
+
+   def _parentBoxes(self, boxes):
+      starts = np.arange(0, len(boxes), self.nodeSize)
+      return np.column_stack([np.minimum.reduceat(boxes[:,0], starts), np.minimum.reduceat(boxes[:,1], starts), np.maximum.reduceat(boxes[:,2], starts), np.maximum.reduceat(boxes[:,3], starts)])
+
+   def __len__(self):
+      return len(self.order)
+
+   def query(self, xmin, ymin, xmax, ymax):
+      '''Returns the indices, in input order, of all boxes overlapping the query box. These are candidates only; follow with an exact test on the geometries.'''
+      if len(self.order) == 0:
+         return np.zeros(0, dtype=np.int64)
+      nodes = np.zeros(1, dtype=np.int64)
+      for level in range(len(self.levels) - 1, -1, -1):
+         boxes = self.levels[level]
+         if level < len(self.levels) - 1:
+            # Expand the surviving nodes of the level above into their children
+            nodes = (nodes[:,None] * self.nodeSize + np.arange(self.nodeSize)).ravel()
+            nodes = nodes[nodes < len(boxes)]
+         b = boxes[nodes]
+         nodes = nodes[(b[:,0] <= xmax) & (b[:,2] >= xmin) & (b[:,1] <= ymax) & (b[:,3] >= ymin)]
+         if len(nodes) == 0:
+            break
+      return np.sort(self.order[nodes])
+
+# Neighbour offsets for 4- and 8-connectivity
+_nbrs4 = ((-1, 0), (0, -1), (0, 1), (1, 0))
+_nbrs8 = _nbrs4 + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def _shift(arr, dr, dc, fill):
+   '''Returns arr shifted so that out[r, c] = arr[r + dr, c + dc], with fill where that falls outside arr'''
+   out = np.empty(arr.shape, dtype=arr.dtype)
+   out.fill(fill)
+   nrows, ncols = arr.shape
+   out[max(-dr, 0):nrows - max(dr, 0), max(-dc, 0):ncols - max(dc, 0)] = arr[max(dr, 0):nrows - max(-dr, 0), max(dc, 0):ncols - max(-dc, 0)]
+   return out
+
+def dilate(mask):
+   '''Dilates a 2D boolean mask by one cell in all 8 directions (a 3 x 3 structuring element)'''
+   out = mask.copy()
+   for dr, dc in _nbrs8:
+      out |= _shift(mask, dr, dc, False)
+   return out
+
+def erode(mask):
+   '''Erodes a 2D boolean mask by one cell in all 8 directions. Cells outside the mask's bounds count as False.'''
+   out = mask.copy()
+   for dr, dc in _nbrs8:
+      out &= _shift(mask, dr, dc, False)
+   return out
+
+def close(mask):
+   '''Morphological closing of a 2D boolean mask with a 3 x 3 structuring element: dilation then erosion. This is the raster counterpart of buffering out then back in by one cell, which bridges gaps of up to one cell.'''
+   padded = np.pad(mask, 1, mode='constant', constant_values=False)
+   return erode(dilate(padded))[1:-1, 1:-1]
+
+def labelComponents(mask, connectivity = 8):
+   '''Labels the connected groups of True cells in a 2D boolean mask. Returns an integer array holding the component number of each cell (numbered from 0 in order of their first cell, -1 outside the mask) and the number of components.'''
+   nbrs = _nbrs8 if connectivity == 8 else _nbrs4
+   size = mask.size
+   lab = np.where(mask, np.arange(size).reshape(mask.shape), size)
+   inMask = mask.ravel()
+   while True:
+      # Each cell takes the smallest label among its neighbours, then jumps to the label of the cell it points at
+      new = lab.copy()
+      for dr, dc in nbrs:
+         np.minimum(new, _shift(lab, dr, dc, size), out=new)
+      new[~mask] = size
+      flat = new.ravel()
+      flat[inMask] = flat[flat[inMask]]
+      if np.array_equal(new, lab):
+         break
+      lab = new
+   out = np.empty(mask.shape, dtype=np.int64)
+   out.fill(-1)
+   roots, comp = np.unique(lab[mask], return_inverse=True)
+   out[mask] = comp
+   return out, len(roots)
+
+def eliminateParts(mask, minFrac):
+   '''Removes the parts of a 2D boolean mask smaller than minFrac of its total outer area, and fills the holes smaller than that, as EliminatePolygonPart does with the PERCENT method and the ANY option. Parts are 8-connected; holes are 4-connected groups of False cells not connected to the edge of the mask.'''
+   # Holes: background not reachable from outside the mask
+   # The padding joins all background outside the mask into the component of the corner cell
+   padded = np.pad(~mask, 1, mode='constant', constant_values=True)
+   bg, nbg = labelComponents(padded, 4)
+   holeLab = np.where(bg == bg[0, 0], -1, bg)[1:-1, 1:-1]
+   outerArea = mask.sum() + (holeLab >= 0).sum()
+   minArea = minFrac * outerArea
+
+   out = mask.copy()
+   parts, nparts = labelComponents(mask, 8)
+   if nparts > 1:
+      sizes = np.bincount(parts[mask], minlength=nparts)
+      out[mask] = sizes[parts[mask]] >= minArea
+   holes = holeLab >= 0
+   if holes.any():
+      sizes = np.bincount(holeLab[holes])
+      out[holes] = sizes[holeLab[holes]] < minArea
+   return out
+
+def distanceToRings(xs, ys, rings, chunk = 2**20):
+   '''Returns the distance from each point (xs, ys) to the nearest edge of a set of rings'''
+   return _distanceToEdges(xs, ys, _ringEdges(rings), chunk)
+
+def _distanceToEdges(xs, ys, edges, chunk = 2**20):
+   x0, y0, x1, y1 = edges
+   xs = np.asarray(xs, dtype=float)
+   ys = np.asarray(ys, dtype=float)
+   dist = np.empty(len(xs))
+   dist.fill(np.inf)
+   dx, dy = x1 - x0, y1 - y0
+   len2 = np.maximum(dx * dx + dy * dy, 1e-300)
+   step = max(chunk // max(len(x0), 1), 1)
+   for i in range(0, len(xs), step):
+      px = xs[i:i + step, None]
+      py = ys[i:i + step, None]
+      t = np.clip(((px - x0) * dx + (py - y0) * dy) / len2, 0, 1)
+      d = np.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+      dist[i:i + step] = d.min(axis=1) if len(x0) else np.inf
+   return dist
+
+def pointsInRings(xs, ys, rings, chunk = 2**20):
+   '''Even-odd test of points (xs, ys) against a polygon given as a list of rings. Returns a boolean array.'''
+   return _pointsInEdges(xs, ys, _ringEdges(rings), chunk)
+
+def _pointsInEdges(xs, ys, edges, chunk = 2**20):
+   x0, y0, x1, y1 = edges
+   xs = np.asarray(xs, dtype=float)
+   ys = np.asarray(ys, dtype=float)
+   inside = np.zeros(len(xs), dtype=bool)
+   step = max(chunk // max(len(x0), 1), 1)
+   for i in range(0, len(xs), step):
+      px = xs[i:i + step, None]
+      py = ys[i:i + step, None]
+      cross = (y0 > py) != (y1 > py)
+      with np.errstate(divide='ignore', invalid='ignore'):
+         xi = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+      inside[i:i + step] = (cross & (px < xi)).sum(axis=1) % 2 == 1
+   return inside
+
+def withinDistance(xs, ys, rings, dist):
+   '''Returns a boolean array telling which points (xs, ys) lie inside the polygon given by rings, or within dist of its boundary: that is, inside the polygon buffered by dist'''
+   return _withinEdges(xs, ys, _ringEdges(rings), ringsExtent(rings), dist)
+
+def _withinEdges(xs, ys, edges, extent, dist):
+   xs = np.asarray(xs, dtype=float)
+   ys = np.asarray(ys, dtype=float)
+   within = np.zeros(len(xs), dtype=bool)
+   if len(xs) == 0:
+      return within
+   # Points farther than dist from the extent cannot be within dist of the polygon; points near the boundary need no point in polygon test
+   e = extent
+   near = np.nonzero((xs >= e[0] - dist) & (xs <= e[2] + dist) & (ys >= e[1] - dist) & (ys <= e[3] + dist))[0]
+   ok = _distanceToEdges(xs[near], ys[near], edges) <= dist
+   rest = near[~ok]
+   ok[~ok] = _pointsInEdges(xs[rest], ys[rest], edges)
+   within[near] = ok
+   return within
+
+def bufferTest(grid, rings, dist):
+   '''Returns a function telling which of a set of flat cell indices of grid have their centers inside the polygon given by rings, or within dist of it. Clipping a raster to a buffer of the polygon keeps these cells. See bufferMask for testing every cell of a window at once.'''
+   edges = _ringEdges(rings)
+   extent = ringsExtent(rings)
+   def test(cells):
+      rows, cols = grid.flatToRowCol(cells)
+      return _withinEdges(grid.xmin + (cols + 0.5) * grid.cellSize, grid.ymax - (rows + 0.5) * grid.cellSize, edges, extent, dist)
+   return test
+
+def bufferMask(rings, grid, dist, chunk = 2**20):
+   '''Returns a boolean array over grid marking the cells whose centers lie inside the polygon given by rings, or within dist of its boundary, as bufferTest does, but for every cell at once.
+   The cells near the boundary are found a row at a time: the points of a row of cell centers within dist of an edge form one interval, bounded by where the row crosses the circles of radius dist around the edge's ends or the two sides offset from the edge by dist. Marking those intervals costs the number of rows times the number of edges, rather than the number of cells times the number of edges.'''
+   x0, y0, x1, y1 = _ringEdges(rings)
+   cs = grid.cellSize
+   nrows, ncols = grid.nrows, grid.ncols
+   # Cells whose centers are inside the polygon
+   mask = np.zeros(nrows * ncols, dtype=bool)
+   mask[rasterizeRings(rings, grid, False)] = True
+   mask = mask.reshape(nrows, ncols)
+   if len(x0) == 0 or nrows == 0 or ncols == 0:
+      return mask
+
+   dx, dy = x1 - x0, y1 - y0
+   length = np.maximum(np.hypot(dx, dy), 1e-300)
+   nx, ny = -dy / length * dist, dx / length * dist
+   # Interval starts and ends, as flat indices into rows of ncols + 1 marks
+   starts, ends = [], []
+   step = max(chunk // len(x0), 1)
+   for r0 in range(0, nrows, step):
+      rows = np.arange(r0, min(r0 + step, nrows))
+      yc = (grid.ymax - (rows + 0.5) * cs)[:, None]
+      lo = np.empty((len(rows), len(x0)))
+      lo.fill(np.inf)
+      hi = -lo
+      with np.errstate(divide='ignore', invalid='ignore'):
+         for px, py in ((x0, y0), (x1, y1)):
+            h = np.sqrt(dist * dist - (yc - py) ** 2)
+            ok = ~np.isnan(h)
+            lo = np.where(ok, np.minimum(lo, px - h), lo)
+            hi = np.where(ok, np.maximum(hi, px + h), hi)
+         for side in (1, -1):
+            t = (yc - (y0 + side * ny)) / dy
+            ok = (t >= 0) & (t <= 1)
+            x = x0 + side * nx + t * dx
+            lo = np.where(ok, np.minimum(lo, x), lo)
+            hi = np.where(ok, np.maximum(hi, x), hi)
+      # Columns whose centers fall within each interval
+      cLo = np.clip(np.ceil((lo - grid.xmin) / cs - 0.5), 0, ncols)
+      cHi = np.clip(np.floor((hi - grid.xmin) / cs - 0.5) + 1, 0, ncols)
+      ok = cLo < cHi
+      r = np.nonzero(ok)[0] + r0
+      starts.append(r * (ncols + 1) + cLo[ok].astype(np.int64))
+      ends.append(r * (ncols + 1) + cHi[ok].astype(np.int64))
+   size = nrows * (ncols + 1)
+   marks = np.bincount(np.concatenate(starts), minlength=size) - np.bincount(np.concatenate(ends), minlength=size)
+   marks = marks.reshape(nrows, ncols + 1)
+   return mask | (np.cumsum(marks, axis=1)[:, :ncols] > 0)
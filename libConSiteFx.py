@@ -13,11 +13,11 @@
 # ----------------------------------------------------------------------------------------
 
 # Import modules
-import arcpy, os, sys, traceback
+import os, sys, traceback
 from time import time as t
-
-# Set overwrite option so that existing data may be overwritten
-arcpy.env.overwriteOutput = True
+import numpy as np
+import geomFx, gridFx, profileFx
+from backendFx import arcpy
    
 def countFeatures(features):
    '''Gets count of features'''
@@ -33,15 +33,29 @@ def multiMeasure(meas, multi):
    newMeas = str(num) + " " + units
    measTuple = (num, units, newMeas)
    return measTuple
+
+def measToMapUnits(meas, metersPerUnit):
+   '''Given a measurement string such as "100 METERS" and the number of meters per map unit of a spatial reference, returns the measurement as a number in map units'''
+   factors = {'METERS': 1.0, 'KILOMETERS': 1000.0, 'DECIMETERS': 0.1, 'CENTIMETERS': 0.01, 'MILLIMETERS': 0.001, 'FEET': 0.3048, 'INTERNATIONALFEET': 0.3048, 'USSURVEYFEET': 1200.0/3937, 'YARDS': 0.9144, 'MILES': 1609.344, 'NAUTICALMILES': 1852.0}
+   num, units, newMeas = multiMeasure(meas, 1)
+   unitKey = units.upper().replace('_', '').replace(' ', '').replace('FOOT', 'FEET')
+   if unitKey not in factors:
+      unitKey += 'S'
+   if unitKey not in factors:
+      raise ValueError('Unrecognized linear unit: %s' % units)
+   return num * factors[unitKey] / float(metersPerUnit)
    
-def createTmpWorkspace():
-   '''Creates a new temporary geodatabase with a timestamp tag, within the current scratchFolder'''
+def createTmpWorkspace(tag = None):
+   '''Creates a new temporary geodatabase with a timestamp tag, within the current scratchFolder. The process ID and optional tag are added to the name so that concurrent processes do not collide.'''
    # Get time stamp
    ts = int(t())
    
    # Create new file geodatabase
    gdbPath = arcpy.env.scratchFolder
-   gdbName = 'tmp_%s.gdb' %ts
+   if tag:
+      gdbName = 'tmp_%s_%s_%s.gdb' %(ts, os.getpid(), tag)
+   else:
+      gdbName = 'tmp_%s_%s.gdb' %(ts, os.getpid())
    tmpWorkspace = gdbPath + os.sep + gdbName 
    arcpy.CreateFileGDB_management(gdbPath, gdbName)
    
@@ -58,15 +72,15 @@ def getScratchMsg(scratchGDB):
    
 def printMsg(msg):
    arcpy.AddMessage(msg)
-   print msg
+   print(msg)
    
 def printWrng(msg):
    arcpy.AddWarning(msg)
-   print 'Warning: ' + msg
+   print('Warning: ' + msg)
    
 def printErr(msg):
    arcpy.AddError(msg)
-   print 'Error: ' + msg
+   print('Error: ' + msg)
  
 def tback():
    '''Standard error handling routing to add to bottom of scripts'''
@@ -91,9 +105,50 @@ def garbagePickup(trashList):
          pass
    return
 
-def CleanFeatures(inFeats, outFeats):
-   '''Repairs geometry, then explodes multipart polygons to prepare features for geoprocessing.'''
+def readWKB(inFeats):
+   '''Reads the geometries of a feature class or layer as a list of WKB byte strings, skipping null geometries'''
+   return [bytes(row[0]) for row in arcpy.da.SearchCursor(inFeats, ["SHAPE@WKB"]) if row[0] is not None]
+
+def writeWKB(wkbList, outFeats, sr, template = ""):
+   '''Writes a list of WKB polygons to a new feature class in a single insert pass'''
+   drive, path = os.path.splitdrive(outFeats)
+   path, filename = os.path.split(path)
+   arcpy.CreateFeatureclass_management (drive + path, filename, "POLYGON", template, "", "", sr)
+   cursor = arcpy.da.InsertCursor(outFeats, ["SHAPE@WKB"])
+   for w in wkbList:
+      cursor.insertRow([bytearray(w)])
+   del cursor
+   return outFeats
+
+def editableFields(inFeats):
+   '''Returns the names of the attribute fields of a feature class that can be written, excluding the object ID, shape, and shape length/area fields'''
+   return [f.name for f in arcpy.ListFields(inFeats) if f.type not in ("OID", "Geometry") and f.editable]
+
+def cleanRows(inFeats, stats = None):
+   '''Streams the features of a feature class through in-process geometry repair and explosion (see geomFx.repairStream). Yields a (polygon, attributes) pair for every valid single part, with attributes ordered as editableFields(inFeats).'''
+   fields = editableFields(inFeats)
+   rows = ((row[0], row[1:]) for row in arcpy.da.SearchCursor(inFeats, ["SHAPE@WKB"] + fields))
+   return geomFx.repairStream(rows, stats)
+
+@profileFx.profiled
+def CleanFeatures(inFeats, outFeats, backend = "arcpy"):
+   '''Repairs geometry, then explodes multipart polygons to prepare features for geoprocessing.
+   If backend is "shapely", features are repaired and exploded in a single in-process pass (see cleanRows), with no retries, and the counts of repaired, exploded and dropped features are reported.'''
    
+   if backend == "shapely":
+      sr = arcpy.Describe(inFeats).spatialReference
+      fields = editableFields(inFeats)
+      drive, path = os.path.splitdrive(outFeats)
+      path, filename = os.path.split(path)
+      arcpy.CreateFeatureclass_management (drive + path, filename, "POLYGON", inFeats, "", "", sr)
+      stats = geomFx.RepairStats()
+      cursor = arcpy.da.InsertCursor(outFeats, ["SHAPE@WKB"] + fields)
+      for part, attrs in cleanRows(inFeats, stats):
+         cursor.insertRow([bytearray(geomFx.toWKB([part])[0])] + list(attrs))
+      del cursor
+      arcpy.AddMessage("Cleaned features: %s" % stats)
+      return outFeats
+
    # Process: Repair Geometry
    arcpy.RepairGeometry_management(inFeats, "DELETE_NULL")
 
@@ -121,7 +176,8 @@ def CleanFeatures(inFeats, outFeats):
    
    return outFeats
    
-def CleanClip(inFeats, clipFeats, outFeats, scratchGDB = "in_memory"):
+@profileFx.profiled
+def CleanClip(inFeats, clipFeats, outFeats, scratchGDB = "in_memory", backend = "arcpy"):
    '''Clips the Input Features with the Clip Features.  The resulting features are then subjected to geometry repair and exploded (eliminating multipart polygons)'''
    # Determine where temporary data are written
    msg = getScratchMsg(scratchGDB)
@@ -132,14 +188,18 @@ def CleanClip(inFeats, clipFeats, outFeats, scratchGDB = "in_memory"):
    arcpy.Clip_analysis(inFeats, clipFeats, tmpClip)
 
    # Process: Clean Features
-   arcpy.CleanFeatures_consiteTools(tmpClip, outFeats)
+   if backend == "shapely":
+      CleanFeatures(tmpClip, outFeats, backend)
+   else:
+      arcpy.CleanFeatures_consiteTools(tmpClip, outFeats)
    
    # Cleanup
    garbagePickup([tmpClip])
    
    return outFeats
    
-def CleanErase(inFeats, eraseFeats, outFeats, scratchGDB = "in_memory"):
+@profileFx.profiled
+def CleanErase(inFeats, eraseFeats, outFeats, scratchGDB = "in_memory", backend = "arcpy"):
    '''Uses Eraser Features to erase portions of the Input Features, then repairs geometry and explodes any multipart polygons.'''
    # Determine where temporary data are written
    msg = getScratchMsg(scratchGDB)
@@ -150,15 +210,20 @@ def CleanErase(inFeats, eraseFeats, outFeats, scratchGDB = "in_memory"):
    arcpy.Erase_analysis(inFeats, eraseFeats, tmpErased, "")
 
    # Process: Clean Features
-   arcpy.CleanFeatures_consiteTools(tmpErased, outFeats)
+   if backend == "shapely":
+      CleanFeatures(tmpErased, outFeats, backend)
+   else:
+      arcpy.CleanFeatures_consiteTools(tmpErased, outFeats)
    
    # Cleanup
    garbagePickup([tmpErased])
    
    return outFeats
    
-def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
-   '''If a positive number is entered for the dilation distance, features are expanded outward by the specified distance, then shrunk back in by the same distance. This causes nearby features to coalesce. If a negative number is entered for the dilation distance, features are first shrunk, then expanded. This eliminates narrow portions of existing features, thereby simplifying them. It can also break narrow "bridges" between features that were formerly coalesced.'''
+@profileFx.profiled
+def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory", backend = "arcpy"):
+   '''If a positive number is entered for the dilation distance, features are expanded outward by the specified distance, then shrunk back in by the same distance. This causes nearby features to coalesce. If a negative number is entered for the dilation distance, features are first shrunk, then expanded. This eliminates narrow portions of existing features, thereby simplifying them. It can also break narrow "bridges" between features that were formerly coalesced.
+   If backend is "shapely", the same sequence runs in memory on all features at once (see geomFx.coalesceArray), with no intermediate datasets.'''
    
    # Parse dilation distance and get the negative
    origDist, units, meas = multiMeasure(dilDist, 1)
@@ -177,6 +242,16 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       dissolve1 = "NONE"
       dissolve2 = "ALL"
 
+   if backend == "shapely":
+      # One of the two buffers dissolves everything, so all features form a single group
+      sr = arcpy.Describe(inFeats).spatialReference
+      stats = geomFx.RepairStats()
+      geoms = [part for part, attrs in cleanRows(inFeats, stats)]
+      parts, groups = geomFx.coalesceArray(geoms, np.zeros(len(geoms), dtype=int), measToMapUnits(dilDist, sr.metersPerUnit), measToMapUnits("0.1 Meters", sr.metersPerUnit))
+      writeWKB(geomFx.toWKB(parts), outFeats, sr)
+      arcpy.AddMessage("Cleaned input features: %s" % stats)
+      return outFeats
+
    # Process: Buffer
    Buff1 = scratchGDB + os.sep + "Buff1"
    arcpy.Buffer_analysis(inFeats, Buff1, meas, "FULL", "ROUND", dissolve1, "", "PLANAR")
@@ -198,8 +273,14 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       
    # Cleanup
    garbagePickup([Buff1, Clean_Buff1, Buff2])
+
+   return outFeats
    
-def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
+@profileFx.profiled
+def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory", backend = "arcpy"):
+   '''Groups features lying within the dilation distance of each other, and wraps each group in a single smoothed polygon with no gaps.
+   The dissolved features are indexed once, so that finding the features within each wrap does not require a selection against all features. Output geometries are written in a single batch at the end.
+   If backend is "shapely", the whole process runs in memory (see geomFx.shrinkWrapArray), with no intermediate datasets.'''
    # Parse dilation distance, and increase it to get smoothing distance
    origDist, units, meas = multiMeasure(dilDist, 1)
    smthDist, units, smthMeas = multiMeasure(dilDist, 8)
@@ -209,6 +290,17 @@ def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       arcpy.AddError("You need to enter a positive, non-zero value for the dilation distance")
       raise arcpy.ExecuteError   
 
+   if backend == "shapely":
+      arcpy.AddMessage("Processing runs in memory with shapely, so no scratch products are written (scratchGDB is not used).")
+      sr = arcpy.Describe(inFeats).spatialReference
+      mpu = sr.metersPerUnit
+      geoms = geomFx.fromWKB(readWKB(inFeats))
+      arcpy.AddMessage("Shrink-wrapping %s features in memory..." % len(geoms))
+      wraps = geomFx.shrinkWrapArray(geoms, measToMapUnits(meas, mpu), measToMapUnits(smthMeas, mpu), measToMapUnits("0.1 Meters", mpu), arcpy.AddMessage)
+      arcpy.AddMessage("Writing %s features..." % len(wraps))
+      writeWKB(geomFx.toWKB(wraps), outFeats, sr, inFeats)
+      return outFeats
+
    # Determine where temporary data are written
    msg = getScratchMsg(scratchGDB)
    arcpy.AddMessage(msg)
@@ -266,10 +358,16 @@ def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
    numWraps = (arcpy.GetCount_management(explFeats)).getOutput(0)
    arcpy.AddMessage('There are %s features after consolidation' %numWraps)
 
+   # Index the dissolved features once, by bounding box
+   arcpy.AddMessage("Indexing dissolved features...")
+   dissRows = [row for row in arcpy.da.SearchCursor(dissFeats, ["OID@", "SHAPE@"])]
+   dissIndex = gridFx.STRIndex([(shp.extent.XMin, shp.extent.YMin, shp.extent.XMax, shp.extent.YMax) for oid, shp in dissRows])
+   oidFld = arcpy.AddFieldDelimiters(dissFeats, arcpy.Describe(dissFeats).OIDFieldName)
+
    # Loop through the exploded buffer features
    myFeats = arcpy.da.SearchCursor(explFeats, ["SHAPE@"])
-   counter = 1
-   for Feat in myFeats:
+   finalShapes = []
+   for counter, Feat in enumerate(myFeats, 1):
       arcpy.AddMessage('Working on feature %s' % str(counter))
       featSHP = Feat[0]
       tmpFeat = scratchGDB + os.sep + "tmpFeat"
@@ -278,13 +376,22 @@ def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       
       # Process:  Repair Geometry
       arcpy.RepairGeometry_management (tmpFeat, "DELETE_NULL")
+      repaired = [row[0] for row in arcpy.da.SearchCursor(tmpFeat, ["SHAPE@"]) if row[0] is not None]
+      if not repaired:
+         arcpy.AddWarning('Feature %s has no valid geometry after repair; skipping' % str(counter))
+         continue
+      featSHP = repaired[0]
+      
+      # Get dissolved features within each exploded buffer feature: candidates by bounding box, then exact test
+      ext = featSHP.extent
+      candidates = dissIndex.query(ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+      selOIDs = [dissRows[i][0] for i in candidates if not dissRows[i][1].disjoint(featSHP)]
+      if not selOIDs:
+         continue
       
-      # Process:  Make Feature Layer
-      arcpy.MakeFeatureLayer_management (dissFeats, "dissFeatsLyr", "", "", "")
+      # Process:  Make Feature Layer of the selected dissolved features
+      arcpy.MakeFeatureLayer_management (dissFeats, "dissFeatsLyr", "%s IN (%s)" % (oidFld, ", ".join(str(oid) for oid in selOIDs)))
       trashList.append("dissFeatsLyr")
-
-      # Process: Select Layer by Location (Get dissolved features within each exploded buffer feature)
-      arcpy.SelectLayerByLocation_management ("dissFeatsLyr", "INTERSECT", tmpFeat, "", "NEW_SELECTION")
       
       # Process:  Coalesce features (expand)
       coalFeats = scratchGDB + os.sep + 'coalFeats'
@@ -303,11 +410,17 @@ def ShrinkWrap(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       arcpy.Dissolve_management (unionFeats, dissunionFeats, "", "", "SINGLE_PART", "")
       trashList.append(dissunionFeats)
       
-      # Process:  Append the final geometry to the ShrinkWrap feature class
-      arcpy.AddMessage("Appending feature...")
-      arcpy.Append_management(dissunionFeats, outFeats, "NO_TEST", "", "")
-      
-      counter +=1
+      # Keep the final geometry for the batched write below
+      finalShapes.extend([row[0] for row in arcpy.da.SearchCursor(dissunionFeats, ["SHAPE@"])])
+      garbagePickup(["dissFeatsLyr"])
+   del myFeats
+
+   # Process:  Write the final geometries to the ShrinkWrap feature class
+   arcpy.AddMessage("Writing %s features..." % len(finalShapes))
+   cursor = arcpy.da.InsertCursor(outFeats, ["SHAPE@"])
+   for myShape in finalShapes:
+      cursor.insertRow([myShape])
+   del cursor
 
    # Cleanup
    garbagePickup([tmpWorkspace])
@@ -0,0 +1,131 @@
+# ----------------------------------------------------------------------------------------
+# prefetchFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A bounded producer/consumer pipeline that loads the inputs of the next few items (e.g. flow direction windows for the next features) on background I/O threads while the current item is being computed, so that disk reads overlap with computation.
+
+# Usage Tips:
+# Wrap the per-item loop in a Prefetcher, giving it the function that loads an item's input. Items come back in their original order, each with a function returning its loaded input:
+#    prefetcher = prefetchFx.Prefetcher(lambda f: tileCache.readExtent(*f.extent), feats, depth=4)
+#    for feat, fetch in prefetcher:
+#       try:
+#          fdir, grid = fetch()   # re-raises any error raised while loading this item
+#          ...
+#    print(prefetcher.report())
+# At most depth items are loaded ahead of the one being computed, so memory use stays bounded: producers block once that many are waiting. With depth 0, each item is loaded in the consumer's own thread, as a plain loop would.
+# The report gives the time the consumer spent waiting for inputs (raise depth or threads if it is large), the time producers spent blocked by a full queue (depth is larger than it needs to be if this is large and waiting is small), and the queue depth seen by the consumer.
+# The load function must be safe to call from another thread, and from several at once if numThreads > 1. arcpy functions are not, including RasterToNumPyArray, so a gridFx.TileCache is only safe to read from if its tiles come from memory or a memory-mapped file (see its threadSafe attribute).
+
+# Dependencies:
+# Python standard library only. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import sys, time, threading
+
+class Prefetcher(object):
+   '''Iterates over items, loading each one's input ahead of time on numThreads background threads, at most depth items ahead of the consumer. Yields (item, fetch) pairs in the order of items, where fetch() returns the loaded input or raises the error raised by load.'''
+   def __init__(self, load, items, depth = 4, numThreads = 1):
+      self.load = load
+      self.items = list(items)
+      self.depth = max(int(depth), 0)
+      self.numThreads = max(int(numThreads), 1)
+      self.waitSec = 0.0    # Time the consumer spent waiting for inputs
+      self.blockedSec = 0.0 # Time producers spent blocked by a full queue
+      self.loadSec = 0.0    # Time spent loading, summed over threads
+      self.waits = 0        # Number of items the consumer had to wait for
+      self.depthSum = 0
+      self.maxDepth = 0
+      self.consumed = 0
+      self._ready = {}
+      self._next = 0
+      self._stop = False
+      self._cond = threading.Condition()
+      self._slots = threading.Semaphore(self.depth)
+
+   def _loadItem(self, i):
+      t0 = time.time()
+      try:
+         result = (True, self.load(self.items[i]))
+      except Exception:
+         result = (False, sys.exc_info()[1])
+      return result, time.time() - t0
+
+   def _produce(self):
+      while True:
+         t0 = time.time()
+         self._slots.acquire()
+         with self._cond:
+            self.blockedSec += time.time() - t0
+            if self._stop or self._next >= len(self.items):
+               self._slots.release()
+               return
+            i = self._next
+            self._next += 1
+         result, secs = self._loadItem(i)
+         with self._cond:
+            self.loadSec += secs
+            self._ready[i] = result
+            self._cond.notify_all()
+
+   def _fetcher(self, result):
+      def fetch():
+         ok, value = result
+         if not ok:
+            raise value
+         return value
+      return fetch
+
+   def __iter__(self):
+      if self.depth == 0:
+         # No background loading: each item is loaded when it is reached
+         for i, item in enumerate(self.items):
+            result, secs = self._loadItem(i)
+            self.loadSec += secs
+            self.waitSec += secs
+            self.waits += 1
+            self.consumed += 1
+            yield item, self._fetcher(result)
+         return
+
+      threads = [threading.Thread(target=self._produce) for t in range(min(self.numThreads, len(self.items)))]
+      for t in threads:
+         t.daemon = True
+         t.start()
+      try:
+         for i, item in enumerate(self.items):
+            t0 = time.time()
+            with self._cond:
+               # Depth is the number of loaded items waiting, including this one if it is ready
+               depth = len(self._ready)
+               if i not in self._ready:
+                  self.waits += 1
+                  while i not in self._ready:
+                     self._cond.wait()
+               result = self._ready.pop(i)
+            self.waitSec += time.time() - t0
+            self.depthSum += depth
+            self.maxDepth = max(self.maxDepth, depth)
+            self.consumed += 1
+            self._slots.release()
+            yield item, self._fetcher(result)
+      finally:
+         # Stop the producers, including any blocked on a full queue if the consumer quit early
+         with self._cond:
+            self._stop = True
+         for t in threads:
+            self._slots.release()
+         for t in threads:
+            t.join()
+
+   def stats(self):
+      '''Returns a dictionary of pipeline counters'''
+      return {'items': self.consumed, 'depth': self.depth, 'threads': self.numThreads, 'waitSec': self.waitSec, 'waits': self.waits, 'blockedSec': self.blockedSec, 'loadSec': self.loadSec, 'meanDepth': self.depthSum / float(self.consumed) if self.consumed else 0.0, 'maxDepth': self.maxDepth}
+
+   def report(self):
+      '''Returns a one-line summary of the pipeline counters'''
+      st = self.stats()
+      return 'Prefetch (depth %s, %s threads): %s items loaded in %.2f s; consumer waited %.2f s for %s items; producers blocked %.2f s; queue depth mean %.1f, max %s' % (st['depth'], st['threads'], st['items'], st['loadSec'], st['waitSec'], st['waits'], st['blockedSec'], st['meanDepth'], st['maxDepth'])
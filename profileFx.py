@@ -0,0 +1,263 @@
+# ----------------------------------------------------------------------------------------
+# profileFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A small profiling library for recording the wall time, memory use, and sizes (cells, vertices) of each processing stage, for each feature, and exporting them for analysis.
+
+# Usage Tips:
+# Create a Profiler and activate it; code then reports through the module-level stage() context manager, which does nothing when no profiler is active. For example:
+#    prof = profileFx.activate(profileFx.Profiler())
+#    with profileFx.stage('watershed', cells=n):
+#       ...
+#    prof.toCSV(path); print(prof.summaryTable())
+# Functions can be reported as stages by decorating them with @profileFx.profiled.
+# Stages may be nested (e.g. CleanFeatures within Coalesce within a "coalesce" stage); each record notes its parent stage, so totals should be compared among stages at the same level.
+# Memory is the resident set size of the process, which includes memory held by arcpy and other native libraries. Two peaks can be recorded for each stage, covering its nested stages too:
+#    sampleSec: a background thread reads the resident set size every sampleSec seconds, and each stage records the highest reading taken while it ran (peakMB). Cheap enough to leave on; peaks shorter than sampleSec may be missed.
+#    traceMemory (Python 3.9 or later): the peak of Python allocations, NumPy arrays included, within each stage (pyPeakMB). Exact, but tracing slows allocation down, and so the stage times.
+
+# Dependencies:
+# Python standard library only. Uses psutil for memory if it is installed. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, sys, time, json, csv, contextlib, functools, threading
+try:
+   import psutil
+except ImportError:
+   psutil = None
+try:
+   import tracemalloc
+except ImportError:
+   tracemalloc = None
+
+# Fields of each stage record, in export order
+recordFields = ('stage', 'feature', 'parent', 'seconds', 'memMB', 'memDeltaMB', 'peakMB', 'pyPeakMB', 'cells', 'vertices')
+
+# Fields of each summary row, in export order
+summaryFields = ('stage', 'n', 'total', 'mean', 'p50', 'p95', 'max', 'memMaxMB', 'peakMaxMB', 'pyPeakMaxMB')
+
+def rssMB():
+   '''Returns the resident memory of this process in MB, or None if it cannot be determined'''
+   if psutil is not None:
+      return psutil.Process(os.getpid()).memory_info().rss / 2.0**20
+   try:
+      with open('/proc/self/statm') as f:
+         return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.0**20
+   except (IOError, OSError, ValueError, AttributeError):
+      pass
+   if sys.platform == 'win32':
+      import ctypes
+      from ctypes import wintypes
+      class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+         _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+      counters = PROCESS_MEMORY_COUNTERS()
+      counters.cb = ctypes.sizeof(counters)
+      if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+         return counters.WorkingSetSize / 2.0**20
+   return None
+
+def _maxOf(*values):
+   '''Returns the largest of values that are not None, or None if all are'''
+   values = [v for v in values if v is not None]
+   return max(values) if values else None
+
+def percentile(values, p):
+   '''Returns the p-th percentile of a list of numbers, interpolating linearly between ranks'''
+   vals = sorted(values)
+   if not vals:
+      return None
+   pos = (len(vals) - 1) * p / 100.0
+   lo = int(pos)
+   hi = min(lo + 1, len(vals) - 1)
+   return vals[lo] + (vals[hi] - vals[lo]) * (pos - lo)
+
+class Profiler(object):
+   '''Collects one record per stage per feature: stage name, feature ID, enclosing stage, wall time in seconds, resident memory at the end of the stage and its change over the stage, peak resident memory during the stage (if sampled), peak Python allocations (if traced), and cell and vertex counts'''
+   def __init__(self, traceMemory = False, sampleSec = None):
+      self.records = []
+      self.feature = None # Feature ID attached to stages that do not give one
+      self._stack = []
+      # Peaks reached by each open stage before its latest nested stage began, as (resident, Python) MB
+      self._peaks = []
+      self.traceMemory = traceMemory and tracemalloc is not None and hasattr(tracemalloc, 'reset_peak')
+      self._startedTrace = self.traceMemory and not tracemalloc.is_tracing()
+      if self._startedTrace:
+         tracemalloc.start()
+      self.sampleSec = sampleSec if sampleSec and rssMB() is not None else None
+      self._rssPeak = None
+      self._lock = threading.Lock()
+      self._stop = threading.Event()
+      self._sampler = None
+
+   def _sample(self):
+      while not self._stop.wait(self.sampleSec):
+         mem = rssMB()
+         with self._lock:
+            if self._rssPeak is not None and mem > self._rssPeak:
+               self._rssPeak = mem
+
+   def _startSampler(self):
+      if self.sampleSec and self._sampler is None:
+         self._sampler = threading.Thread(target=self._sample, name='profileFx sampler')
+         self._sampler.daemon = True
+         self._sampler.start()
+
+   def close(self):
+      '''Stops the memory sampling thread, if any, and memory tracing, if this profiler started it'''
+      if self._startedTrace:
+         tracemalloc.stop()
+         self._startedTrace = False
+         self.traceMemory = False
+      if self._sampler is not None:
+         self._stop.set()
+         self._sampler.join()
+         self._sampler = None
+         self._stop.clear()
+
+   def _pyPeak(self):
+      return tracemalloc.get_traced_memory()[1] / 2.0**20 if self.traceMemory else None
+
+   @contextlib.contextmanager
+   def stage(self, name, feature = None, **counts):
+      '''Times the enclosed block as one stage. Yields the stage record, so that counts known only at the end (e.g. rec["cells"] = n) can be added to it.'''
+      rec = dict((f, None) for f in recordFields)
+      rec.update(counts)
+      rec['stage'] = name
+      rec['feature'] = feature if feature is not None else self.feature
+      rec['parent'] = self._stack[-1]['stage'] if self._stack else None
+      mem0 = rssMB()
+      self._startSampler()
+      # The peaks are restarted for this stage; the enclosing stage keeps what it has reached so far, and takes this stage's peaks when it ends
+      with self._lock:
+         if self._peaks:
+            self._peaks[-1] = (_maxOf(self._peaks[-1][0], self._rssPeak), _maxOf(self._peaks[-1][1], self._pyPeak()))
+         self._rssPeak = mem0
+      if self.traceMemory:
+         tracemalloc.reset_peak()
+      self._stack.append(rec)
+      self._peaks.append((None, None))
+      t0 = time.time()
+      try:
+         yield rec
+      finally:
+         rec['seconds'] = time.time() - t0
+         self._stack.pop()
+         rssPeak, pyPeak = self._peaks.pop()
+         mem1 = rssMB()
+         rec['memMB'] = mem1
+         if mem0 is not None and mem1 is not None:
+            rec['memDeltaMB'] = mem1 - mem0
+         with self._lock:
+            if self.sampleSec:
+               rec['peakMB'] = _maxOf(rssPeak, self._rssPeak, mem1)
+               self._rssPeak = rec['peakMB']
+         if self.traceMemory:
+            rec['pyPeakMB'] = _maxOf(pyPeak, self._pyPeak())
+         self.records.append(rec)
+
+   def extend(self, records):
+      '''Adds records collected elsewhere, e.g. by another process'''
+      self.records.extend(records)
+
+   def summary(self):
+      '''Returns one row per stage, in order of first appearance: stage name, number of records, total, mean, median (p50), 95th percentile and maximum seconds, maximum resident memory at the end of the stage, and the highest resident and Python peaks during it (None if not recorded)'''
+      stages = []
+      byStage = {}
+      for rec in self.records:
+         if rec['stage'] not in byStage:
+            stages.append(rec['stage'])
+            byStage[rec['stage']] = []
+         byStage[rec['stage']].append(rec)
+      rows = []
+      for name in stages:
+         recs = byStage[name]
+         secs = [r['seconds'] for r in recs]
+         rows.append({'stage': name, 'n': len(recs), 'total': sum(secs), 'mean': sum(secs) / len(secs), 'p50': percentile(secs, 50), 'p95': percentile(secs, 95), 'max': max(secs), 'memMaxMB': _maxOf(*[r['memMB'] for r in recs]), 'peakMaxMB': _maxOf(*[r.get('peakMB') for r in recs]), 'pyPeakMaxMB': _maxOf(*[r.get('pyPeakMB') for r in recs])})
+      return rows
+
+   def summaryTable(self):
+      '''Returns the summary as a plain text table'''
+      lines = ['%-24s %7s %10s %9s %9s %9s %9s %10s %10s %10s' % ('Stage', 'N', 'Total (s)', 'Mean', 'p50', 'p95', 'Max', 'Mem (MB)', 'Peak (MB)', 'Py peak')]
+      for row in self.summary():
+         mems = ['%10.1f' % row[f] if row[f] is not None else '%10s' % '-' for f in ('memMaxMB', 'peakMaxMB', 'pyPeakMaxMB')]
+         lines.append('%-24s %7d %10.2f %9.3f %9.3f %9.3f %9.3f %s' % (row['stage'][:24], row['n'], row['total'], row['mean'], row['p50'], row['p95'], row['max'], ' '.join(mems)))
+      return '\n'.join(lines)
+
+   def toJSON(self, path):
+      '''Writes the records and the summary to a JSON file'''
+      with open(path, 'w') as f:
+         json.dump({'records': self.records, 'summary': self.summary()}, f, indent=1, default=str)
+      return path
+
+   def _csvFile(self, path):
+      # The csv module wants binary files in Python 2, and text files without newline translation in Python 3
+      if sys.version_info[0] < 3:
+         return open(path, 'wb')
+      return open(path, 'w', newline='')
+
+   def toCSV(self, path):
+      '''Writes the records to a CSV file, and the summary to a second CSV file alongside it with "_summary" added to the name. Returns both paths.'''
+      with self._csvFile(path) as f:
+         writer = csv.DictWriter(f, recordFields, extrasaction='ignore')
+         writer.writeheader()
+         writer.writerows(self.records)
+      root, ext = os.path.splitext(path)
+      sumPath = root + '_summary' + ext
+      with self._csvFile(sumPath) as f:
+         writer = csv.DictWriter(f, summaryFields)
+         writer.writeheader()
+         writer.writerows(self.summary())
+      return path, sumPath
+
+   def export(self, path):
+      '''Writes the records to JSON or CSV, depending on the extension of path (.json or anything else)'''
+      if path.lower().endswith('.json'):
+         return self.toJSON(path)
+      return self.toCSV(path)
+
+# The profiler that stage() reports to, if any
+_active = None
+
+def activate(profiler):
+   '''Makes profiler the one that stage() reports to, and returns it'''
+   global _active
+   _active = profiler
+   return profiler
+
+def deactivate():
+   '''Stops reporting to the active profiler, stops its memory sampling, and returns it'''
+   global _active
+   profiler, _active = _active, None
+   if profiler is not None:
+      profiler.close()
+   return profiler
+
+def active():
+   '''Returns the active profiler, or None'''
+   return _active
+
+@contextlib.contextmanager
+def stage(name, feature = None, **counts):
+   '''Times the enclosed block as a stage of the active profiler. Yields the stage record, or a throwaway dictionary if no profiler is active.'''
+   if _active is None:
+      yield dict(counts)
+   else:
+      with _active.stage(name, feature, **counts) as rec:
+         yield rec
+
+def setFeature(feature):
+   '''Sets the feature ID attached to stages of the active profiler'''
+   if _active is not None:
+      _active.feature = feature
+
+def profiled(func):
+   '''Decorator reporting each call of a function as a stage of the active profiler, named after the function'''
+   @functools.wraps(func)
+   def wrapper(*args, **kwargs):
+      with stage(func.__name__):
+         return func(*args, **kwargs)
+   return wrapper
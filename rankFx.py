@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------------------------
+# rankFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of NumPy functions for scoring and ranking Stream Conservation Units (SCUs) held in memory as a columnar table.
+
+# Usage Tips:
+# Once the zonal statistics are in the table, changing the weights or the BRANK cutoff only needs array arithmetic, so re-ranking takes milliseconds. Save the table with SCUTable.save and reload it with SCUTable.load to re-rank later without any geoprocessing.
+# Each criterion is rescaled to 0-1 so that higher means higher priority: BRANK B1 scores 1 and B5 scores 0; the zonal means are rescaled from their minimum to maximum over the whole table. Give a criterion a negative weight to reverse its direction.
+
+# Dependencies:
+# numpy 1.7 or later, as shipped with ArcGIS 10.3.1. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import numpy as np
+
+# Biodiversity ranks, from most to least significant
+brankLevels = ('B1', 'B2', 'B3', 'B4', 'B5')
+
+# Scoring criteria, in the order weights are given
+criteria = ('BRANK', 'WtrshdInteg', 'ConsPrior', 'Vuln')
+defaultWeights = (0.25, 0.25, 0.25, 0.25)
+
+def parseBRANK(values):
+   '''Converts biodiversity ranks such as "B1" through "B5" to ordinals 1 through 5. Anything else becomes NaN.'''
+   vals = np.char.upper(np.char.strip(np.asarray(values).astype(str)))
+   ords = np.empty(vals.shape)
+   ords.fill(np.nan)
+   for i, level in enumerate(brankLevels):
+      ords[vals == level] = i + 1
+   return ords
+
+def brankCutoff(lo_BRANK):
+   '''Returns the ordinal of the lowest biodiversity rank to include'''
+   cutoff = parseBRANK([lo_BRANK])[0]
+   if np.isnan(cutoff):
+      raise ValueError('Unrecognized biodiversity rank: %s' % lo_BRANK)
+   return cutoff
+
+class SCUTable(object):
+   '''Columnar table of SCU attributes: IDs, BRANK ordinals, and one array per scoring criterion'''
+   def __init__(self, ids, brank, columns = None):
+      self.ids = np.asarray(ids)
+      brank = np.asarray(brank)
+      if brank.dtype.kind in 'fiu':
+         self.brankOrd = brank.astype(float)
+      else:
+         self.brankOrd = parseBRANK(brank)
+      self.columns = {}
+      self._criteria = None
+      for name, values in (columns or {}).items():
+         self.setColumn(name, values)
+
+   def __len__(self):
+      return len(self.ids)
+
+   def setColumn(self, name, values):
+      '''Sets a criterion column. None values become NaN.'''
+      values = [np.nan if v is None else v for v in values]
+      self.columns[name] = np.asarray(values, dtype=float)
+      self._criteria = None
+
+   def criteriaMatrix(self):
+      '''Returns the n x 4 matrix of criteria rescaled to 0-1, in the order of rankFx.criteria. Missing values score 0. The matrix is cached until a column changes.'''
+      if self._criteria is None:
+         n = len(self.ids)
+         mat = np.zeros((n, len(criteria)))
+         nLevels = len(brankLevels)
+         mat[:,0] = (nLevels - self.brankOrd) / float(nLevels - 1)
+         for j, name in enumerate(criteria[1:]):
+            col = self.columns.get(name)
+            if col is None or np.all(np.isnan(col)):
+               continue
+            lo, hi = np.nanmin(col), np.nanmax(col)
+            mat[:,j + 1] = (col - lo) / (hi - lo) if hi > lo else 1.0
+         mat[np.isnan(mat)] = 0.0
+         self._criteria = mat
+      return self._criteria
+
+   def brankMask(self, lo_BRANK):
+      '''Returns a boolean array selecting SCUs ranked lo_BRANK or better'''
+      return self.brankOrd <= brankCutoff(lo_BRANK)
+
+   def score(self, weights = defaultWeights):
+      '''Returns the weighted score of every SCU'''
+      return self.criteriaMatrix().dot(np.asarray(weights, dtype=float))
+
+   def rank(self, weights = defaultWeights, lo_BRANK = 'B5', k = None):
+      '''Scores the SCUs ranked lo_BRANK or better and orders them best first. If k is given, only the top k are selected, by partial sort; the result is the same as the first k of the full ranking. Returns the row indices of the selected SCUs in rank order, and their scores.'''
+      scores = self.score(weights)
+      idx = np.nonzero(self.brankMask(lo_BRANK))[0]
+      if k is not None and k < len(idx):
+         # Keep every SCU tied with the k-th best score, so that table order decides which of them make the cut
+         if hasattr(np, 'partition'):
+            kth = -np.partition(-scores[idx], k - 1)[k - 1]
+         else:
+            # numpy before 1.8 has no partial sort
+            kth = -np.sort(-scores[idx])[k - 1]
+         idx = idx[scores[idx] >= kth]
+      # Ties are broken by table order so that rankings are reproducible
+      order = np.lexsort((idx, -scores[idx]))
+      idx = idx[order][:k]
+      return idx, scores[idx]
+
+   def rankArray(self, weights = defaultWeights, lo_BRANK = 'B5'):
+      '''Returns the rank of every SCU (1 = highest priority), with 0 for SCUs excluded by the BRANK cutoff, and the scores'''
+      idx, scores = self.rank(weights, lo_BRANK)
+      ranks = np.zeros(len(self.ids), dtype=np.int64)
+      ranks[idx] = np.arange(1, len(idx) + 1)
+      return ranks, self.score(weights)
+
+   def sensitivity(self, weights = None, lo_BRANK = 'B5', k = 10, interval = (0.05, 0.95), maxMB = 64, maxBins = 1024):
+      '''Ranks the SCUs ranked lo_BRANK or better under every weight vector in weights (a numScenarios x 4 array, e.g. from sampleWeights) and summarizes the distribution of each SCU's rank. Scenarios are scored in chunks, each as a single matrix product, and ranked with one argsort per chunk; chunks are sized to keep their working arrays to about maxMB megabytes, so memory does not grow with the number of scenarios.
+      Returns a dictionary of arrays over the selected SCUs, in table order: "rows" (their row indices), "ids", "meanRank", "rankLo" and "rankHi" (the interval quantiles of rank), "pTop" (the fraction of scenarios ranking the SCU in the top k), and "scenarios".
+      Rank quantiles come from a histogram of at most maxBins bins per SCU. They are exact when there are no more SCUs than maxBins; otherwise each bin spans several ranks and the interval is widened to whole bins.'''
+      if weights is None:
+         weights = sampleWeights(1000)
+      weights = np.atleast_2d(np.asarray(weights, dtype=float))
+      rows = np.nonzero(self.brankMask(lo_BRANK))[0]
+      mat = self.criteriaMatrix()[rows]
+      n, numScen = len(rows), len(weights)
+      binWidth = max(1, -(-n // maxBins))
+      nBins = -(-n // binWidth) if n else 0
+      rankSum = np.zeros(n)
+      topCount = np.zeros(n, dtype=np.int64)
+      hist = np.zeros(n * nBins, dtype=np.int64)
+      # A chunk holds about eight arrays of 8 bytes per SCU and scenario (scores, sort order, ranks and temporaries)
+      chunk = max(1, int(maxMB * 2**20 // (64 * max(n, 1))))
+      rankVals = np.arange(1, n + 1)[None, :]
+      cellBase = np.arange(n)[None, :] * nBins
+      for s0 in range(0, numScen, chunk):
+         # One row of scores per scenario, so that each is sorted along contiguous memory
+         scores = weights[s0:s0 + chunk].dot(mat.T)
+         # Ties are broken by table order, as in rank
+         order = np.argsort(-scores, axis=1, kind='mergesort')
+         ranks = np.empty_like(order)
+         ranks[np.arange(len(order))[:, None], order] = rankVals
+         rankSum += ranks.sum(axis=0)
+         topCount += (ranks <= k).sum(axis=0)
+         hist += np.bincount((cellBase + (ranks - 1) // binWidth).ravel(), minlength=n * nBins)
+      hist = hist.reshape(n, nBins)
+      # Quantiles from the cumulative histogram: the lower bound is the start of its bin, the upper bound the end of its bin
+      cum = np.cumsum(hist, axis=1)
+      lo = np.array([np.searchsorted(c, interval[0] * numScen, 'right') for c in cum], dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+      hi = np.array([np.searchsorted(c, interval[1] * numScen, 'left') for c in cum], dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+      return {'rows': rows, 'ids': self.ids[rows], 'meanRank': rankSum / max(numScen, 1), 'rankLo': lo * binWidth + 1, 'rankHi': np.minimum((hi + 1) * binWidth, n), 'pTop': topCount / float(max(numScen, 1)), 'scenarios': numScen}
+
+   def save(self, path):
+      '''Saves the table to a NumPy .npz file'''
+      arrays = dict(('col_' + name, col) for name, col in self.columns.items())
+      np.savez(path, ids=self.ids, brankOrd=self.brankOrd, **arrays)
+
+   @classmethod
+   def load(cls, path):
+      '''Loads a table saved with SCUTable.save'''
+      f = np.load(path)
+      columns = dict((name[4:], f[name]) for name in f.files if name.startswith('col_'))
+      return cls(f['ids'], f['brankOrd'], columns)
+
+def sampleWeights(numScenarios, weights = defaultWeights, concentration = None, seed = None):
+   '''Draws numScenarios weight vectors for sensitivity analysis, as a numScenarios x 4 array. Without concentration, the sizes of the weights are drawn uniformly from all weightings summing to 1. With concentration, they are drawn from a Dirichlet distribution centred on the sizes of weights, more tightly the larger the concentration (criteria weighted 0 stay 0). The signs of weights are kept, so criteria given negative weights stay reversed.'''
+   weights = np.asarray(weights, dtype=float)
+   rng = np.random.RandomState(seed)
+   if concentration is None:
+      alpha = np.ones(len(weights))
+   else:
+      alpha = concentration * np.abs(weights) / np.abs(weights).sum()
+   draws = np.zeros((int(numScenarios), len(weights)))
+   keep = alpha > 0
+   draws[:, keep] = rng.dirichlet(alpha[keep], int(numScenarios))
+   return draws * np.where(weights < 0, -1.0, 1.0)
+
+def rerankSCUs(table, weights = defaultWeights, lo_BRANK = 'B5', k = None):
+   '''Re-ranks a saved or in-memory SCU table under new weights and BRANK cutoff without any geoprocessing. table may be an SCUTable or the path of a saved one. Returns a list of (SCU ID, score) tuples, best first.'''
+   if not isinstance(table, SCUTable):
+      table = SCUTable.load(table)
+   idx, scores = table.rank(weights, lo_BRANK, k)
+   return list(zip(table.ids[idx].tolist(), scores.tolist()))
+
+def sensitivitySCUs(table, numScenarios = 10000, weights = defaultWeights, concentration = None, lo_BRANK = 'B5', k = 10, seed = None):
+   '''Monte Carlo weight sensitivity of a saved or in-memory SCU table: ranks the SCUs under numScenarios weight vectors drawn with sampleWeights and summarizes each SCU's rank (see SCUTable.sensitivity). table may be an SCUTable or the path of a saved one. Returns a list of (SCU ID, mean rank, rank interval low, rank interval high, probability of being in the top k) tuples, in order of mean rank.'''
+   if not isinstance(table, SCUTable):
+      table = SCUTable.load(table)
+   sens = table.sensitivity(sampleWeights(numScenarios, weights, concentration, seed), lo_BRANK, k)
+   order = np.argsort(sens['meanRank'], kind='mergesort')
+   return list(zip(sens['ids'][order].tolist(), sens['meanRank'][order].tolist(), sens['rankLo'][order].tolist(), sens['rankHi'][order].tolist(), sens['pTop'][order].tolist()))
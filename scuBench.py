@@ -0,0 +1,421 @@
+# ----------------------------------------------------------------------------------------
+# scuBench.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# Benchmarks catchment delineation, the zonal statistics step of prioritizeSCUs, Coalesce and ShrinkWrap on synthetic data, so that performance regressions can be caught before a statewide run.
+
+# Usage Tips:
+# Run from the command line, e.g.:
+#    python scuBench.py --sizes 1000,10000,100000 --out bench.json
+# A flow direction grid is derived from a random DEM, and SCU polygons are scattered over it at a fixed density, so the grid grows with the number of features.
+# Each case runs in a fresh process, so that its peak memory (which includes generating its synthetic data) is measured on its own. Throughput is reported in features per second, and the scaling exponent between successive sizes (1 = linear).
+# Backends are benchmarked where they are available: the numpy engines always; shapely geometry if shapely 2 is installed; arcpy (with the same synthetic data written to a scratch geodatabase) only if arcpy can be imported. Without arcpy, the harness runs headless on any platform.
+# A case that raises, dies (e.g. out of memory) or runs past --timeout is reported as failed. To catch regressions, save a run with --out and compare later runs against it with --baseline; the exit code is 1 if any case failed or ran more than --tolerance slower than in the baseline.
+
+# Dependencies:
+# numpy 1.7 or later. Optionally shapely 2 and arcpy, as above.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, sys, time, math, json, argparse, multiprocessing, tempfile, shutil
+try:
+   from queue import Empty
+except ImportError:
+   from Queue import Empty
+import numpy as np
+import d8Fx, gridFx, zonalFx, rankFx, geomFx, profileFx, coverFx
+try:
+   import resource
+except ImportError:
+   resource = None
+
+# Synthetic data parameters, in cells
+cellsPerFeature = 400 # Grid area per SCU; sets the density of features
+searchCells = 10 # Maximum catchment distance
+cellSize = 10.0
+
+def peakRSSMB():
+   '''Returns the peak resident memory of this process so far, in MB'''
+   if resource is not None:
+      peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      # Reported in bytes on macOS and in kilobytes elsewhere
+      return peak / 2.0**20 if sys.platform == 'darwin' else peak / 2.0**10
+   if profileFx.psutil is not None:
+      return profileFx.psutil.Process(os.getpid()).memory_info().peak_wset / 2.0**20
+   return None
+
+def smoothNoise(shape, radius, rng):
+   '''Returns random noise smoothed by repeated box filtering'''
+   z = rng.standard_normal(shape)
+   for axis in (0, 1):
+      for rep in range(3):
+         c = np.cumsum(np.pad(z, [(radius + 1, radius) if a == axis else (0, 0) for a in (0, 1)], mode='edge'), axis=axis)
+         z = (np.take(c, np.arange(2 * radius + 1, c.shape[axis]), axis=axis) - np.take(c, np.arange(0, c.shape[axis] - 2 * radius - 1), axis=axis)) / (2.0 * radius + 1)
+   return z
+
+def syntheticDEM(nrows, ncols, seed = 0):
+   '''Returns a random DEM: smooth noise at two scales on a gentle regional slope'''
+   rng = np.random.RandomState(seed)
+   rows, cols = np.mgrid[0:nrows, 0:ncols]
+   return 0.02 * (rows + cols) + 5 * smoothNoise((nrows, ncols), 16, rng) + smoothNoise((nrows, ncols), 3, rng)
+
+def d8FromDEM(dem):
+   '''Derives D8 flow directions from a DEM by steepest descent. Cells with no lower neighbour drain to their lowest neighbour anyway, so pits produce small loops, as unfilled real data can. Cells on the edge may flow off the grid.'''
+   nrows, ncols = dem.shape
+   padded = np.pad(dem, 1, mode='constant', constant_values=np.inf)
+   best = np.empty(dem.shape)
+   best.fill(-np.inf)
+   fdir = np.zeros(dem.shape, dtype=np.uint8)
+   for code, dr, dc in zip(d8Fx.d8Codes, d8Fx.d8RowOff, d8Fx.d8ColOff):
+      nbr = padded[1 + dr:1 + dr + nrows, 1 + dc:1 + dc + ncols]
+      drop = (dem - nbr) / math.sqrt(dr * dr + dc * dc)
+      better = drop > best
+      best[better] = drop[better]
+      fdir[better] = code
+   # Cells on the top and bottom rows with no lower neighbour drain off the grid instead of into a pit
+   fdir[0, :] = np.where(best[0, :] <= 0, 64, fdir[0, :])
+   fdir[-1, :] = np.where(best[-1, :] <= 0, 4, fdir[-1, :])
+   return fdir
+
+def syntheticSCUs(grid, numFeats, seed = 0):
+   '''Scatters numFeats small rectangular polygons over a grid, away from its edges. Returns a dictionary of feature ID -> rings, with outer rings clockwise as in ArcGIS.'''
+   rng = np.random.RandomState(seed)
+   margin = (searchCells + 2) * grid.cellSize
+   x0 = rng.uniform(grid.xmin + margin, grid.xmax - margin, numFeats)
+   y0 = rng.uniform(grid.ymin + margin, grid.ymax - margin, numFeats)
+   w = rng.uniform(1, 4, numFeats) * grid.cellSize
+   h = rng.uniform(1, 4, numFeats) * grid.cellSize
+   feats = {}
+   for i in range(numFeats):
+      feats[i + 1] = [[(x0[i], y0[i]), (x0[i], y0[i] + h[i]), (x0[i] + w[i], y0[i] + h[i]), (x0[i] + w[i], y0[i]), (x0[i], y0[i])]]
+   return feats
+
+def syntheticData(numFeats, seed = 0):
+   '''Returns the flow direction grid, its GridSpec, and the SCU polygons for a benchmark of numFeats features'''
+   side = int(math.ceil(math.sqrt(numFeats * cellsPerFeature)))
+   grid = gridFx.GridSpec(0.0, side * cellSize, cellSize, side, side)
+   fdir = d8FromDEM(syntheticDEM(side, side, seed))
+   return fdir, grid, syntheticSCUs(grid, numFeats, seed)
+
+# Benchmark cases. Each takes the number of features and returns the number of features processed; setup done inside the "setup" stage is excluded from the timing.
+def caseDelineateNumpy(numFeats, truncation = 'buffer'):
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+   with profileFx.stage('run'):
+      catch = d8Fx.traceCatchments(fdir, grid, feats, searchCells * cellSize, truncation)
+      for myID, cells in catch.items():
+         gridFx.cellsToRegions(cells, grid)
+   return len(catch)
+
+def caseDelineateFlowdist(numFeats):
+   return caseDelineateNumpy(numFeats, 'flowdist')
+
+def caseDelineateNested(numFeats):
+   # Three flow distance thresholds from one trace out to the largest
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+   maxDists = [searchCells * cellSize * f for f in (0.25, 0.5, 1.0)]
+   with profileFx.stage('run'):
+      catch = d8Fx.traceCatchments(fdir, grid, feats, maxDists[-1], 'flowdist', True)
+      for myID, (cells, lengths) in catch.items():
+         for threshCells in d8Fx.nestedCatchments(cells, lengths, maxDists):
+            gridFx.cellsToRegions(threshCells, grid)
+   return len(catch)
+
+def caseDelineateTiled(numFeats):
+   # Flow distance truncation traced out of core, through a cache holding a few small tiles
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+      sources = gridFx.rasterizeLabels(feats, grid).zoneCells()
+      tileCache = gridFx.TileCache(lambda r0, r1, c0, c1: fdir[r0:r1, c0:c1], grid, 64, 16 * 64 * 64 * fdir.itemsize)
+   with profileFx.stage('run'):
+      catch = d8Fx.traceTiled(tileCache, sources, searchCells * cellSize)
+      for myID, (cells, lengths) in catch.items():
+         gridFx.cellsToRegions(cells, grid)
+   return len(catch)
+
+def caseDelineateRasterFinish(numFeats):
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+   with profileFx.stage('run'):
+      catch = d8Fx.traceCatchments(fdir, grid, feats, searchCells * cellSize)
+      for myID, cells in catch.items():
+         cells, numParts = d8Fx.finishCatchment(cells, grid, feats[myID], searchCells * cellSize / 3)
+         gridFx.cellsToRegions(cells, grid)
+   return len(catch)
+
+def caseZonalNumpy(numFeats):
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+      catch = d8Fx.traceCatchments(fdir, grid, feats, searchCells * cellSize)
+      rng = np.random.RandomState(1)
+      rasts = [rng.random_sample(grid.shape).astype(np.float32) for i in range(3)]
+   with profileFx.stage('run'):
+      membership = zonalFx.ZoneMembership.fromCellSets(grid, catch)
+      means = []
+      for rast in rasts:
+         st = zonalFx.zonalStats(membership, lambda r0, r1, c0, c1: rast[r0:r1, c0:c1])
+         means.append(st['mean'])
+      table = rankFx.SCUTable(membership.zoneIDs, rng.randint(1, 6, len(membership.zoneIDs)), dict(zip(rankFx.criteria[1:], means)))
+      table.rankArray()
+   return len(membership.zoneIDs)
+
+def caseCoverageNumpy(numFeats):
+   # Portfolio of a tenth of the SCUs covering the most distinct cells, and the overlap of every pair of catchments
+   with profileFx.stage('setup'):
+      fdir, grid, feats = syntheticData(numFeats)
+      catch = d8Fx.traceCatchments(fdir, grid, feats, searchCells * cellSize)
+   with profileFx.stage('run'):
+      index = coverFx.CoverageIndex.fromCellSets(catch, cellSize ** 2)
+      index.greedy(max(1, numFeats // 10))
+      index.overlaps()
+   return len(index)
+
+def caseSensitivityNumpy(numFeats):
+   # 10000 weighting scenarios over an SCU table of numFeats rows
+   with profileFx.stage('setup'):
+      rng = np.random.RandomState(1)
+      table = rankFx.SCUTable(np.arange(numFeats), rng.randint(1, 6, numFeats), dict((c, rng.random_sample(numFeats)) for c in rankFx.criteria[1:]))
+   with profileFx.stage('run'):
+      rankFx.sensitivitySCUs(table, 10000, seed=1)
+   return numFeats
+
+def shapelyPolygons(numFeats):
+   fdir, grid, feats = syntheticData(numFeats)
+   return np.array([geomFx.shapely.polygons(rings[0]) for myID, rings in sorted(feats.items())], dtype=object)
+
+def caseCoalesceShapely(numFeats):
+   with profileFx.stage('setup'):
+      geoms = shapelyPolygons(numFeats)
+   with profileFx.stage('run'):
+      # One group per feature, as in catchment smoothing
+      geomFx.coalesceArray(geoms, np.arange(len(geoms)), cellSize)
+   return len(geoms)
+
+def caseShrinkWrapShapely(numFeats):
+   with profileFx.stage('setup'):
+      geoms = shapelyPolygons(numFeats)
+   with profileFx.stage('run'):
+      geomFx.shrinkWrapArray(geoms, 2 * cellSize, 16 * cellSize)
+   return len(geoms)
+
+def arcpyData(numFeats, workspace):
+   '''Writes the synthetic data for numFeats features to a geodatabase: a flow direction raster "fdir" and a polygon feature class "scus" with an integer ID field "lngID"'''
+   import arcpy
+   fdir, grid, feats = syntheticData(numFeats)
+   sr = arcpy.SpatialReference(26917) # NAD83 / UTM zone 17N
+   gdb = arcpy.CreateFileGDB_management(workspace, 'bench.gdb').getOutput(0)
+   in_FlowDir = gdb + os.sep + 'fdir'
+   arcpy.NumPyArrayToRaster(fdir, arcpy.Point(grid.xmin, grid.ymin), cellSize, cellSize, 0).save(in_FlowDir)
+   arcpy.DefineProjection_management(in_FlowDir, sr)
+   arcpy.CreateFeatureclass_management(gdb, 'scus', 'POLYGON', '', '', '', sr)
+   in_Feats = gdb + os.sep + 'scus'
+   arcpy.AddField_management(in_Feats, 'lngID', 'LONG')
+   cursor = arcpy.da.InsertCursor(in_Feats, ['lngID', 'SHAPE@'])
+   for myID, rings in sorted(feats.items()):
+      cursor.insertRow([myID, arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in rings[0]]), sr)])
+   del cursor
+   return gdb, in_FlowDir, in_Feats
+
+def inScratch(func, numFeats, *args):
+   '''Runs a benchmark using arcpy in a scratch folder of its own, which is deleted afterwards'''
+   workspace = tempfile.mkdtemp(prefix='scuBench_')
+   try:
+      return func(numFeats, workspace, *args)
+   finally:
+      shutil.rmtree(workspace, ignore_errors=True)
+
+def _delineateArcpy(numFeats, workspace, backend):
+   import scuFX
+   with profileFx.stage('setup'):
+      gdb, in_FlowDir, in_Feats = arcpyData(numFeats, workspace)
+   with profileFx.stage('run'):
+      scuFX.delineatePolyCatchments(in_Feats, 'lngID', in_FlowDir, gdb + os.sep + 'catch', '%s METERS' % (searchCells * cellSize), 'in_memory', backend)
+   return numFeats
+
+def caseDelineateArcpy(numFeats):
+   return inScratch(_delineateArcpy, numFeats, 'arcpy')
+
+def caseDelineateArcpyNumpy(numFeats):
+   return inScratch(_delineateArcpy, numFeats, 'numpy')
+
+def caseZonalArcpy(numFeats):
+   return inScratch(_zonalArcpy, numFeats)
+
+def _zonalArcpy(numFeats, workspace):
+   import arcpy, scuFX
+   with profileFx.stage('setup'):
+      gdb, in_FlowDir, in_Feats = arcpyData(numFeats, workspace)
+      in_Catch = gdb + os.sep + 'catch'
+      scuFX.delineatePolyCatchments(in_Feats, 'lngID', in_FlowDir, in_Catch, '%s METERS' % (searchCells * cellSize), 'in_memory', 'numpy')
+      rng = np.random.RandomState(1)
+      desc = arcpy.Describe(in_FlowDir)
+      rasts = []
+      for i in range(3):
+         arr = rng.random_sample((desc.height, desc.width)).astype(np.float32)
+         rasts.append(gdb + os.sep + 'val%s' % i)
+         arcpy.NumPyArrayToRaster(arr, arcpy.Point(desc.extent.XMin, desc.extent.YMin), cellSize, cellSize).save(rasts[-1])
+         arcpy.DefineProjection_management(rasts[-1], desc.spatialReference)
+   with profileFx.stage('run'):
+      scuFX.catchmentZonalStats(in_Catch, 'lngID', range(1, numFeats + 1), rasts)
+   return numFeats
+
+def _geomArcpy(numFeats, workspace, tool, backend):
+   import libConSiteFx
+   with profileFx.stage('setup'):
+      gdb, in_FlowDir, in_Feats = arcpyData(numFeats, workspace)
+   with profileFx.stage('run'):
+      if tool == 'Coalesce':
+         libConSiteFx.Coalesce(in_Feats, '%s METERS' % cellSize, gdb + os.sep + 'out', 'in_memory', backend)
+      else:
+         libConSiteFx.ShrinkWrap(in_Feats, '%s METERS' % (2 * cellSize), gdb + os.sep + 'out', 'in_memory', backend)
+   return numFeats
+
+def caseCoalesceArcpy(numFeats):
+   return inScratch(_geomArcpy, numFeats, 'Coalesce', 'arcpy')
+
+def caseShrinkWrapArcpy(numFeats):
+   return inScratch(_geomArcpy, numFeats, 'ShrinkWrap', 'arcpy')
+
+def arcpyAvailable():
+   try:
+      import arcpy
+      return True
+   except ImportError:
+      return False
+
+def availableCases():
+   '''Returns a list of (benchmark, backend, case function) for every backend that can run here'''
+   cases = [('delineate', 'numpy', caseDelineateNumpy), ('delineate', 'numpy-flowdist', caseDelineateFlowdist), ('delineate', 'numpy-nested3', caseDelineateNested), ('delineate', 'numpy-tiled', caseDelineateTiled), ('delineate', 'numpy-raster', caseDelineateRasterFinish), ('zonal', 'numpy', caseZonalNumpy), ('sensitivity', 'numpy', caseSensitivityNumpy), ('coverage', 'numpy', caseCoverageNumpy)]
+   if geomFx.shapely is not None:
+      cases += [('coalesce', 'shapely', caseCoalesceShapely), ('shrinkwrap', 'shapely', caseShrinkWrapShapely)]
+   if arcpyAvailable():
+      cases += [('delineate', 'arcpy', caseDelineateArcpy), ('delineate', 'arcpy-numpy', caseDelineateArcpyNumpy), ('zonal', 'arcpy', caseZonalArcpy), ('coalesce', 'arcpy', caseCoalesceArcpy), ('shrinkwrap', 'arcpy', caseShrinkWrapArcpy)]
+   return cases
+
+def _runCase(func, numFeats, queue):
+   prof = profileFx.activate(profileFx.Profiler())
+   try:
+      processed = func(numFeats)
+      secs = sum(r['seconds'] for r in prof.records if r['stage'] == 'run')
+      queue.put({'features': processed, 'seconds': secs, 'peakMB': peakRSSMB()})
+   except Exception as e:
+      queue.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+def runCase(func, numFeats, timeout = None):
+   '''Runs one benchmark case in a fresh process. Returns a dictionary of the number of features processed, the time taken (excluding setup), and the peak resident memory of the process, or of the error: the exception raised, the process dying without a result (e.g. killed for running out of memory, or a crash in native code), or the case running longer than timeout seconds, in which case the process is stopped.'''
+   queue = multiprocessing.Queue()
+   proc = multiprocessing.Process(target=_runCase, args=(func, numFeats, queue))
+   proc.start()
+   t0 = time.time()
+   result = None
+   while result is None:
+      try:
+         result = queue.get(timeout=1)
+      except Empty:
+         if not proc.is_alive():
+            # The result may have been put just before the process exited
+            try:
+               result = queue.get(timeout=1)
+            except Empty:
+               result = {'error': 'process died without a result (exit code %s)' % proc.exitcode}
+         elif timeout and time.time() - t0 > timeout:
+            proc.terminate()
+            result = {'error': 'timed out after %s s' % timeout}
+   proc.join()
+   return result
+
+def runBenchmarks(sizes, names = None, maxSeconds = None, timeout = None):
+   '''Runs every available case at each size, smallest first. names optionally restricts the benchmarks run. A case is not run at larger sizes once it has taken more than maxSeconds, and is stopped if it runs for more than timeout seconds. Returns a list of result dictionaries.'''
+   results = []
+   for bench, backend, func in availableCases():
+      if names and bench not in names:
+         continue
+      for numFeats in sorted(sizes):
+         print('Running %s (%s) with %s features...' % (bench, backend, numFeats))
+         res = runCase(func, numFeats, timeout)
+         res.update({'benchmark': bench, 'backend': backend, 'size': numFeats})
+         if 'seconds' in res:
+            res['featsPerSec'] = res['features'] / res['seconds'] if res['seconds'] > 0 else None
+         results.append(res)
+         if 'error' in res:
+            print('   failed: %s' % res['error'])
+            break
+         if maxSeconds and res['seconds'] > maxSeconds:
+            print('   skipping larger sizes (took %.1f s)' % res['seconds'])
+            break
+   addScaling(results)
+   return results
+
+def addScaling(results):
+   '''Adds to each result the scaling exponent of its time from the next smaller size of the same case: the slope of log(time) against log(size), where 1 is linear'''
+   prev = {}
+   for res in results:
+      key = (res['benchmark'], res['backend'])
+      res['scaling'] = None
+      if 'seconds' not in res:
+         continue
+      if key in prev and prev[key]['seconds'] > 0 and res['seconds'] > 0:
+         p = prev[key]
+         res['scaling'] = math.log(res['seconds'] / p['seconds']) / math.log(float(res['size']) / p['size'])
+      prev[key] = res
+
+def reportTable(results):
+   '''Returns the results as a plain text table'''
+   lines = ['%-12s %-16s %8s %10s %12s %10s %8s' % ('Benchmark', 'Backend', 'Features', 'Time (s)', 'Features/s', 'Peak (MB)', 'Scaling')]
+   for res in results:
+      if 'error' in res:
+         lines.append('%-12s %-16s %8s  failed: %s' % (res['benchmark'], res['backend'], res['size'], res['error']))
+         continue
+      fmt = lambda v, f: f % v if v is not None else '-'
+      lines.append('%-12s %-16s %8d %10.2f %12s %10s %8s' % (res['benchmark'], res['backend'], res['size'], res['seconds'], fmt(res['featsPerSec'], '%.1f'), fmt(res['peakMB'], '%.1f'), fmt(res['scaling'], '%.2f')))
+   return '\n'.join(lines)
+
+def compareResults(results, baseline, tolerance = 0.25):
+   '''Compares results with a baseline run (a list of results, as saved with --out). Returns a list of problems: cases that ran in the baseline but fail now, and cases more than tolerance (a fraction) slower than in the baseline. Cases missing from either run are ignored.'''
+   base = dict(((b['benchmark'], b['backend'], b['size']), b) for b in baseline)
+   problems = []
+   for res in results:
+      old = base.get((res['benchmark'], res['backend'], res['size']))
+      if old is None or 'error' in old:
+         continue
+      name = '%s (%s) with %s features' % (res['benchmark'], res['backend'], res['size'])
+      if 'error' in res:
+         problems.append('%s failed: %s' % (name, res['error']))
+      elif res['seconds'] > old['seconds'] * (1 + tolerance):
+         problems.append('%s took %.2f s, against %.2f s in the baseline' % (name, res['seconds'], old['seconds']))
+   return problems
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmarks SCU catchment delineation, zonal statistics, Coalesce and ShrinkWrap on synthetic data.')
+   parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated numbers of features (default: 1000,10000,100000)')
+   parser.add_argument('--only', default='', help='comma-separated benchmarks to run: delineate, zonal, sensitivity, coverage, coalesce, shrinkwrap (default: all)')
+   parser.add_argument('--max-seconds', type=float, default=None, help='stop scaling a case up once a run takes longer than this')
+   parser.add_argument('--timeout', type=float, default=None, help='stop a case that runs longer than this many seconds, and report it as failed')
+   parser.add_argument('--out', default=None, help='optional path of a JSON file for the results')
+   parser.add_argument('--baseline', default=None, help='optional JSON file of earlier results (from --out) to check for regressions')
+   parser.add_argument('--tolerance', type=float, default=0.25, help='fraction by which a case may be slower than the baseline (default: 0.25)')
+   args = parser.parse_args()
+
+   sizes = [int(s) for s in args.sizes.split(',') if s]
+   names = [s for s in args.only.split(',') if s]
+   results = runBenchmarks(sizes, names, args.max_seconds, args.timeout)
+   print(reportTable(results))
+   if args.out:
+      with open(args.out, 'w') as f:
+         json.dump(results, f, indent=1)
+      print('Results saved to %s' % args.out)
+   failed = [res for res in results if 'error' in res]
+   if args.baseline:
+      with open(args.baseline) as f:
+         problems = compareResults(results, json.load(f), args.tolerance)
+      for p in problems:
+         print('Regression: %s' % p)
+      return 1 if problems or failed else 0
+   return 1 if failed else 0
+
+if __name__ == '__main__':
+   sys.exit(main())
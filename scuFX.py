@@ -19,126 +19,694 @@
 # ----------------------------------------------------------------------------------------
 
 # Import modules
-import arcpy
-from arcpy.sa import *
-arcpy.CheckOutExtension("Spatial")
+# arcpy is loaded, and the Spatial Analyst license checked out, only when first used (see backendFx)
+from backendFx import arcpy, sa
 import libConSiteFx
-from libConSiteFx import *
-import os, sys, datetime, traceback
+from libConSiteFx import countFeatures, multiMeasure, measToMapUnits, createTmpWorkspace, printMsg, printWrng, printErr, tback, garbagePickup, readWKB, Coalesce
+import d8Fx, gridFx, zonalFx, rankFx, cacheFx, geomFx, profileFx, writerFx, prefetchFx, coverFx
+import os, sys, re, datetime, time, traceback, math, multiprocessing, hashlib, tempfile, shutil
+import batchFx
+import numpy as np
 
-# Set overwrite option so that existing data may be overwritten
-arcpy.env.overwriteOutput = True
+# Interval, in seconds, at which profiled runs sample resident memory for the peak of each stage (see profileFx)
+profileSampleSec = 0.02
 
-# Define functions used to create toolbox tools
-def delineatePolyCatchments(in_Feats, fld_ID, in_FlowDir, out_Catch, maxDist = '500 METERS', out_Scratch = 'in_memory'):
-   """Delineates catchments individually for each polygon in feature class or layer, out to a maximum distance"""
+# Flow direction rasters kept loaded by warmFlowDir, by the name they were given and by catalog path
+warmRasters = {}
+
+class WarmRaster(object):
+   '''What warmFlowDir keeps of a flow direction raster: its properties, optionally the whole grid (read-only, in memory or memory-mapped from gridFile), tile caches by tile size, its upstream index, and its fingerprint'''
+   def __init__(self, in_FlowDir, loadGrid = False, gridFile = None):
+      desc = arcpy.Describe(in_FlowDir)
+      self.path = desc.catalogPath
+      self.cellSize = arcpy.GetRasterProperties_management(in_FlowDir, "CELLSIZEX").getOutput(0)
+      self.sr = desc.spatialReference
+      self.grid = gridFx.GridSpec(desc.extent.XMin, desc.extent.YMax, float(self.cellSize), desc.height, desc.width)
+      self.fdir = None
+      if gridFile:
+         # Pages of a memory-mapped file are shared by every process mapping it
+         self.fdir = np.load(gridFile, mmap_mode='r')
+      elif loadGrid:
+         self.fdir = arcpy.RasterToNumPyArray(in_FlowDir, arcpy.Point(self.grid.xmin, self.grid.ymin), self.grid.ncols, self.grid.nrows, 0)
+         # Windows are handed out as views, so guard the grid against changes
+         self.fdir.flags.writeable = False
+      self.tileCaches = {}
+      self.upIndex = {}
+      self.fingerprint = None
+
+def warmFlowDir(in_FlowDir, loadGrid = False, useIndex = False, gridFile = None):
+   '''Loads the properties of a flow direction raster and, if loadGrid is True, the whole grid into memory, and keeps them for every later call in this process, so that repeated delineations against the same raster do not describe or read it again. A whole statewide grid takes a lot of memory; gridFile, a .npy copy of the grid written by saveFlowDir, is memory-mapped instead of loading it, so that processes warming the same raster share one copy. If useIndex is True, its upstream index is loaded (or built) as well. Returns the time taken, in seconds.
+   The raster is assumed not to change while it is warm; call coolFlowDir to let it go.'''
+   t0 = time.time()
+   warm = WarmRaster(in_FlowDir, loadGrid, gridFile)
+   warmRasters[in_FlowDir] = warm
+   warmRasters[warm.path] = warm
+   if useIndex:
+      loadUpstreamIndex(in_FlowDir)
+   return time.time() - t0
+
+def saveFlowDir(in_FlowDir, out_File, blockRows = 4096):
+   '''Copies a flow direction raster to a .npy file, for warmFlowDir to memory-map, reading it a block of rows at a time. NoData is written as 0. Returns the time taken, in seconds.'''
+   t0 = time.time()
+   fullGrid = rasterGrid(in_FlowDir)
+   out = None
+   for r0 in range(0, fullGrid.nrows, blockRows):
+      blockGrid = fullGrid.subGrid(r0, min(r0 + blockRows, fullGrid.nrows), 0, fullGrid.ncols)
+      block = arcpy.RasterToNumPyArray(in_FlowDir, arcpy.Point(blockGrid.xmin, blockGrid.ymin), blockGrid.ncols, blockGrid.nrows, 0)
+      if out is None:
+         out = np.lib.format.open_memmap(out_File, mode='w+', dtype=block.dtype, shape=(fullGrid.nrows, fullGrid.ncols))
+      out[r0:r0 + blockGrid.nrows] = block
+   if out is not None:
+      out.flush()
+      del out
+   return time.time() - t0
+
+def coolFlowDir(in_FlowDir = None):
+   '''Forgets a raster kept by warmFlowDir, or all of them'''
+   if in_FlowDir is None:
+      warmRasters.clear()
+      return
+   warm = warmRasters.get(in_FlowDir)
+   for key in [k for k, w in warmRasters.items() if w is warm]:
+      del warmRasters[key]
+
+def rasterProperties(in_FlowDir):
+   '''Returns the cell size (as text) and spatial reference of a raster'''
+   warm = warmRasters.get(in_FlowDir)
+   if warm is not None:
+      return warm.cellSize, warm.sr
+   return arcpy.GetRasterProperties_management(in_FlowDir, "CELLSIZEX").getOutput(0), arcpy.Describe(in_FlowDir).spatialReference
+
+# Define helper functions for moving between arcpy and in-memory (NumPy) representations
+def rasterGrid(in_Rast):
+   '''Returns a GridSpec describing the full extent and cell size of a raster'''
+   warm = warmRasters.get(in_Rast)
+   if warm is not None:
+      return warm.grid
+   desc = arcpy.Describe(in_Rast)
+   cellSize = float(arcpy.GetRasterProperties_management(in_Rast, "CELLSIZEX").getOutput(0))
+   return gridFx.GridSpec(desc.extent.XMin, desc.extent.YMax, cellSize, desc.height, desc.width)
+
+def rasterBlockReader(in_Rast):
+   '''Returns a function reading blocks (row0, row1, col0, col1) of a raster as floating point arrays, with NoData as NaN'''
+   fullGrid = rasterGrid(in_Rast)
+   noData = arcpy.Raster(in_Rast).noDataValue
+   def readBlock(r0, r1, c0, c1):
+      blockGrid = fullGrid.subGrid(r0, r1, c0, c1)
+      lowerLeft = arcpy.Point(blockGrid.xmin, blockGrid.ymin)
+      if noData is None:
+         return arcpy.RasterToNumPyArray(in_Rast, lowerLeft, blockGrid.ncols, blockGrid.nrows).astype(float)
+      arr = arcpy.RasterToNumPyArray(in_Rast, lowerLeft, blockGrid.ncols, blockGrid.nrows, noData).astype(float)
+      arr[arr == noData] = np.nan
+      return arr
+   return readBlock
+
+def readFlowDir(in_FlowDir, extent = None):
+   '''Reads the window of a flow direction raster covering extent (xmin, ymin, xmax, ymax), or the whole raster, into a NumPy array. Returns the array and its GridSpec. NoData is read as 0. If the raster was loaded by warmFlowDir, the window is a read-only view of the grid in memory.'''
+   fullGrid = rasterGrid(in_FlowDir)
+   if extent is None:
+      r0, r1, c0, c1 = 0, fullGrid.nrows, 0, fullGrid.ncols
+   else:
+      r0, r1, c0, c1 = fullGrid.window(*extent)
+   grid = fullGrid.subGrid(r0, r1, c0, c1)
+   warm = warmRasters.get(in_FlowDir)
+   if warm is not None and warm.fdir is not None:
+      return warm.fdir[r0:r1, c0:c1], grid
+   lowerLeft = arcpy.Point(grid.xmin, grid.ymin)
+   fdir = arcpy.RasterToNumPyArray(in_FlowDir, lowerLeft, grid.ncols, grid.nrows, 0)
+   return fdir, grid
+
+def flowDirTileCache(in_FlowDir, tileSize = 512, maxMB = 256):
+   '''Sets up a TileCache serving windows of a flow direction raster, which is read from disk one tile at a time as windows are requested. If the raster was loaded by warmFlowDir, tiles are cut from the grid in memory, or, if only its properties were loaded, the cache is kept with it so that its tiles stay loaded for later runs.'''
+   warm = warmRasters.get(in_FlowDir)
+   if warm is not None and (tileSize, maxMB) in warm.tileCaches:
+      return warm.tileCaches[(tileSize, maxMB)]
+   fullGrid = rasterGrid(in_FlowDir)
+   def readTile(r0, r1, c0, c1):
+      if warm is not None and warm.fdir is not None:
+         # A copy, so that the cache holds (and accounts for) the memory of its own tiles, and a memory-mapped grid is read once
+         return np.array(warm.fdir[r0:r1, c0:c1])
+      tileGrid = fullGrid.subGrid(r0, r1, c0, c1)
+      return arcpy.RasterToNumPyArray(in_FlowDir, arcpy.Point(tileGrid.xmin, tileGrid.ymin), tileGrid.ncols, tileGrid.nrows, 0)
+   # Tiles read through arcpy must not be prefetched, as arcpy cannot be called from other threads
+   tileCache = gridFx.TileCache(readTile, fullGrid, tileSize, maxMB * 2**20, threadSafe=warm is not None and warm.fdir is not None)
+   if warm is not None:
+      warm.tileCaches[(tileSize, maxMB)] = tileCache
+   return tileCache
+
+def prefetchDepth(tileCache, prefetch):
+   '''Returns the number of windows to read ahead from tileCache: prefetch, or 0 if its tiles cannot be read on another thread'''
+   if prefetch and not tileCache.threadSafe:
+      printMsg('Flow direction tiles are read through arcpy, which cannot run on another thread, so windows are not read ahead')
+      return 0
+   return prefetch
+
+def printCacheStats(tileCache):
+   '''Prints the hit and miss counts of a TileCache'''
+   st = tileCache.stats()
+   printMsg('Flow direction tile cache: %s hits, %s misses, %s evictions (hit rate %.1f%%)' % (st['hits'], st['misses'], st['evictions'], 100 * st['hitRate']))
+
+def shapeToRings(myShape):
+   '''Converts an arcpy polygon to a list of rings of (x, y) tuples'''
+   rings = []
+   for part in myShape:
+      ring = []
+      for pnt in part:
+         if pnt is None:
+            # A null point separates an outer ring from the interior rings that follow it
+            rings.append(ring)
+            ring = []
+         else:
+            ring.append((pnt.X, pnt.Y))
+      rings.append(ring)
+   return rings
+
+def cellsToPolygons(cells, grid, sr):
+   '''Traces a set of grid cells out to arcpy polygons, one per group of connected cells, as RasterToPolygon does'''
+   polys = []
+   for region in gridFx.cellsToRegions(cells, grid):
+      arr = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for (x, y) in ring]) for ring in region])
+      polys.append(arcpy.Polygon(arr, sr))
+   return polys
+
+def cellsToPolygon(cells, grid, sr):
+   '''Traces a set of grid cells out to a single arcpy polygon, with one part per group of connected cells'''
+   rings = [ring for region in gridFx.cellsToRegions(cells, grid) for ring in region]
+   arr = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for (x, y) in ring]) for ring in rings])
+   return arcpy.Polygon(arr, sr)
+
+def bufferLookup(grid, window, rings, searchDist):
+   '''Returns a function telling which of a set of flat cell indices of grid, all within window, lie in the buffer of a polygon by searchDist (see gridFx.bufferMask)'''
+   r0, r1, c0, c1 = window
+   inBuffer = gridFx.bufferMask(rings, grid.subGrid(r0, r1, c0, c1), searchDist)
+   def test(cells):
+      rows, cols = grid.flatToRowCol(cells)
+      return inBuffer[rows - r0, cols - c0]
+   return test
+
+def traceCatchmentsD8(in_Feats, fld_ID, in_FlowDir, searchDist, truncation = 'buffer', tileCache = None, ids = None, upIndex = None, prefetch = 0, tiled = False, clusterCells = 2**24):
+   '''Delineates catchments for all features with the in-memory D8 engine. Returns a dictionary of feature ID -> (catchment cells, GridSpec of the window the cells index into, flow lengths of the cells or None).
+   truncation: "buffer" traces each full catchment within searchDist map units of its feature, as the per-feature clip of the flow direction raster to the processing buffer does. "flowdist" keeps only cells whose flow length down to the feature is within searchDist, and returns those flow lengths, so that catchments for shorter distances can be cut from the same trace (see d8Fx.nestedCatchments).
+   tileCache: if given, features are traced one at a time, in Hilbert order, on windows served from the cache. Otherwise features are grouped in Hilbert order into clusters whose windows (extending searchDist and a cell beyond their features) hold at most clusterCells cells, or one feature, and one window is read for each cluster.
+   prefetch: with tileCache, the number of windows read ahead on a background thread while the current feature is traced (see prefetchFx). 0 reads each window when it is needed, as does a tile cache reading through arcpy.
+   ids: if given, only features with these IDs are traced.
+   upIndex: if given, a d8Fx.UpstreamIndex of in_FlowDir, which is then not read at all; each catchment is found by walking the index upstream from its feature.
+   tiled: if True, with tileCache, all features are traced together one tile at a time, passing catchments that cross tile boundaries on to the next tile (see d8Fx.traceTiled), so that memory is bounded by the tile cache however large the raster or the windows.'''
+   feats = [(row[0], shapeToRings(row[1])) for row in arcpy.da.SearchCursor(in_Feats, [fld_ID, "SHAPE@"]) if ids is None or row[0] in ids]
+   ext = [gridFx.ringsExtent(rings) for (myID, rings) in feats]
+   catchCells = {}
+   # Windows read for tracing extend one cell further, to hold the source cells touched by features and what drains to them (see d8Fx.traceCatchments)
+   cellSize = rasterGrid(in_FlowDir).cellSize
+   readDist = searchDist + cellSize
+
+   if upIndex is not None:
+      printMsg('Tracing catchments for %s features with the upstream index...' % len(feats))
+      grid = upIndex.grid
+      sources = gridFx.rasterizeLabels(dict(feats), grid).zoneCells()
+      for (myID, rings), e in zip(feats, ext):
+         if truncation == 'flowdist':
+            cells, lengths = upIndex.upstream(sources[myID], searchDist)
+         else:
+            window = grid.window(e[0] - searchDist, e[1] - searchDist, e[2] + searchDist, e[3] + searchDist)
+            cells, lengths = upIndex.upstream(sources[myID], window=window, allowed=bufferLookup(grid, window, rings, searchDist))[0], None
+         catchCells[myID] = (cells, grid, lengths)
+      return catchCells
+
+   if tileCache is not None and tiled:
+      printMsg('Tracing catchments for %s features tile by tile...' % len(feats))
+      grid = tileCache.grid
+      sources = gridFx.rasterizeLabels(dict(feats), grid).zoneCells()
+      if truncation == 'flowdist':
+         traced = d8Fx.traceTiled(tileCache, sources, searchDist)
+      else:
+         windows = dict((myID, grid.window(e[0] - searchDist, e[1] - searchDist, e[2] + searchDist, e[3] + searchDist)) for (myID, rings), e in zip(feats, ext))
+         tests = dict((myID, gridFx.bufferTest(grid, rings, searchDist)) for myID, rings in feats)
+         traced = d8Fx.traceTiled(tileCache, sources, windows=windows, allowed=tests)
+      for myID, rings in feats:
+         cells, lengths = traced[myID]
+         if truncation != 'flowdist':
+            lengths = None
+         catchCells[myID] = (cells, grid, lengths)
+      printCacheStats(tileCache)
+      return catchCells
+
+   def addTraced(traced, grid):
+      for myID, t in traced.items():
+         if truncation == 'flowdist':
+            catchCells[myID] = (t[0], grid, t[1])
+         else:
+            catchCells[myID] = (t, grid, None)
+
+   if truncation == 'flowdist':
+      printMsg('Tracing upstream cells within a flow length of %s for %s features...' % (searchDist, len(feats)))
+   else:
+      printMsg('Tracing upstream cells for %s features...' % len(feats))
+   order = gridFx.hilbertOrder([0.5 * (e[0] + e[2]) for e in ext], [0.5 * (e[1] + e[3]) for e in ext])
+
+   if tileCache is not None:
+      prefetcher = prefetchFx.Prefetcher(lambda i: tileCache.readExtent(ext[i][0] - readDist, ext[i][1] - readDist, ext[i][2] + readDist, ext[i][3] + readDist), order, prefetchDepth(tileCache, prefetch))
+      for i, fetchWindow in prefetcher:
+         myID, rings = feats[i]
+         fdir, grid = fetchWindow()
+         addTraced(d8Fx.traceCatchments(fdir, grid, {myID: rings}, searchDist, truncation, True), grid)
+      printMsg(prefetcher.report())
+      return catchCells
+
+   # Group neighbouring features into clusters, each read as one window of bounded size
+   clusters = []
+   for i in order:
+      e = ext[i]
+      if clusters:
+         c = clusters[-1]
+         box = (min(c[1][0], e[0]), min(c[1][1], e[1]), max(c[1][2], e[2]), max(c[1][3], e[3]))
+         if ((box[2] - box[0] + 2 * readDist) / cellSize + 1) * ((box[3] - box[1] + 2 * readDist) / cellSize + 1) <= clusterCells:
+            clusters[-1] = (c[0] + [i], box)
+            continue
+      clusters.append(([i], e))
+   printMsg('Reading flow direction windows for %s clusters of features...' % len(clusters))
+   for members, box in clusters:
+      fdir, grid = readFlowDir(in_FlowDir, (box[0] - readDist, box[1] - readDist, box[2] + readDist, box[3] + readDist))
+      addTraced(d8Fx.traceCatchments(fdir, grid, dict(feats[i] for i in members), searchDist, truncation, True), grid)
+      del fdir
+   return catchCells
+
+def thresholdCells(traced, threshDists):
+   '''Given one entry of the result of traceCatchmentsD8, traced out to the largest of threshDists (in map units), returns the catchment cells to use for each distance in threshDists. Catchments truncated by flow length are cut down to each distance. Catchments traced within a buffer window are returned whole for every distance, and are clipped to each distance later; since the window is that of the largest distance, the catchment for a smaller distance can reach further round the edge of its buffer than it would in a run with that distance alone.'''
+   cells, grid, lengths = traced
+   if lengths is None:
+      return [cells] * len(threshDists)
+   return d8Fx.nestedCatchments(cells, lengths, threshDists)
+
+def distanceList(maxDist):
+   '''Returns a list of the linear units in maxDist, which may be a single linear unit such as "500 METERS", a list of them, or a semicolon-separated string of them as passed by a multivalue tool parameter'''
+   if isinstance(maxDist, (list, tuple)):
+      return [str(d).strip() for d in maxDist]
+   return [d.strip().strip("'\"") for d in str(maxDist).split(';') if d.strip().strip("'\"")]
+
+def thresholdName(out_Catch, maxDist):
+   '''Returns the name of the output for one distance threshold: out_Catch with the distance added, e.g. scuCatch_500_METERS'''
+   root, ext = os.path.splitext(out_Catch)
+   if ext.lower() not in ('.shp', '.gpkg', '.parquet', '.fgb'):
+      root, ext = out_Catch, ''
+   return '%s_%s%s' % (root, re.sub(r'\W+', '_', maxDist).strip('_'), ext)
+
+def catchmentShapes(in_Catch, fld_ID, ids, threshold = None):
+   '''Returns a dictionary of feature ID -> catchment geometry for the features of in_Catch whose IDs are in ids.
+   in_Catch may hold catchments for several distances, one feature per input feature and distance with the distance in a Threshold field (see delineatePolyCatchments). threshold then chooses the distance to use, as written in that field (e.g. "500 METERS"); it may only be left out if in_Catch holds a single distance.'''
+   ids = set(ids)
+   hasThreshold = 'threshold' in [f.name.lower() for f in arcpy.ListFields(in_Catch)]
+   if threshold is not None and not hasThreshold:
+      raise ValueError('%s has no Threshold field to select %s from' % (in_Catch, threshold))
+   shapes = {}
+   found = set()
+   for row in arcpy.da.SearchCursor(in_Catch, [fld_ID, "SHAPE@"] + (['Threshold'] if hasThreshold else [])):
+      if hasThreshold:
+         found.add(row[2])
+         if threshold is not None and row[2] != str(threshold):
+            continue
+      if row[0] in ids and row[1] is not None:
+         shapes[row[0]] = row[1]
+   if hasThreshold and threshold is None and len(found) > 1:
+      raise ValueError('%s holds catchments for several distances (%s); choose one with threshold' % (in_Catch, ', '.join(sorted(str(t) for t in found))))
+   if threshold is not None and str(threshold) not in found:
+      raise ValueError('%s holds no catchments for %s' % (in_Catch, threshold))
+   return shapes
+
+def catchmentZonalStats(in_Catch, fld_ID, ids, in_Rasts, stat = 'mean', threshold = None):
+   '''Computes a zonal statistic of each raster in in_Rasts within the catchment of each feature whose ID is in ids, at distance threshold if in_Catch holds several (see catchmentShapes). Catchments may overlap. They are burned into each raster's grid once, as a sparse membership list shared by rasters on the same grid, and each raster is then read a single time in blocks. Returns a list, ordered as in_Rasts, of dictionaries of feature ID -> statistic (None where the catchment holds no data).'''
+   catchShapes = catchmentShapes(in_Catch, fld_ID, ids, threshold)
+   printMsg('Getting zonal statistics for %s catchments...' % len(catchShapes))
+
+   memberships = {}
+   results = []
+   for in_Rast in in_Rasts:
+      grid = rasterGrid(in_Rast)
+      sr = arcpy.Describe(in_Rast).spatialReference
+      key = (repr(grid), sr.name)
+      if key not in memberships:
+         printMsg('Burning catchments into a %s by %s grid...' % (grid.nrows, grid.ncols))
+         polys = {}
+         for myID, myShape in catchShapes.items():
+            if myShape.spatialReference.name != sr.name:
+               myShape = myShape.projectAs(sr)
+            polys[myID] = shapeToRings(myShape)
+         memberships[key] = zonalFx.ZoneMembership.fromPolygons(grid, polys)
+      membership = memberships[key]
+      printMsg('Reading %s...' % in_Rast)
+      st = zonalFx.zonalStats(membership, rasterBlockReader(in_Rast))
+      vals = {}
+      for myID, v in zip(st['ids'], st[stat]):
+         vals[myID] = None if np.isnan(v) else float(v)
+      results.append(vals)
+   return results
+
+def rasterFingerprint(in_Rast):
+   '''Returns a fingerprint of the current state of a raster, built from its path, georeferencing, and the sizes and modification times of the files holding it. Any edit to the raster changes the fingerprint. For a raster loaded by warmFlowDir, the fingerprint is only worked out once.'''
+   warm = warmRasters.get(in_Rast)
+   if warm is not None:
+      if warm.fingerprint is None:
+         warm.fingerprint = _rasterFingerprint(in_Rast)
+      return warm.fingerprint
+   return _rasterFingerprint(in_Rast)
+
+def _rasterFingerprint(in_Rast):
+   desc = arcpy.Describe(in_Rast)
+   path = desc.catalogPath
+   cellSize = arcpy.GetRasterProperties_management(in_Rast, "CELLSIZEX").getOutput(0)
+   parts = [path, str(desc.extent.XMin), str(desc.extent.YMax), str(desc.height), str(desc.width), cellSize, desc.spatialReference.name]
+
+   # A raster in a geodatabase has no files of its own, so fall back to the files of its container.
+   # This also changes the fingerprint when other datasets in the geodatabase are edited, which is safe but not free.
+   target = path
+   while target and not os.path.exists(target):
+      target = os.path.dirname(target)
+   files = []
+   if os.path.isfile(target):
+      folder, name = os.path.split(target)
+      base = os.path.splitext(name)[0]
+      files = [os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(base)]
+   elif target:
+      for dirPath, dirNames, fileNames in os.walk(target):
+         files.extend([os.path.join(dirPath, f) for f in fileNames if not f.endswith('.lock')])
+   for f in sorted(files):
+      st = os.stat(f)
+      parts.append('%s:%s:%s' % (os.path.relpath(f, target if os.path.isdir(target) else os.path.dirname(target)), st.st_size, int(st.st_mtime)))
+   return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+def upstreamIndexPath(in_FlowDir):
+   '''Returns the folder in which the upstream index of a flow direction raster is kept: beside the raster, or beside its geodatabase. The folder name does not start with the raster\'s own name, so that writing the index does not change rasterFingerprint.'''
+   path = arcpy.Describe(in_FlowDir).catalogPath
+   folder, name = os.path.split(path)
+   gdb = folder
+   while gdb and not gdb.lower().endswith('.gdb') and os.path.dirname(gdb) != gdb:
+      gdb = os.path.dirname(gdb)
+   if gdb.lower().endswith('.gdb'):
+      folder, gdbName = os.path.split(gdb)
+      name = '%s_%s' % (os.path.splitext(gdbName)[0], name)
+   return os.path.join(folder, 'upidx_' + name)
+
+def loadUpstreamIndex(in_FlowDir, withDist = False):
+   '''Loads the persistent upstream index of a flow direction raster (see d8Fx.UpstreamIndex), memory-mapped. If there is none yet, or the raster has changed since it was built, the whole raster is read once and a new index is built and saved. For a raster loaded by warmFlowDir, the index is kept once loaded.'''
+   warm = warmRasters.get(in_FlowDir)
+   if warm is not None:
+      # An index built with outlet distances serves requests without them too
+      for key in (True, withDist):
+         if key in warm.upIndex:
+            return warm.upIndex[key]
+      warm.upIndex[withDist] = _loadUpstreamIndex(in_FlowDir, withDist)
+      return warm.upIndex[withDist]
+   return _loadUpstreamIndex(in_FlowDir, withDist)
+
+def _loadUpstreamIndex(in_FlowDir, withDist = False):
+   indexDir = upstreamIndexPath(in_FlowDir)
+   fingerprint = rasterFingerprint(in_FlowDir)
+   upIndex = d8Fx.UpstreamIndex.load(indexDir, fingerprint)
+   if upIndex is not None and (upIndex.outletDist is not None or not withDist):
+      printMsg('Using upstream index in %s' % indexDir)
+      return upIndex
+   printMsg('Building upstream index for %s...' % in_FlowDir)
+   fdir, grid = readFlowDir(in_FlowDir)
+   d8Fx.UpstreamIndex.build(fdir, grid, withDist, fingerprint).save(indexDir)
+   del fdir
+   printMsg('Upstream index saved to %s' % indexDir)
+   return d8Fx.UpstreamIndex.load(indexDir, fingerprint)
+
+def catchmentKeys(geomBytes, maxDists, cellSize, fdirPrint, truncation, finish, backend, geomBackend):
+   '''Returns the catchment cache keys of one feature, one per distance in maxDists (see cacheFx.catchmentKey). With buffer truncation, every catchment is traced in a window of 3 times the largest distance, so the window goes into the keys as well.'''
+   extra = (truncation, finish, backend, geomBackend)
+   if truncation == 'buffer':
+      extra += (multiMeasure(maxDists[-1], 3)[2],)
+   return [cacheFx.catchmentKey(geomBytes, d, cellSize, fdirPrint, *extra) for d in maxDists]
+
+def reportFailure(myID):
+   '''Prints the messages for a feature that failed to process'''
+   # Add failure message
+   printMsg("\nFailed to fully process feature " + str(myID))
+
+   # Error handling code swiped from "A Python Primer for ArcGIS"
+   tb = sys.exc_info()[2]
+   tbinfo = traceback.format_tb(tb)[0]
+   pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
+   msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
+
+   printWrng(msgs)
+   printWrng(pymsg)
+   printMsg(arcpy.GetMessages(1))
+
+   # Add status message
+   printMsg("\nMoving on to the next feature.  Note that the output will be incomplete.")
+
+def processCatchments(in_Catch, fld_ID, in_FlowDir, maxDist, out_Scratch = 'in_memory', backend = 'arcpy', truncation = 'buffer', tileSize = 0, cacheDir = None, geomBackend = 'arcpy', finish = 'vector', useIndex = False, prefetch = 0, tiled = False):
+   '''Delineates the catchment of each feature in in_Catch, which must already match the flow direction raster's coordinate system. This is the per-feature loop behind delineatePolyCatchments. Returns the list of feature IDs that failed, a list for each distance threshold of the IDs whose output is suspect, and a dictionary for each threshold of feature ID -> catchment geometry, for writing out in bulk (see writeCatchments). Features that failed have no geometry.
+   If tileSize is greater than 0, flow direction windows are served from a cache of tiles of that many cells square instead of being clipped from the raster for each feature, and features are processed in Hilbert order so that neighbouring features reuse cached tiles.
+   If cacheDir is given, finished catchments are kept in a persistent cache there, keyed by the feature geometry, maxDist, cell size, truncation and finishing methods, and a fingerprint of in_FlowDir. Features found in the cache are not recomputed.
+   If geomBackend is "shapely", the smoothing check is run on all catchments together after the loop, in memory, instead of running Coalesce once per feature.
+   If finish is "raster" (numpy backend only), catchments are clipped, cleaned and checked on their cells (see d8Fx.finishCatchment) and polygonized directly, with no vector tools or scratch datasets.
+   If useIndex is True (numpy backend only), catchments are traced on the persistent upstream index of in_FlowDir (see loadUpstreamIndex), which is built first if need be.
+   If prefetch is greater than 0 and windows come from the tile cache, the windows for the next prefetch features are read on a background thread while the current feature is processed (see prefetchFx), and the time spent waiting for them is reported.
+   If tiled is True (numpy backend, with tileSize greater than 0), catchments are traced out of core, one tile at a time, with catchments crossing tile boundaries stitched together by passing their inflow on to the neighbouring tiles (see d8Fx.traceTiled). Only the tiles in the cache are held in memory, whatever the size of the raster.
+   maxDist may also be a list of distances. Each catchment is then traced once, out to the largest distance, and the catchments for the other distances are cut from it: by flow length with "flowdist" truncation, and by clipping to the buffer of each distance otherwise. With buffer truncation, every catchment is therefore traced within the window of the largest distance (3 times it), not its own, so catchments for the smaller distances can differ from those of single-distance runs where flow enters their buffer from outside their own window. The suspect lists and geometries are returned in the order of maxDist.'''
    # Get cell size and output spatial reference from in_FlowDir
-   cellSize = (arcpy.GetRasterProperties_management(in_FlowDir, "CELLSIZEX")).getOutput(0)
-   srRast = arcpy.Describe(in_FlowDir).spatialReference
+   cellSize, srRast = rasterProperties(in_FlowDir)
    linUnit = srRast.linearUnitName
-   printMsg('Cell size of flow direction raster is %s %ss' %(cellSize, linUnit))
-   printMsg('Catchment delineation is strongly dependent on cell size.')
+
+   # Work through the distance thresholds smallest first. Catchments are traced out to the largest distance.
+   if isinstance(maxDist, (list, tuple)):
+      inDists = list(maxDist)
+   else:
+      inDists = [maxDist]
+   threshOrder = sorted(range(len(inDists)), key=lambda k: measToMapUnits(inDists[k], srRast.metersPerUnit))
+   maxDists = [inDists[k] for k in threshOrder]
+   threshDists = [measToMapUnits(d, srRast.metersPerUnit) for d in maxDists]
+   maxDist = maxDists[-1]
 
    # Set environment setting and other variables
    arcpy.env.snapRaster = in_FlowDir
    dist, units, procDist = multiMeasure(maxDist, 3)
 
-   # Check if input features and input flow direction have same spatial reference.
-   # If so, just make a copy. If not, reproject features to match raster.
-   srFeats = arcpy.Describe(in_Feats).spatialReference
-   if srFeats.Name == srRast.Name:
-      printMsg('Coordinate systems for features and raster are the same. Copying...')
-      arcpy.CopyFeatures_management (in_Feats, out_Catch)
+   # Set up the tile cache if requested
+   if int(tileSize) > 0:
+      tileCache = flowDirTileCache(in_FlowDir, int(tileSize))
    else:
-      printMsg('Reprojecting features to match raster...')
-      # Check if geographic transformation is needed, and handle accordingly.
-      if srFeats.GCS.Name == srRast.GCS.Name:
-         geoTrans = ""
-         printMsg('No geographic transformation needed...')
-      else:
-         transList = arcpy.ListTransformations(srFeats,srRast)
-         geoTrans = transList[0]
-      arcpy.Project_management (in_Feats, out_Catch, srRast, geoTrans)
+      tileCache = None
 
    # Create an empty list to store IDs of features that fail to get processed
    myFailList = []
+   flags = [[] for d in maxDists] # Initialize empty lists to keep track of suspects, by threshold
+   finalShapes = [{} for d in maxDists] # Final shapes by threshold are written back after the loop
+   elimShapes = {} # Catchment parts awaiting batch smoothing, by (threshold, feature ID)
 
-   # Set up processing cursor and loop
-   flags = [] # Initialize empty list to keep track of suspects
-   cursor = arcpy.da.UpdateCursor(out_Catch, [fld_ID, "SHAPE@"])
-   for row in cursor:
-      try:
-         # Extract the unique ID and geometry object
-         myID = row[0]
-         myShape = row[1]
+   # Get the features to process. When windows come from the tile cache, put them in Hilbert order.
+   feats = [(row[0], row[1]) for row in arcpy.da.SearchCursor(in_Catch, [fld_ID, "SHAPE@"])]
+   if tileCache is not None:
+      order = gridFx.hilbertOrder([f[1].centroid.X for f in feats], [f[1].centroid.Y for f in feats])
+      feats = [feats[i] for i in order]
+
+   # Serve unchanged features from the catchment cache, if one is in use
+   cacheKeys = {}
+   if cacheDir:
+      catchCache = cacheFx.ResultCache(cacheDir)
+      fdirPrint = rasterFingerprint(in_FlowDir)
+      for myID, myShape in feats:
+         cacheKeys[myID] = catchmentKeys(myShape.WKB, maxDists, cellSize, fdirPrint, truncation, finish, backend, geomBackend)
+         entries = [catchCache.get(key) for key in cacheKeys[myID]]
+         # A feature is only served from the cache if its catchments for all thresholds are there
+         if None not in entries:
+            for k, entry in enumerate(entries):
+               finalShapes[k][myID] = arcpy.FromWKB(entry['wkb'])
+               if entry['suspect']:
+                  flags[k].append(myID)
+      feats = [f for f in feats if f[0] not in finalShapes[0]]
+      printMsg('%s catchments served from cache; %s to compute' % (len(finalShapes[0]), len(feats)))
+
+   # For the numpy backend, delineate all remaining catchments up front
+   if backend == 'numpy' and feats:
+      if truncation == 'flowdist':
+         searchDist = measToMapUnits(maxDist, srRast.metersPerUnit)
+      else:
+         searchDist = measToMapUnits(procDist, srRast.metersPerUnit)
+      with profileFx.stage('trace') as rec:
+         if useIndex:
+            upIndex = loadUpstreamIndex(in_FlowDir)
+         else:
+            upIndex = None
+         catchCells = traceCatchmentsD8(in_Catch, fld_ID, in_FlowDir, searchDist, truncation, tileCache, set(f[0] for f in feats), upIndex, prefetch, tiled)
+         rec['cells'] = sum(len(c[0]) for c in catchCells.values())
+
+   # Finish catchments on their cells instead of running the vector tools below
+   if finish == 'raster' and feats:
+      printMsg('Finishing %s catchments in raster space...' % len(feats))
+      for myID, myShape in feats:
+         try:
+            profileFx.setFeature(myID)
+            flowGrid = catchCells[myID][1]
+            srcRings = shapeToRings(myShape)
+            myShapes = []
+            for k, cells in enumerate(thresholdCells(catchCells[myID], threshDists)):
+               if truncation == 'flowdist':
+                  clipDist = None
+               else:
+                  clipDist = threshDists[k]
+               with profileFx.stage('finish', cells=len(cells)):
+                  cells, numParts = d8Fx.finishCatchment(cells, flowGrid, srcRings, clipDist)
+               if len(cells) == 0:
+                  raise ValueError('Catchment of feature %s is empty' % str(myID))
+               
+               # Check the number of parts after smoothing. 
+               # It should be just one. If more, the output is likely bad and should be flagged.
+               if numParts > 1:
+                  printWrng('Output is suspect for feature %s' % str(myID))
+                  flags[k].append(myID)
+               with profileFx.stage('polygonize', cells=len(cells)) as rec:
+                  myShapes.append(cellsToPolygon(cells, flowGrid, srRast))
+                  rec['vertices'] = myShapes[-1].pointCount
+            for k, shp in enumerate(myShapes):
+               finalShapes[k][myID] = shp
+         except:
+            myFailList.append(myID)
+            reportFailure(myID)
+      profileFx.setFeature(None)
+      loopFeats = []
+   else:
+      loopFeats = feats
+
+   # With the tile cache, the flow direction window covering each feature's processing buffer can be read ahead, while earlier features are processed. 
+   # Geoprocessing tools cannot run on other threads, so the per-feature clip is not prefetched, nor are tiles the cache reads through arcpy.
+   if backend == 'arcpy' and tileCache is not None:
+      procDistMap = measToMapUnits(procDist, srRast.metersPerUnit)
+      procWindows = {}
+      for myID, myShape in loopFeats:
+         ext = myShape.extent
+         procWindows[myID] = (ext.XMin - procDistMap, ext.YMin - procDistMap, ext.XMax + procDistMap, ext.YMax + procDistMap)
+      prefetcher = prefetchFx.Prefetcher(lambda f: tileCache.readExtent(*procWindows[f[0]]), loopFeats, prefetchDepth(tileCache, prefetch))
+   else:
+      prefetcher = prefetchFx.Prefetcher(lambda f: None, loopFeats, 0)
 
+   # Set up processing loop
+   for (myID, myShape), fetchWindow in prefetcher:
+      try:
          printMsg('Working on feature %s' %str(myID))
+         profileFx.setFeature(myID)
 
-         # Process:  Select (Analysis)
-         # Create a temporary feature class including only the current feature
-         selQry = "%s = %s" % (fld_ID, str(myID))
-         tmpFeat = out_Scratch + os.sep + 'tmpFeat'
-         arcpy.Select_analysis (out_Catch, tmpFeat, selQry)
-
-         # Convert feature to raster
-         printMsg('Converting feature to raster...')
-         srcRast = out_Scratch + os.sep + 'srcRast'
-         arcpy.PolygonToRaster_conversion (tmpFeat, fld_ID, srcRast, "MAXIMUM_COMBINED_AREA", fld_ID, cellSize)
-
-         # Restrict processing area to avoid ridiculous processing time
-         procBuff = out_Scratch + os.sep + 'procBuff'
-         printMsg('Buffering feature to set maximum processing distance')
-         arcpy.Buffer_analysis (tmpFeat, procBuff, procDist, "", "", "ALL", "")
-         myExtent = str(arcpy.Describe(procBuff).extent).replace(" NaN", "")
-         printMsg('Extent: %s' %myExtent)
-         clp_FlowDir = out_Scratch + os.sep + 'clp_FlowDir'
-         printMsg('Clipping flow direction raster to processing buffer')
-         arcpy.Clip_management (in_FlowDir, myExtent, clp_FlowDir, procBuff, "", "ClippingGeometry")
-         arcpy.env.extent = clp_FlowDir
-
-         # Create catchment
-         # NOTE: May want to replace this procedure with an implementation of flow distance 
-         printMsg('Delineating catchment...')
-         catchRast = Watershed (clp_FlowDir, srcRast)
-         catchRast.save(out_Scratch + os.sep + 'catchRast')
-
-         # Convert catchment to polygon
-         printMsg('Converting catchment to polygon...')
-         catchPoly = out_Scratch + os.sep + 'catchPoly'
-         arcpy.RasterToPolygon_conversion (catchRast, catchPoly, "NO_SIMPLIFY")
-
-         # Clip the catchment to the maximum distance buffer
-         clipBuff = out_Scratch + os.sep + 'clipBuff'
-         printMsg('Clipping catchment to maximum distance...')
-         arcpy.Buffer_analysis (tmpFeat, clipBuff, maxDist, "", "", "ALL", "")
-         clipCatch = out_Scratch + os.sep + 'clipCatch'
-         arcpy.Clip_analysis (catchPoly, clipBuff, clipCatch)
-         
-         # Eliminate parts because some features will make you cry/scream if you don't
-         printMsg('Eliminating trivial parts of catchment polygon...')
-         elimCatch = out_Scratch + os.sep + 'elimCatch'
-         arcpy.EliminatePolygonPart_management (clipCatch, elimCatch, "PERCENT", "", 10, "ANY")
-
-         # Coalesce to assure final catchment is a nice smooth feature
-         printMsg('Smoothing catchment...')
-         dist = float(cellSize)
-         dilDist = "%s %ss" % (str(dist), linUnit)
-         coalCatch = out_Scratch + os.sep + 'coalCatch'
-         Coalesce(elimCatch, dilDist, coalCatch, out_Scratch)
+         if backend == 'numpy':
+            # Catchment cells are converted to polygons below, once per threshold with flow distance truncation, and once for all thresholds otherwise
+            flowGrid = catchCells[myID][1]
+            cellSets = thresholdCells(catchCells[myID], threshDists)
+            srcFeat = myShape
+         else:
+            # Process:  Select (Analysis)
+            # Create a temporary feature class including only the current feature
+            with profileFx.stage('select', vertices=myShape.pointCount):
+               selQry = "%s = %s" % (fld_ID, str(myID))
+               tmpFeat = out_Scratch + os.sep + 'tmpFeat'
+               arcpy.Select_analysis (in_Catch, tmpFeat, selQry)
+
+            # Convert feature to raster
+            # The arcpy backend keeps PolygonToRaster and its maximum combined area rule; gridFx.rasterizeLabels assigns cells differently
+            printMsg('Converting feature to raster...')
+            with profileFx.stage('rasterize'):
+               srcRast = out_Scratch + os.sep + 'srcRast'
+               arcpy.PolygonToRaster_conversion (tmpFeat, fld_ID, srcRast, "MAXIMUM_COMBINED_AREA", fld_ID, cellSize)
+
+            # Restrict processing area to avoid ridiculous processing time
+            with profileFx.stage('buffer'):
+               procBuff = out_Scratch + os.sep + 'procBuff'
+               printMsg('Buffering feature to set maximum processing distance')
+               arcpy.Buffer_analysis (tmpFeat, procBuff, procDist, "", "", "ALL", "")
+               myExtent = str(arcpy.Describe(procBuff).extent).replace(" NaN", "")
+               printMsg('Extent: %s' %myExtent)
+            clp_FlowDir = out_Scratch + os.sep + 'clp_FlowDir'
+            with profileFx.stage('clipFlowDir') as rec:
+               if tileCache is not None:
+                  # Assemble the window from cached tiles, blanking cells outside the processing buffer as the clip would.
+                  # The window covers the feature's extent grown by the processing distance, which is the extent of the buffer.
+                  printMsg('Reading flow direction window from tile cache')
+                  procShape = arcpy.da.SearchCursor(procBuff, ["SHAPE@"]).next()[0]
+                  fdirWin, winGrid = fetchWindow()
+                  inBuff = np.zeros(fdirWin.size, dtype=bool)
+                  inBuff[gridFx.rasterizeRings(shapeToRings(procShape), winGrid, False)] = True
+                  fdirWin = np.where(inBuff.reshape(fdirWin.shape), fdirWin, 0)
+                  winRast = arcpy.NumPyArrayToRaster(fdirWin, arcpy.Point(winGrid.xmin, winGrid.ymin), winGrid.cellSize, winGrid.cellSize, 0)
+                  winRast.save(clp_FlowDir)
+                  arcpy.DefineProjection_management (clp_FlowDir, srRast)
+               else:
+                  printMsg('Clipping flow direction raster to processing buffer')
+                  arcpy.Clip_management (in_FlowDir, myExtent, clp_FlowDir, procBuff, "", "ClippingGeometry")
+               arcpy.env.extent = clp_FlowDir
+               clpDesc = arcpy.Describe(clp_FlowDir)
+               rec['cells'] = clpDesc.width * clpDesc.height
+
+            # Create catchment
+            # NOTE: For truncation by flow distance instead, use the numpy backend with truncation = "flowdist"
+            printMsg('Delineating catchment...')
+            with profileFx.stage('watershed'):
+               catchRast = sa.Watershed(clp_FlowDir, srcRast)
+               catchRast.save(out_Scratch + os.sep + 'catchRast')
+
+            # Convert catchment to polygon
+            printMsg('Converting catchment to polygon...')
+            with profileFx.stage('polygonize') as rec:
+               catchPoly = out_Scratch + os.sep + 'catchPoly'
+               arcpy.RasterToPolygon_conversion (catchRast, catchPoly, "NO_SIMPLIFY")
+               rec['vertices'] = sum(row[0] for row in arcpy.da.SearchCursor(catchPoly, ["SHAPE@POINTCOUNT"]))
+            srcFeat = myShape
+
+         # Finish the catchment for each threshold, smallest first
+         myShapes = []
+         for k, thisDist in enumerate(maxDists):
+            if backend == 'numpy' and (k == 0 or truncation == 'flowdist'):
+               # Convert catchment cells to polygon
+               printMsg('Converting catchment to polygon...')
+               catchPoly = out_Scratch + os.sep + 'catchPoly'
+               cells = cellSets[k]
+               with profileFx.stage('polygonize', cells=len(cells)) as rec:
+                  catchShape = cellsToPolygons(cells, flowGrid, srRast)
+                  arcpy.CopyFeatures_management (catchShape, catchPoly)
+                  rec['vertices'] = sum(p.pointCount for p in catchShape)
+
+            # Clip the catchment to the maximum distance buffer
+            # With flow distance truncation the catchment already stops at the maximum distance.
+            if truncation == 'flowdist':
+               clipCatch = catchPoly
+            else:
+               with profileFx.stage('clipCatch'):
+                  clipBuff = out_Scratch + os.sep + 'clipBuff'
+                  printMsg('Clipping catchment to maximum distance...')
+                  arcpy.Buffer_analysis (srcFeat, clipBuff, thisDist, "", "", "ALL", "")
+                  clipCatch = out_Scratch + os.sep + 'clipCatch'
+                  arcpy.Clip_analysis (catchPoly, clipBuff, clipCatch)
          
-         # Check the number of features at this point. 
-         # It should be just one. If more, the output is likely bad and should be flagged.
-         count = countFeatures(coalCatch)
-         if count > 1:
-            printWrng('Output is suspect for feature %s' % str(myID))
-            flags.append(myID)
+            # Eliminate parts because some features will make you cry/scream if you don't
+            printMsg('Eliminating trivial parts of catchment polygon...')
+            with profileFx.stage('eliminate'):
+               elimCatch = out_Scratch + os.sep + 'elimCatch'
+               arcpy.EliminatePolygonPart_management (clipCatch, elimCatch, "PERCENT", "", 10, "ANY")
+
+            # Coalesce to assure final catchment is a nice smooth feature
+            if geomBackend == 'shapely':
+               # Deferred to a single batch after the loop
+               elimShapes[(k, myID)] = readWKB(elimCatch)
+            else:
+               printMsg('Smoothing catchment...')
+               with profileFx.stage('coalesce'):
+                  dist = float(cellSize)
+                  dilDist = "%s %ss" % (str(dist), linUnit)
+                  coalCatch = out_Scratch + os.sep + 'coalCatch'
+                  Coalesce(elimCatch, dilDist, coalCatch, out_Scratch)
+            
+               # Check the number of features at this point. 
+               # It should be just one. If more, the output is likely bad and should be flagged.
+               count = countFeatures(coalCatch)
+               if count > 1:
+                  printWrng('Output is suspect for feature %s' % str(myID))
+                  flags[k].append(myID)
          
-         # Use the catchment geometry as the final shape
-         myFinalShape = arcpy.SearchCursor(elimCatch).next().Shape
+            # Use the catchment geometry as the final shape
+            myShapes.append(arcpy.SearchCursor(elimCatch).next().Shape)
 
-         # Update the feature with its final shape
-         row[1] = myFinalShape
-         cursor.updateRow(row)
+         # Keep the final shapes for updating the features
+         for k, myFinalShape in enumerate(myShapes):
+            finalShapes[k][myID] = myFinalShape
 
          printMsg('Finished processing feature %s' %str(myID))
          
@@ -147,46 +715,521 @@ def delineatePolyCatchments(in_Feats, fld_ID, in_FlowDir, out_Catch, maxDist = '
 
       except:
          # Add failure message and append failed feature ID to list
-         printMsg("\nFailed to fully process feature " + str(myID))
          myFailList.append(myID)
+         reportFailure(myID)
+   profileFx.setFeature(None)
+
+   # Smooth all catchments in one batch, grouping parts by threshold and feature
+   if elimShapes:
+      printMsg('Smoothing %s catchments...' % len(elimShapes))
+      smoothKeys = sorted(elimShapes.keys())
+      wkbList, groups = [], []
+      for g, key in enumerate(smoothKeys):
+         wkbList.extend(elimShapes[key])
+         groups.extend([g] * len(elimShapes[key]))
+      with profileFx.stage('coalesce') as rec:
+         parts, partGroups = geomFx.coalesceArray(geomFx.fromWKB(wkbList), np.array(groups, dtype=int), float(cellSize), measToMapUnits("0.1 Meters", srRast.metersPerUnit))
+      counts = np.bincount(partGroups, minlength=len(smoothKeys))
+      for (k, myID), count in zip(smoothKeys, counts):
+         if count > 1:
+            printWrng('Output is suspect for feature %s' % str(myID))
+            flags[k].append(myID)
 
-         # Error handling code swiped from "A Python Primer for ArcGIS"
-         tb = sys.exc_info()[2]
-         tbinfo = traceback.format_tb(tb)[0]
-         pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
-         msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
+   # Store newly computed catchments in the cache
+   if cacheDir:
+      for k in range(len(maxDists)):
+         flagSet = set(flags[k])
+         for myID, myShape in feats:
+            if myID in finalShapes[k]:
+               catchCache.put(cacheKeys[myID][k], {'wkb': bytes(finalShapes[k][myID].WKB), 'suspect': myID in flagSet})
 
-         printWrng(msgs)
-         printWrng(pymsg)
-         printMsg(arcpy.GetMessages(1))
+   if tileCache is not None:
+      printCacheStats(tileCache)
+      if loopFeats and backend == 'arcpy':
+         printMsg(prefetcher.report())
+   if cacheDir:
+      printMsg(catchCache.report())
 
-         # Add status message
-         printMsg("\nMoving on to the next feature.  Note that the output will be incomplete.")
-   
-   if len(flags) > 0:
-      printWrng('These features may be incorrect: %s' % str(flags))
+   # Hand back the final shapes as WKB, by threshold in the order given
+   threshFlags = [None] * len(maxDists)
+   threshShapes = [None] * len(maxDists)
+   for k, i in enumerate(threshOrder):
+      threshFlags[i] = flags[k]
+      threshShapes[i] = dict((myID, bytes(shp.WKB)) for myID, shp in finalShapes[k].items())
+   return (myFailList, threshFlags, threshShapes)
+
+def catchBatchWorker(args):
+   '''Process pool worker for delineatePolyCatchments. Copies one batch of features to a new scratch geodatabase of its own and delineates their catchments there. Returns the batch number, the scratch geodatabase, the list of failed feature IDs, the suspect IDs and catchment geometries (as WKB) by threshold, as from processCatchments, and the profiling records of the batch (empty unless profiling was requested).'''
+   batchNum, in_Catch, fld_ID, batchIDs, in_FlowDir, maxDist, out_Scratch, backend, truncation, tileSize, cacheDir, geomBackend, finish, useIndex, prefetch, tiled, profile = args
+   if profile:
+      profileFx.activate(profileFx.Profiler(sampleSec=profileSampleSec))
+   tmpWorkspace = createTmpWorkspace('b%s' % batchNum)
+   batchCatch = tmpWorkspace + os.sep + 'batchCatch'
+   try:
+      try:
+         selQry = "%s IN (%s)" % (fld_ID, ", ".join([str(i) for i in batchIDs]))
+         arcpy.Select_analysis (in_Catch, batchCatch, selQry)
+
+         # The in_memory workspace is private to each process, so it can be shared by name. Scratch on disk cannot.
+         if out_Scratch == 'in_memory':
+            batchScratch = 'in_memory'
+         else:
+            batchScratch = tmpWorkspace
+         myFailList, flags, shapes = processCatchments(batchCatch, fld_ID, in_FlowDir, maxDist, batchScratch, backend, truncation, tileSize, cacheDir, geomBackend, finish, useIndex, prefetch, tiled)
+      except:
+         tback()
+         numThresh = len(maxDist) if isinstance(maxDist, (list, tuple)) else 1
+         myFailList, flags, shapes = list(batchIDs), [[] for k in range(numThresh)], [{} for k in range(numThresh)]
+      prof = profileFx.deactivate()
+      records = prof.records if prof is not None else []
+   except:
+      # delineateParallel only deletes the scratch geodatabases of batches that come back, so one that will not is deleted here
+      garbagePickup([tmpWorkspace])
+      raise
+   return (batchNum, tmpWorkspace, myFailList, flags, shapes, records)
+
+def delineateParallel(in_Catch, fld_ID, in_FlowDir, maxDist, out_Scratch, backend, truncation, numWorkers, tileSize = 0, cacheDir = None, geomBackend = 'arcpy', finish = 'vector', useIndex = False, prefetch = 0, tiled = False):
+   '''Splits the features in in_Catch into batches and delineates their catchments in a pool of numWorkers processes. Catchment geometries come back from the workers as WKB, so nothing is written to in_Catch while the workers read from it. Results are merged in batch order, so they do not depend on which worker finishes first. Returns the combined results, as processCatchments does.
+   If a profiler is active, each worker profiles its own batch, and the records are added to the active profiler.'''
+   # When running inside ArcMap, sys.executable is the application rather than Python, so the workers need to be pointed at Python explicitly
+   if not os.path.basename(sys.executable).lower().startswith('python'):
+      multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+   # Layers do not carry over into other processes, so hand the workers the raster's path
+   in_FlowDir = arcpy.Describe(in_FlowDir).catalogPath
+
+   # Split features into several batches per worker so that slow batches do not hold up the pool.
+   # Batches are cut from the Hilbert ordering of the features so that each covers a compact area.
+   feats = [(row[0], row[1]) for row in arcpy.da.SearchCursor(in_Catch, [fld_ID, "SHAPE@XY"])]
+   order = gridFx.hilbertOrder([f[1][0] for f in feats], [f[1][1] for f in feats])
+   allIDs = [feats[i][0] for i in order]
+   numBatches = min(len(allIDs), numWorkers * 4)
+   batchSize = int(math.ceil(len(allIDs) / float(max(numBatches, 1))))
+   jobs = []
+   for b in range(numBatches):
+      batchIDs = allIDs[b * batchSize:(b + 1) * batchSize]
+      if batchIDs:
+         jobs.append((b, in_Catch, fld_ID, batchIDs, in_FlowDir, maxDist, out_Scratch, backend, truncation, tileSize, cacheDir, geomBackend, finish, useIndex, prefetch, tiled, profileFx.active() is not None))
+   printMsg('Processing %s features in %s batches with %s workers...' % (len(allIDs), len(jobs), numWorkers))
+
+   # Results are collected as batches finish, so that if the pool fails part way, the scratch geodatabases of the batches already done are still deleted
+   pool = multiprocessing.Pool(numWorkers)
+   results = []
+   try:
+      for res in pool.imap_unordered(catchBatchWorker, jobs, 1):
+         results.append(res)
+      pool.close()
+   except:
+      pool.terminate()
+      garbagePickup([res[1] for res in results])
+      raise
+   finally:
+      pool.join()
+
+   # Collect results in batch order
+   printMsg('Merging batch results...')
+   numThresh = len(maxDist) if isinstance(maxDist, (list, tuple)) else 1
+   myFailList = []
+   flags = [[] for k in range(numThresh)]
+   shapes = [{} for k in range(numThresh)]
+   trashList = []
+   for batchNum, tmpWorkspace, batchFails, batchFlags, batchShapes, records in sorted(results):
+      myFailList.extend(batchFails)
+      for k in range(numThresh):
+         flags[k].extend(batchFlags[k])
+         shapes[k].update(batchShapes[k])
+      if profileFx.active() is not None:
+         profileFx.active().extend(records)
+      trashList.append(tmpWorkspace)
+
+   garbagePickup(trashList)
+   return (myFailList, flags, shapes)
+
+def writeCatchments(in_Catch, fld_ID, outputs, maxDists, myFailList, flags, shapes, sr, batchSize = 1000):
+   '''Writes catchments out in bulk, through batched writers (see writerFx), with the attributes of the features in in_Catch and Failed and Suspect fields (0 or 1). Features that failed keep their original geometry.
+   outputs: one output path per distance threshold in maxDists, or a single path, in which case the catchments for all thresholds go to it with the distance in a Threshold field
+   flags, shapes: suspect IDs and catchment geometries (WKB) by threshold, as from processCatchments'''
+   fieldTypes = {'SmallInteger': 'SHORT', 'Integer': 'LONG', 'Single': 'DOUBLE', 'Double': 'DOUBLE', 'String': 'TEXT', 'Date': 'DATE'}
+   attrFlds = [f for f in arcpy.ListFields(in_Catch) if f.type in fieldTypes and f.editable and f.name.lower() not in ('failed', 'suspect', 'threshold')]
+   fields = [(f.name, fieldTypes[f.type]) for f in attrFlds] + [('Failed', 'SHORT'), ('Suspect', 'SHORT')]
+   idPos = [f.name for f in attrFlds].index(fld_ID)
+   if len(outputs) == 1 and len(maxDists) > 1:
+      fields.append(('Threshold', 'TEXT'))
+      writers = [writerFx.openWriter(outputs[0], fields, sr.exportToString(), sr.factoryCode, batchSize)] * len(maxDists)
+   else:
+      writers = [writerFx.openWriter(out, fields, sr.exportToString(), sr.factoryCode, batchSize) for out in outputs]
+   failSet = set(myFailList)
+   flagSets = [set(f) for f in flags]
+
+   # Threshold by threshold, so that each output gets its rows in the order of the features
+   for k, thisDist in enumerate(maxDists):
+      for row in arcpy.da.SearchCursor(in_Catch, ["SHAPE@WKB"] + [f.name for f in attrFlds]):
+         myID = row[idPos + 1]
+         values = list(row[1:]) + [int(myID in failSet), int(myID in flagSets[k])]
+         if fields[-1][0] == 'Threshold':
+            values.append(thisDist)
+         writers[k].add(shapes[k].get(myID, row[0]), values)
+   for w in set(writers):
+      w.close()
+      printMsg('%s features written to %s in %s batches' % (w.written, w.path, w.batches))
+   return outputs
+
+# Define functions used to create toolbox tools
+def delineatePolyCatchments(in_Feats, fld_ID, in_FlowDir, out_Catch, maxDist = '500 METERS', out_Scratch = 'in_memory', backend = 'arcpy', truncation = 'buffer', numWorkers = 1, tileSize = 0, cacheDir = None, geomBackend = 'arcpy', profileOut = None, finish = 'vector', useIndex = False, thresholdOutput = 'field', prefetch = 0, tiled = False):
+   """Delineates catchments individually for each polygon in feature class or layer, out to a maximum distance.
+   maxDist: a linear unit such as "500 METERS", or several, as a list or a semicolon-separated string. With several distances, each catchment is traced once, out to the largest, and the catchments for the others are cut from it (see processCatchments). With buffer truncation, the window is then 3 times the largest distance for all of them, so the catchments for the smaller distances can differ from single-distance runs.
+   out_Catch: the output, as a feature class (file geodatabase or shapefile), a GeoPackage (.gpkg, optionally followed by the layer name), GeoParquet (.parquet) or FlatGeobuf (.fgb) file. Each feature carries the attributes of its input feature plus Failed and Suspect fields (0 or 1); features that failed keep their input geometry. Results are gathered in memory and written in batches (see writeCatchments).
+   thresholdOutput: how catchments for several distances are written. "field" puts them all in out_Catch, one feature per input feature and distance, with the distance in a Threshold field. "separate" writes one output per distance, named after out_Catch with the distance added (see thresholdName), and out_Catch itself is not created.
+   backend: "arcpy" runs Spatial Analyst's Watershed tool once per feature. "numpy" reads the flow direction raster into memory once and traces the catchments of all features together with the D8 engine in d8Fx, then finishes each catchment with the same clipping and smoothing steps.
+   truncation: "buffer" delineates the catchment within a window of 3 times maxDist, then clips it to a straight-line buffer of maxDist. "flowdist" (numpy backend only) keeps the cells whose flow length down to the feature is within maxDist, and never visits cells beyond that.
+   numWorkers: if greater than 1, features are split into batches and handed to a pool of that many processes, each working in a scratch geodatabase of its own.
+   tileSize: if greater than 0, flow direction windows are read through an LRU cache of tiles of this many cells square instead of clipping the raster for every feature (see processCatchments).
+   cacheDir: optional folder for a persistent catchment cache. On re-runs, only features that are new or have changed are recomputed (see processCatchments).
+   geomBackend: "arcpy" smooths each catchment with Coalesce as it goes. "shapely" smooths all catchments in one in-memory batch (see geomFx).
+   finish: "vector" finishes each catchment with RasterToPolygon (or its numpy equivalent), Clip, EliminatePolygonPart and Coalesce. "raster" (numpy backend only) does the same clipping, part elimination and smoothing check on the catchment cells, with closing and connected-component filters, and polygonizes the result directly.
+   useIndex: if True (numpy backend only), catchments are traced on a persistent upstream index of in_FlowDir, kept beside the raster. The index is built on the first run and rebuilt whenever the raster changes; later runs load it memory-mapped instead of reading the raster.
+   prefetch: with tileSize greater than 0, the number of flow direction windows read ahead on a background thread while earlier features are processed, so that reading overlaps with computation. The time spent waiting for windows and the queue depth are reported, for tuning. 0 reads each window when it is needed. Windows can only be read ahead if the raster's grid was loaded by warmFlowDir, since arcpy cannot read it on another thread.
+   tiled: if True (numpy backend, with tileSize greater than 0), catchments are traced out of core: the flow direction raster is processed one tile at a time, with a halo of one cell, and catchments crossing tile boundaries are stitched together by passing their inflow from tile to tile. Peak memory is then bounded by the tile cache rather than by the size of the raster, so statewide rasters can be processed whole.
+   profileOut: optional path of a .json or .csv file in which to save the time, memory (at the end of the stage and its sampled peak), and cell/vertex counts of every processing stage for every feature (see profileFx). A summary table by stage is printed at the end."""
+   if backend not in ('arcpy', 'numpy'):
+      printErr('Unrecognized backend: %s' % backend)
+      raise arcpy.ExecuteError
+   if truncation not in ('buffer', 'flowdist'):
+      printErr('Unrecognized truncation method: %s' % truncation)
+      raise arcpy.ExecuteError
+   if truncation == 'flowdist' and backend != 'numpy':
+      printErr('Flow distance truncation requires the numpy backend')
+      raise arcpy.ExecuteError
+   if finish not in ('vector', 'raster'):
+      printErr('Unrecognized finishing method: %s' % finish)
+      raise arcpy.ExecuteError
+   if finish == 'raster' and backend != 'numpy':
+      printErr('Raster finishing requires the numpy backend')
+      raise arcpy.ExecuteError
+   if useIndex and backend != 'numpy':
+      printErr('The upstream index requires the numpy backend')
+      raise arcpy.ExecuteError
+   if tiled and (backend != 'numpy' or int(tileSize) <= 0):
+      printErr('Tiled processing requires the numpy backend and a tile size')
+      raise arcpy.ExecuteError
+   maxDists = distanceList(maxDist)
+   if not maxDists:
+      printErr('No maximum distance given')
+      raise arcpy.ExecuteError
+   if thresholdOutput not in ('field', 'separate'):
+      printErr('Unrecognized threshold output: %s' % thresholdOutput)
+      raise arcpy.ExecuteError
+
+   # Get cell size and output spatial reference from in_FlowDir
+   cellSize, srRast = rasterProperties(in_FlowDir)
+   linUnit = srRast.linearUnitName
+   printMsg('Cell size of flow direction raster is %s %ss' %(cellSize, linUnit))
+   printMsg('Catchment delineation is strongly dependent on cell size.')
+
+   # With several distance thresholds, catchments go to one output with a threshold field, or to one output per threshold
+   if len(maxDists) == 1:
+      maxDist = maxDists[0]
+      outCatches = [out_Catch]
+   else:
+      printMsg('Delineating catchments for %s distance thresholds: %s' % (len(maxDists), ', '.join(maxDists)))
+      maxDist = maxDists
+      if thresholdOutput == 'separate':
+         outCatches = [thresholdName(out_Catch, d) for d in maxDists]
+      else:
+         outCatches = [out_Catch]
+
+   # Features are processed from a working copy in a scratch geodatabase, which is only read from while catchments are delineated.
+   # Check if input features and input flow direction have same spatial reference.
+   # If so, just make a copy. If not, reproject features to match raster.
+   workGDB = createTmpWorkspace('work')
+   try:
+      workFeats = workGDB + os.sep + 'workFeats'
+      srFeats = arcpy.Describe(in_Feats).spatialReference
+      if srFeats.Name == srRast.Name:
+         printMsg('Coordinate systems for features and raster are the same. Copying...')
+         arcpy.CopyFeatures_management (in_Feats, workFeats)
+      else:
+         printMsg('Reprojecting features to match raster...')
+         # Check if geographic transformation is needed, and handle accordingly.
+         if srFeats.GCS.Name == srRast.GCS.Name:
+            geoTrans = ""
+            printMsg('No geographic transformation needed...')
+         else:
+            transList = arcpy.ListTransformations(srFeats,srRast)
+            geoTrans = transList[0]
+         arcpy.Project_management (in_Feats, workFeats, srRast, geoTrans)
+
+      # Build the upstream index up front if need be, so that parallel workers all share one copy
+      if useIndex:
+         loadUpstreamIndex(in_FlowDir)
+
+      # Process the features, in parallel if requested
+      if profileOut:
+         profileFx.activate(profileFx.Profiler(sampleSec=profileSampleSec))
+      try:
+         if int(numWorkers) > 1:
+            myFailList, flags, shapes = delineateParallel(workFeats, fld_ID, in_FlowDir, maxDist, out_Scratch, backend, truncation, int(numWorkers), tileSize, cacheDir, geomBackend, finish, useIndex, int(prefetch), tiled)
+         else:
+            myFailList, flags, shapes = processCatchments(workFeats, fld_ID, in_FlowDir, maxDist, out_Scratch, backend, truncation, tileSize, cacheDir, geomBackend, finish, useIndex, int(prefetch), tiled)
+
+         # Report each suspect feature once, whichever thresholds it is suspect at
+         suspects = []
+         for threshFlags in flags:
+            for myID in threshFlags:
+               if myID not in suspects:
+                  suspects.append(myID)
+         if len(suspects) > 0:
+            printWrng('These features may be incorrect: %s' % str(suspects))
+
+         # Write all catchments out in bulk, with failures and suspects flagged
+         printMsg('Writing catchments...')
+         with profileFx.stage('write'):
+            writeCatchments(workFeats, fld_ID, outCatches, maxDists, myFailList, flags, shapes, srRast)
+      finally:
+         # The profile is closed after the write, so that writing is profiled too
+         if profileOut:
+            prof = profileFx.deactivate()
+            printMsg('Processing time by stage:\n%s' % prof.summaryTable())
+            printMsg('Profile saved to %s' % str(prof.export(profileOut)))
+   finally:
+      # The working copy is deleted whether or not the delineation succeeds
+      garbagePickup([workGDB])
+
+   if len(outCatches) > 1:
+      return outCatches
    return out_Catch
 
-def prioritizeSCUs(in_SCU, in_Catch, fld_ID, fld_BRANK, lo_BRANK, in_Integrity, in_ConsPriority, in_Vulnerability, out_SCU, out_Scratch = 'in_memory'):
-   '''Prioritizes Stream Conservation Units (SCUs) for conservation, based on biodiversity rank (BRANK), watershed integrity and conservation priority (from ConservationVision Watershed Model), and vulnerability (from ConservationVision Development Vulnerability Model)'''
-   # Step 1: First cut based on BRANK: Create subset of SCUs ranked lo_BRANK or better
-   selQry = "%s <= '%s'" % (fld_BRANK, lo_BRANK)
-   arcpy.Select_analysis (in_SCU, out_SCU, selQry)
+def prioritizeSCUs(in_SCU, in_Catch, fld_ID, fld_BRANK, lo_BRANK, in_Integrity, in_ConsPriority, in_Vulnerability, out_SCU, out_Scratch = 'in_memory', weights = rankFx.defaultWeights, out_Table = None, numScenarios = 0, topK = 10, concentration = None, threshold = None):
+   '''Prioritizes Stream Conservation Units (SCUs) for conservation, based on biodiversity rank (BRANK), watershed integrity and conservation priority (from ConservationVision Watershed Model), and vulnerability (from ConservationVision Development Vulnerability Model)
+   weights: weights for BRANK, watershed integrity, conservation priority and vulnerability, in that order
+   out_Table: optional path of a .npz file in which to save the scored SCU table, so that it can be re-ranked under other weights or BRANK cutoffs with rankFx.rerankSCUs, without any geoprocessing
+   numScenarios: if greater than 0, the ranking is also repeated under that many weight vectors drawn at random (see rankFx.sampleWeights), and each SCU gets its mean rank (MeanRank), 90% rank interval (RankLo to RankHi), and the fraction of scenarios placing it in the top topK (PTop). concentration centres the draws on weights; without it, all weightings are equally likely.
+   threshold: the distance whose catchments to use, if in_Catch holds catchments for several distances in a Threshold field (e.g. "500 METERS")'''
+   # Step 1: First cut based on BRANK: Load SCU attributes into a columnar table, with BRANK parsed to ordinals, and select SCUs ranked lo_BRANK or better
+   rows = [row for row in arcpy.da.SearchCursor(in_SCU, [fld_ID, fld_BRANK])]
+   table = rankFx.SCUTable([r[0] for r in rows], [r[1] for r in rows])
+   keep = table.brankMask(lo_BRANK)
+   printMsg('%s of %s SCUs are ranked %s or better' % (int(keep.sum()), len(table), lo_BRANK))
    
-   # Step 2: For each SCU catchment corresponding to SCUs in subset, get zonal stats of Watershed Integrity, Conservation Priority and Vulnerability. Do this in loop in case of catchment overlap.
-   # Process: Add fields (WtrshdInteg, ConsPrior, and Vuln)
-   
-   # Set up cursor for loop
-   #for s in SCUs:
-      # Process: Select (catchment)
-      # Process: Zonal statistics by table (Watershed Integrity)
-      # Get mean value and update ConsPrior field
-      # Process: Zonal statistics by table (Conservation Priority)
-      # Get mean value and update ConsPrior field
-      # Process: Zonal statistics by table (Vulnerability)
-      # Get mean value and update Vuln field
-
-   # Step 3: Score catchments based on BRANK, Watershed Integrity, Conservation Priority, and Vulnerability, then rank
+   # Step 2: For each SCU catchment, get zonal stats of Watershed Integrity, Conservation Priority and Vulnerability.
+   # Catchments overlap, so Zonal Statistics as Table would have to run once per SCU. Instead, all catchments are burned into a sparse membership list once and each raster is read in a single pass (see zonalFx).
+   # Stats are gathered for all SCUs, not just the subset, so that the BRANK cutoff can be changed later without geoprocessing.
+   statFlds = ['WtrshdInteg', 'ConsPrior', 'Vuln']
+   means = catchmentZonalStats(in_Catch, fld_ID, table.ids.tolist(), [in_Integrity, in_ConsPriority, in_Vulnerability], threshold=threshold)
+   for fld, vals in zip(statFlds, means):
+      table.setColumn(fld, [vals.get(myID) for myID in table.ids.tolist()])
+
+   # Step 3: Score SCUs based on BRANK, Watershed Integrity, Conservation Priority, and Vulnerability, then rank
+   ranks, scores = table.rankArray(weights, lo_BRANK)
+   sensFlds = []
+   if numScenarios > 0:
+      printMsg('Ranking SCUs under %s weighting scenarios...' % numScenarios)
+      sens = table.sensitivity(rankFx.sampleWeights(numScenarios, weights, concentration), lo_BRANK, topK)
+      # SCUs excluded by the BRANK cutoff were not ranked, so their fields are left null
+      sensCols = {}
+      for fld in ('meanRank', 'rankLo', 'rankHi', 'pTop'):
+         sensCols[fld] = np.empty(len(table))
+         sensCols[fld].fill(np.nan)
+         sensCols[fld][sens['rows']] = sens[fld]
+      sensFlds = [('MeanRank', 'meanRank', "DOUBLE"), ('RankLo', 'rankLo', "LONG"), ('RankHi', 'rankHi', "LONG"), ('PTop', 'pTop', "DOUBLE")]
+   if out_Table:
+      table.save(out_Table)
+      printMsg('SCU table saved to %s' % out_Table)
+
+   # Write the subset with its stats, score and rank
+   arcpy.CopyFeatures_management (in_SCU, out_SCU)
+   for fld in statFlds + ['Score']:
+      arcpy.AddField_management (out_SCU, fld, "DOUBLE")
+   arcpy.AddField_management (out_SCU, 'Rank', "LONG")
+   for fld, col, fldType in sensFlds:
+      arcpy.AddField_management (out_SCU, fld, fldType)
+   rowOf = dict((myID, i) for i, myID in enumerate(table.ids.tolist()))
+   cursor = arcpy.da.UpdateCursor(out_SCU, [fld_ID] + statFlds + ['Score', 'Rank'] + [f[0] for f in sensFlds])
+   for row in cursor:
+      i = rowOf[row[0]]
+      if not keep[i]:
+         cursor.deleteRow()
+         continue
+      for j, fld in enumerate(statFlds):
+         v = table.columns[fld][i]
+         row[j + 1] = None if np.isnan(v) else float(v)
+      row[4] = float(scores[i])
+      row[5] = int(ranks[i])
+      for j, (fld, col, fldType) in enumerate(sensFlds):
+         v = sensCols[col][i]
+         row[6 + j] = None if np.isnan(v) else int(v) if fldType == "LONG" else float(v)
+      cursor.updateRow(row)
+   del cursor
+
+   return out_SCU
+
+def catchmentMembership(in_Catch, fld_ID, ids, in_Rast, threshold = None):
+   '''Burns the catchments of the features whose IDs are in ids, at distance threshold if in_Catch holds several (see catchmentShapes), into the grid of in_Rast, projecting them to its coordinate system if need be. Returns the zonalFx.ZoneMembership of the catchments.'''
+   grid = rasterGrid(in_Rast)
+   sr = arcpy.Describe(in_Rast).spatialReference
+   polys = {}
+   for myID, myShape in catchmentShapes(in_Catch, fld_ID, ids, threshold).items():
+      if myShape.spatialReference.name != sr.name:
+         myShape = myShape.projectAs(sr)
+      polys[myID] = shapeToRings(myShape)
+   printMsg('Burning %s catchments into a %s by %s grid...' % (len(polys), grid.nrows, grid.ncols))
+   return zonalFx.ZoneMembership.fromPolygons(grid, polys)
+
+def portfolioSCUs(in_Catch, fld_ID, in_Integrity, minIntegrity, budget, fld_Cost = None, ids = None, out_Overlap = None, threshold = None):
+   '''Chooses a portfolio of SCUs whose catchments together cover the most distinct area of high watershed integrity (at least minIntegrity), within a budget. SCUs are ranked on their own by prioritizeSCUs, so overlapping catchments can make top-ranked SCUs protect the same cells twice; here each SCU is credited only with the high-integrity area not already covered by the SCUs chosen before it.
+   Catchments are burned into the integrity raster's grid once and held as compact cell sets (see coverFx), and the portfolio is chosen greedily with lazy evaluation of marginal gains, without any polygon overlay.
+   budget: the total cost allowed. fld_Cost is an optional field of in_Catch holding the cost of each SCU; without it, every SCU costs 1 and budget is the number of SCUs to choose.
+   ids: if given, only SCUs with these IDs are considered (e.g. those ranked lo_BRANK or better).
+   out_Overlap: optional path of a .csv file in which to save the area shared by every pair of overlapping catchments (all cells, not only high-integrity ones), and the fraction of each catchment it makes up.
+   threshold: the distance whose catchments to use, if in_Catch holds catchments for several distances in a Threshold field (see catchmentShapes).
+   Returns a list of (SCU ID, area added, cumulative area) tuples, in the order chosen.'''
+   fields = [fld_ID] + ([fld_Cost] if fld_Cost else [])
+   rows = [row for row in arcpy.da.SearchCursor(in_Catch, fields) if ids is None or row[0] in ids]
+   costOf = dict((row[0], row[1] if fld_Cost else 1.0) for row in rows)
+   membership = catchmentMembership(in_Catch, fld_ID, costOf.keys(), in_Integrity, threshold)
+   cellArea = membership.grid.cellSize ** 2
+
+   # Keep only the catchment cells of high integrity
+   printMsg('Reading %s...' % in_Integrity)
+   vals = zonalFx.cellValues(membership, rasterBlockReader(in_Integrity))
+   with np.errstate(invalid='ignore'):
+      high = vals >= minIntegrity
+   index = coverFx.CoverageIndex.fromPairs(membership.zoneIDs, membership.cells[high], membership.zones[high], cellArea)
+   printMsg('%s catchment cells of integrity %s or more, held in %.1f MB' % (int(high.sum()), minIntegrity, index.nbytes / 2.0**20))
+
+   costs = [costOf[myID] if costOf[myID] is not None else 0.0 for myID in index.ids]
+   picks, gains = index.greedy(budget, costs)
+   portfolio = []
+   total = 0.0
+   for k, gain in zip(picks, gains):
+      total += gain
+      portfolio.append((index.ids[k], float(gain), total))
+   # Member cells are sorted, so distinct cells are where the cell number changes
+   highCells = membership.cells[high]
+   allHigh = (len(highCells) and 1 + int(np.count_nonzero(np.diff(highCells)))) * cellArea
+   printMsg('Chose %s SCUs, covering %s of the %s units of high-integrity area in all catchments' % (len(portfolio), total, allHigh))
+
+   if out_Overlap:
+      full = coverFx.CoverageIndex.fromPairs(membership.zoneIDs, membership.cells, membership.zones, cellArea)
+      i, j, shared = full.overlaps()
+      areas = full.areas()
+      with open(out_Overlap, 'w') as f:
+         f.write('%s_1,%s_2,SharedArea,Frac_1,Frac_2\n' % (fld_ID, fld_ID))
+         for a, b, n in zip(i, j, shared):
+            f.write('%s,%s,%s,%.4f,%.4f\n' % (full.ids[a], full.ids[b], n * cellArea, n * cellArea / areas[a], n * cellArea / areas[b]))
+      printMsg('Overlaps of %s pairs of catchments saved to %s' % (len(i), out_Overlap))
+   return portfolio
+
+def runJob(job, jobNum = 0):
+   '''Runs one job of a batch manifest (see batchFx.loadManifest) in this process: delineatePolyCatchments for "delineate" jobs and prioritizeSCUs for "prioritize" jobs, with the job's arguments, on the input SCUs selected by its "where" clause if it has one. Returns a dictionary of the job's name, tool, time taken, number of input features, output, and error message (None if it succeeded).'''
+   args = dict((k, v) for k, v in job.items() if k not in ('name', 'tool', 'where'))
+   result = {'name': job['name'], 'tool': job['tool'], 'features': None, 'output': None, 'error': None}
+   inKey = 'in_Feats' if job['tool'] == 'delineate' else 'in_SCU'
+   layer = None
+   t0 = time.time()
+   try:
+      if job.get('where'):
+         layer = 'batchJob%s' % jobNum
+         arcpy.MakeFeatureLayer_management(args[inKey], layer, job['where'])
+         args[inKey] = layer
+      result['features'] = countFeatures(args[inKey])
+      if job['tool'] == 'delineate':
+         # Jobs already run side by side in the batch's workers, so each job delineates in a single process
+         args['numWorkers'] = 1
+         result['output'] = delineatePolyCatchments(**args)
+      else:
+         result['output'] = prioritizeSCUs(**args)
+   except Exception as e:
+      tback()
+      result['error'] = str(e) or type(e).__name__
+   finally:
+      if layer:
+         garbagePickup([layer])
+   result['seconds'] = time.time() - t0
+   return result
+
+# Flow direction raster and warm-up options of the batch this process runs jobs for, and whether it has warmed up yet
+batchWarm = {'in_FlowDir': None, 'options': {}, 'gridFile': None, 'done': False}
+
+def batchWorkerInit(in_FlowDir, warmOptions, gridFile = None):
+   '''Process pool initializer for runBatch: notes the flow direction raster and how to warm it. Nothing is loaded until the worker runs its first delineation job, so workers that only run prioritization jobs never load the raster.'''
+   batchWarm.update({'in_FlowDir': in_FlowDir, 'options': dict(warmOptions), 'gridFile': gridFile, 'done': False})
+
+def batchJobWorker(args):
+   '''Process pool worker for runBatch. Runs one job, warming the worker first (see warmFlowDir) if the job is a delineation and the worker has not yet warmed up, and adds the process ID of the worker and the time spent warming it for this job to its result.'''
+   jobNum, job = args
+   warmSec = 0.0
+   if job['tool'] == 'delineate' and not batchWarm['done']:
+      opts = batchWarm['options']
+      warmSec = warmFlowDir(batchWarm['in_FlowDir'], opts.get('loadGrid', False), opts.get('useIndex', False), batchWarm['gridFile'])
+      batchWarm['done'] = True
+   result = runJob(job, jobNum)
+   result['pid'] = os.getpid()
+   result['warmSec'] = warmSec
+   return result
+
+def runBatch(manifest, numWorkers = None, out_Report = None):
+   '''Runs every job in a manifest (a JSON file or dictionary; see batchFx) against its flow direction raster. Instead of each job starting cold, describing and reading the raster again, a pool of long-lived workers is started, each loading the raster (and its upstream index, if the manifest asks for it) once, before its first delineation job, and the jobs are streamed through the pool as workers come free.
+   If the manifest's warm options ask for the whole grid (loadGrid) and there are several workers, the grid is copied once to a temporary .npy file which every worker memory-maps, rather than each holding a copy of its own.
+   numWorkers: number of worker processes, overriding numWorkers in the manifest. With 1, jobs run one after another in this process, on a raster warmed once.
+   out_Report: optional path of a .json file in which to save the per-job results and the summary.
+   Prints the time and throughput of every job, and the time saved against running every job cold. Returns the list of per-job results, in manifest order, and the summary (see batchFx.summarize).'''
+   manifest = batchFx.loadManifest(manifest)
+   numWorkers = int(numWorkers or manifest['numWorkers'])
+
+   # Workers are separate processes, so hand them the raster's path rather than a layer name
+   in_FlowDir = arcpy.Describe(manifest['in_FlowDir']).catalogPath
+   jobs = []
+   for job in manifest['jobs']:
+      if job['tool'] == 'delineate':
+         job = dict(job, in_FlowDir=in_FlowDir)
+      jobs.append(job)
+   printMsg('Running %s jobs against %s with %s workers...' % (len(jobs), in_FlowDir, numWorkers))
+
+   t0 = time.time()
+   results = []
+   def jobDone(result):
+      results.append(result)
+      status = 'failed' if result['error'] else 'finished'
+      printMsg('Job %s %s in %.1f s (%s of %s done)' % (result['name'], status, result['seconds'], len(results), len(jobs)))
+   gridDir, gridFile, sharedSec = None, None, 0.0
+   try:
+      if numWorkers > 1:
+         if manifest['warm'].get('loadGrid') and any(job['tool'] == 'delineate' for job in jobs):
+            printMsg('Copying the flow direction grid for the workers to share...')
+            gridDir = tempfile.mkdtemp(prefix='scuBatch_')
+            gridFile = os.path.join(gridDir, 'fdir.npy')
+            sharedSec = saveFlowDir(in_FlowDir, gridFile)
+         # When running inside ArcMap, sys.executable is the application rather than Python, so the workers need to be pointed at Python explicitly
+         if not os.path.basename(sys.executable).lower().startswith('python'):
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+         pool = multiprocessing.Pool(numWorkers, batchWorkerInit, (in_FlowDir, manifest['warm'], gridFile))
+         try:
+            for result in pool.imap_unordered(batchJobWorker, list(enumerate(jobs)), 1):
+               jobDone(result)
+         finally:
+            pool.close()
+            pool.join()
+      else:
+         batchWorkerInit(in_FlowDir, manifest['warm'])
+         try:
+            for args in enumerate(jobs):
+               jobDone(batchJobWorker(args))
+         finally:
+            coolFlowDir(in_FlowDir)
+   finally:
+      if gridDir:
+         shutil.rmtree(gridDir, ignore_errors=True)
+
+   # Report in manifest order, whichever worker finished first
+   position = dict((job['name'], i) for i, job in enumerate(jobs))
+   results.sort(key=lambda r: position[r['name']])
+   summary = batchFx.summarize(results, time.time() - t0, sharedSec)
+   printMsg(batchFx.reportTable(results, summary))
+   if out_Report:
+      batchFx.saveReport(out_Report, results, summary)
+      printMsg('Batch report saved to %s' % out_Report)
+   return results, summary
 
 # Use the main function below to run the catchment function directly from Python IDE with hard-coded variables
 def main():
@@ -0,0 +1,3 @@
+# Tests import the library modules from the repository folder, as the toolbox does
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,22 @@
+import backendFx
+
+def test_lazyModule():
+   loaded = []
+   mod = backendFx.LazyModule('json', loaded.append)
+   assert not mod.loaded and not loaded
+   assert mod.loads('[1]') == [1]
+   assert mod.loaded and len(loaded) == 1
+   mod.dumps([])
+   assert len(loaded) == 1
+
+def test_libraryImports():
+   # Every library module imports without arcpy; the budget is loose, as test machines vary
+   problems = backendFx.checkImportBudget(budget=10.0)
+   assert problems == []
+
+def test_checkImportBudget():
+   times = backendFx.importTimes(['gridFx', 'noSuchModule'])
+   assert times['noSuchModule'] == (None, False)
+   assert times['gridFx'][0] is not None and not times['gridFx'][1]
+   problems = backendFx.checkImportBudget(budget=1.0, times={'fast': (0.1, False), 'slow': (2.5, False), 'heavy': (0.2, True), 'broken': (None, False)})
+   assert problems == ['broken failed to import', 'heavy loads arcpy on import', 'slow took 2.50 s to import (budget 1.00 s)']
@@ -0,0 +1,19 @@
+import batchFx
+
+def test_summarize():
+   results = [{'name': 'a', 'tool': 'delineate', 'seconds': 10.0, 'features': 100, 'pid': 1, 'warmSec': 4.0, 'error': None},
+              {'name': 'b', 'tool': 'delineate', 'seconds': 10.0, 'features': 100, 'pid': 1, 'warmSec': 0.0, 'error': None},
+              {'name': 'c', 'tool': 'delineate', 'seconds': 10.0, 'features': 50, 'pid': 2, 'warmSec': 2.0, 'error': None},
+              {'name': 'd', 'tool': 'prioritize', 'seconds': 5.0, 'features': 80, 'pid': 3, 'warmSec': 0.0, 'error': 'failed'}]
+   s = batchFx.summarize(results, 30.0)
+   assert s['workers'] == 3 and s['failed'] == 1
+   assert s['warmSec'] == 6.0
+   # Three delineation jobs would each have loaded the raster, at the mean of 3 s
+   assert s['coldSec'] == 35.0 + 9.0
+   assert s['savedSec'] == 3.0
+   assert s['features'] == 250
+
+def test_loadManifest():
+   m = batchFx.loadManifest({'in_FlowDir': 'fdir', 'defaults': {'in_Feats': 'scus', 'fld_ID': 'ID'}, 'jobs': [{'out_Catch': 'a'}, {'name': 'x', 'out_Catch': 'b'}]})
+   assert [j['name'] for j in m['jobs']] == ['job1', 'x']
+   assert m['warm'] == {} and m['numWorkers'] == 1
@@ -0,0 +1,18 @@
+import os
+import cacheFx
+
+def test_catchmentKey():
+   key = cacheFx.catchmentKey(b'wkb', 500, 30, 'print', 'buffer', 'vector', 'numpy', 'shapely')
+   assert key == cacheFx.catchmentKey(b'wkb', 500, 30, 'print', 'buffer', 'vector', 'numpy', 'shapely')
+   assert key != cacheFx.catchmentKey(b'wkb', 500, 30, 'print', 'buffer', 'vector', 'arcpy', 'shapely')
+   assert key != cacheFx.catchmentKey(b'wkb', 500, 30, 'print', 'buffer', 'vector', 'numpy', 'arcpy')
+
+def test_putOverwrite(tmpdir):
+   cache = cacheFx.ResultCache(str(tmpdir))
+   cache.put('a', b'x' * 1000)
+   cache.put('a', b'y' * 10)
+   cache.put('b', b'z' * 100)
+   onDisk = sum(os.path.getsize(os.path.join(str(tmpdir), f)) for f in os.listdir(str(tmpdir)))
+   assert cache.nbytes == onDisk
+   assert cache.get('a') == b'y' * 10
+   assert cacheFx.ResultCache(str(tmpdir)).nbytes == onDisk
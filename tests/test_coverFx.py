@@ -0,0 +1,64 @@
+import numpy as np
+import coverFx
+
+def randomCellSets(seed, count = 25):
+   rng = np.random.RandomState(seed)
+   cellSets = {}
+   for k in range(count):
+      # Sizes on both sides of arrayMax, spread over several chunks
+      center = rng.randint(0, 4 * coverFx.chunkSize)
+      size = rng.choice([50, 800, 6000, 20000])
+      cellSets[100 + k] = np.clip(center + rng.randint(-size, size, size), 0, None)
+   return cellSets
+
+def naiveGreedy(sets, budget, costs):
+   '''Recomputes the gain of every candidate at every step'''
+   covered = set()
+   picks, gains = [], []
+   spent = 0.0
+   while True:
+      best, bestRatio = None, 0.0
+      for k, s in enumerate(sets):
+         if k in picks or spent + costs[k] > budget:
+            continue
+         ratio = len(s - covered) / max(costs[k], 1e-12)
+         if ratio > bestRatio:
+            best, bestRatio = k, ratio
+      if best is None:
+         break
+      picks.append(best)
+      gains.append(len(sets[best] - covered))
+      covered |= sets[best]
+      spent += costs[best]
+   affordable = [k for k in range(len(sets)) if costs[k] <= budget]
+   if affordable:
+      single = max(affordable, key=lambda k: len(sets[k]))
+      if len(sets[single]) > sum(gains):
+         picks, gains = [single], [len(sets[single])]
+   return picks, gains
+
+def test_overlaps(monkeypatch):
+   # Small blocks exercise the pairing of blocks within a chunk
+   monkeypatch.setattr(coverFx, 'blockRows', 4)
+   for seed in range(3):
+      cellSets = randomCellSets(seed)
+      index = coverFx.CoverageIndex.fromCellSets(cellSets)
+      sets = [set(cellSets[i].tolist()) for i in index.ids]
+      assert all(np.array_equal(s.cells(), np.unique(cellSets[i])) for s, i in zip(index.sets, index.ids))
+      i, j, counts = index.overlaps()
+      found = dict(((a, b), c) for a, b, c in zip(i, j, counts))
+      for a in range(len(sets)):
+         for b in range(a + 1, len(sets)):
+            assert found.get((a, b), 0) == len(sets[a] & sets[b])
+
+def test_greedy():
+   for seed in range(4):
+      cellSets = randomCellSets(seed)
+      index = coverFx.CoverageIndex.fromCellSets(cellSets, 2.0)
+      sets = [set(cellSets[i].tolist()) for i in index.ids]
+      rng = np.random.RandomState(seed)
+      for budget, costs in ((5, None), (None, None), (7.5, rng.randint(1, 5, len(sets)).astype(float))):
+         picks, gains = index.greedy(budget, costs)
+         nPicks, nGains = naiveGreedy(sets, float('inf') if budget is None else budget, np.ones(len(sets)) if costs is None else costs)
+         assert list(picks) == nPicks
+         assert np.allclose(gains, np.array(nGains) * 2.0)
@@ -0,0 +1,172 @@
+import math
+import numpy as np
+import d8Fx, gridFx
+
+def randomFlowDir(nrows, ncols, seed):
+   # Random D8 codes, with a few sinks and NoData cells; random codes also make flow loops
+   rng = np.random.RandomState(seed)
+   fdir = np.array(d8Fx.d8Codes)[rng.randint(0, 8, (nrows, ncols))]
+   fdir[rng.rand(nrows, ncols) < 0.05] = 0
+   return fdir
+
+def demFlowDir(nrows, ncols, seed):
+   # Steepest descent on a smooth random surface, giving dendritic flow like real data
+   rng = np.random.RandomState(seed)
+   dem = np.cumsum(np.cumsum(rng.rand(nrows + 8, ncols + 8) - 0.45, 0), 1)[4:-4, 4:-4]
+   dem += np.add.outer(np.arange(nrows), np.arange(ncols)) * 0.5
+   fdir = np.zeros((nrows, ncols), dtype=np.int32)
+   best = np.zeros((nrows, ncols))
+   padded = np.pad(dem, 1, mode='edge')
+   for code, dr, dc in zip(d8Fx.d8Codes, d8Fx.d8RowOff, d8Fx.d8ColOff):
+      drop = (dem - padded[1 + dr:1 + dr + nrows, 1 + dc:1 + dc + ncols]) / math.hypot(dr, dc)
+      sel = drop > best
+      fdir[sel] = code
+      best[sel] = drop[sel]
+   return fdir
+
+def bruteTrace(fdir, srcCells, cellSize = 1.0, maxDist = None, allowed = None):
+   '''Follows every cell downstream, one step at a time, to the first source cell it reaches. allowed is a boolean array of the cells a path may pass through, as if all others were NoData.'''
+   nrows, ncols = fdir.shape
+   src = set(int(c) for c in srcCells)
+   moves = dict((code, (dr, dc)) for code, dr, dc in zip(d8Fx.d8Codes, d8Fx.d8RowOff, d8Fx.d8ColOff))
+   result = {}
+   for u in range(nrows * ncols):
+      v, length, visited = u, 0.0, set()
+      while True:
+         if v in src:
+            result[u] = length
+            break
+         if (allowed is not None and not allowed[v]) or v in visited:
+            break
+         visited.add(v)
+         r, c = divmod(v, ncols)
+         if fdir[r, c] not in moves:
+            break
+         dr, dc = moves[fdir[r, c]]
+         if not (0 <= r + dr < nrows and 0 <= c + dc < ncols):
+            break
+         v = (r + dr) * ncols + c + dc
+         length += cellSize * math.hypot(dr, dc)
+   if maxDist is not None:
+      result = dict((u, d) for u, d in result.items() if d <= maxDist)
+   cells = np.array(sorted(result), dtype=np.int64)
+   return cells, np.array([result[u] for u in cells])
+
+def windowMask(shape, window):
+   mask = np.zeros(shape, dtype=bool)
+   mask[window[0]:window[1], window[2]:window[3]] = True
+   return mask.ravel()
+
+def randomSources(n, seed, count = 4):
+   rng = np.random.RandomState(seed)
+   return dict((k, rng.choice(n, rng.randint(1, 6), replace=False)) for k in range(count))
+
+def flowDirs():
+   return [randomFlowDir(17, 23, 1), randomFlowDir(30, 20, 2), demFlowDir(25, 31, 3)]
+
+def test_upstreamSets():
+   for seed, fdir in enumerate(flowDirs()):
+      sources = randomSources(fdir.size, seed)
+      traced = d8Fx.upstreamSets(fdir, sources)
+      for k, src in sources.items():
+         assert np.array_equal(traced[k], bruteTrace(fdir, src)[0])
+
+def test_flowLengthUpstream():
+   for seed, fdir in enumerate(flowDirs()):
+      for k, src in randomSources(fdir.size, seed).items():
+         for maxDist in (0.0, 2.5, 6.0, None):
+            cells, lengths = d8Fx.flowLengthUpstream(fdir, src, maxDist, 10.0 if maxDist is None else 1.0)
+            bCells, bLengths = bruteTrace(fdir, src, 10.0 if maxDist is None else 1.0, maxDist)
+            assert np.array_equal(cells, bCells)
+            assert np.allclose(lengths, bLengths)
+
+def test_flowLengthUpstreamAllowed():
+   fdir = demFlowDir(25, 31, 3)
+   allowed = np.random.RandomState(5).rand(fdir.size) < 0.8
+   for k, src in randomSources(fdir.size, 7).items():
+      cells, lengths = d8Fx.flowLengthUpstream(fdir, src, None, 1.0, lambda c: allowed[c])
+      bCells, bLengths = bruteTrace(fdir, src, allowed=allowed)
+      assert np.array_equal(cells, bCells)
+      assert np.allclose(lengths, bLengths)
+
+def test_nestedCatchments():
+   # Each cut of a catchment traced to the largest distance is what tracing to that distance gives, and each is nested in the next
+   maxDists = [0.0, 2.5, 6.0]
+   for seed, fdir in enumerate(flowDirs()):
+      for k, src in randomSources(fdir.size, seed).items():
+         cells, lengths = d8Fx.flowLengthUpstream(fdir, src, maxDists[-1], 1.0)
+         nested = d8Fx.nestedCatchments(cells, lengths, maxDists)
+         assert len(nested) == len(maxDists)
+         for d, cut in zip(maxDists, nested):
+            assert np.array_equal(cut, d8Fx.flowLengthUpstream(fdir, src, d, 1.0)[0])
+         for small, large in zip(nested[:-1], nested[1:]):
+            assert set(small.tolist()) <= set(large.tolist())
+
+def test_upstreamIndex():
+   for seed, fdir in enumerate(flowDirs()):
+      grid = gridFx.GridSpec(0.0, float(fdir.shape[0]), 1.0, fdir.shape[0], fdir.shape[1])
+      index = d8Fx.UpstreamIndex.build(fdir, grid)
+      window = (2, fdir.shape[0] - 3, 4, fdir.shape[1] - 1)
+      for k, src in randomSources(fdir.size, seed).items():
+         src = src[windowMask(fdir.shape, window)[src]]
+         cells, lengths = index.upstream(src, 5.0, window)
+         bCells, bLengths = bruteTrace(fdir, src, maxDist=5.0, allowed=windowMask(fdir.shape, window))
+         assert np.array_equal(cells, bCells)
+         assert np.allclose(lengths, bLengths)
+
+def test_traceTiled():
+   for seed, fdir in enumerate(flowDirs()):
+      grid = gridFx.GridSpec(0.0, float(fdir.shape[0]), 1.0, fdir.shape[0], fdir.shape[1])
+      sources = randomSources(fdir.size, seed, 6)
+      windows = dict((k, (k, fdir.shape[0] - 2, 2 * k, fdir.shape[1])) for k in sources)
+      sources = dict((k, src[windowMask(fdir.shape, windows[k])[src]]) for k, src in sources.items())
+      allowed = np.random.RandomState(seed).rand(fdir.size) < 0.85
+      tests = dict((k, lambda c: allowed[c]) for k in sources if k % 2)
+      for tileSize in (3, 7, 64):
+         cache = gridFx.TileCache(lambda r0, r1, c0, c1: np.array(fdir[r0:r1, c0:c1]), grid, tileSize)
+         traced = d8Fx.traceTiled(cache, sources, 7.0, windows, tests)
+         for k, src in sources.items():
+            mask = windowMask(fdir.shape, windows[k])
+            if k in tests:
+               mask &= allowed
+            bCells, bLengths = bruteTrace(fdir, src, maxDist=7.0, allowed=mask)
+            assert np.array_equal(traced[k][0], bCells)
+            assert np.allclose(traced[k][1], bLengths)
+
+def test_traceTiledMatchesIndex():
+   for seed, fdir in enumerate(flowDirs()):
+      grid = gridFx.GridSpec(0.0, float(fdir.shape[0]), 1.0, fdir.shape[0], fdir.shape[1])
+      index = d8Fx.UpstreamIndex.build(fdir, grid)
+      sources = randomSources(fdir.size, seed, 8)
+      cache = gridFx.TileCache(lambda r0, r1, c0, c1: np.array(fdir[r0:r1, c0:c1]), grid, 5)
+      for maxDist in (None, 4.5):
+         traced = d8Fx.traceTiled(cache, sources, maxDist)
+         for k, src in sources.items():
+            cells, lengths = index.upstream(src, maxDist)
+            assert np.array_equal(traced[k][0], cells)
+            assert np.allclose(traced[k][1], lengths)
+
+def test_traceCatchmentsBuffer():
+   # Catchments stay within the buffer of each feature, as with the flow direction raster clipped to it
+   fdir = demFlowDir(40, 45, 4)
+   grid = gridFx.GridSpec(100.0, 500.0, 10.0, 40, 45)
+   feats = {1: [[(200, 300), (200, 330), (240, 330), (240, 300), (200, 300)]],
+            2: [[(310, 250), (310, 270), (330, 270), (330, 250), (310, 250)]],
+            3: [[(150, 440), (150, 470), (260, 470), (260, 440), (150, 440)]]}
+   searchDist = 85.0
+   sources = gridFx.rasterizeLabels(feats, grid).zoneCells()
+   traced = d8Fx.traceCatchments(fdir, grid, feats, searchDist)
+   for myID, rings in feats.items():
+      inBuffer = gridFx.bufferTest(grid, rings, searchDist)(np.arange(fdir.size))
+      assert np.array_equal(traced[myID], bruteTrace(fdir, sources[myID], allowed=inBuffer)[0])
+
+def test_traceCatchmentsFlowDist():
+   fdir = demFlowDir(40, 45, 4)
+   grid = gridFx.GridSpec(100.0, 500.0, 10.0, 40, 45)
+   feats = {1: [[(200, 300), (200, 330), (240, 330), (240, 300), (200, 300)]], 2: [[(310, 250), (310, 270), (330, 270), (330, 250), (310, 250)]]}
+   sources = gridFx.rasterizeLabels(feats, grid).zoneCells()
+   traced = d8Fx.traceCatchments(fdir, grid, feats, 120.0, 'flowdist', True)
+   for myID in feats:
+      cells, lengths = bruteTrace(fdir, sources[myID], 10.0, 120.0)
+      assert np.array_equal(traced[myID][0], cells)
+      assert np.allclose(traced[myID][1], lengths)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import geomFx
+
+pytestmark = pytest.mark.skipif(geomFx.shapely is None, reason='requires shapely 2')
+
+def polygon(*rings):
+   return geomFx.shapely.polygons(rings[0], holes=list(rings[1:]) or None)
+
+def square(x0, y0, x1, y1):
+   return polygon([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+
+def test_coalesceSpike():
+   # A 100 x 100 square with a spike 1 unit wide and 30 long on its east side
+   spiky = polygon([(0, 0), (100, 0), (100, 49.5), (130, 49.5), (130, 50.5), (100, 50.5), (100, 100), (0, 100), (0, 0)])
+   parts, groups = geomFx.coalesceArray([spiky], [0], -5)
+   # Shrinking then growing by 5 cuts the spike off, and only rounds the corners of the square
+   assert len(parts) == 1
+   assert list(groups) == [0]
+   xmin, ymin, xmax, ymax = geomFx.shapely.bounds(parts[0])
+   assert xmax == pytest.approx(100)
+   assert geomFx.shapely.area(parts[0]) == pytest.approx(10000, rel=0.01)
+   assert geomFx.shapely.area(parts[0]) <= 10000
+
+def test_shrinkWrapBridge():
+   squares = [square(0, 0, 10, 10), square(12, 0, 22, 10)]
+   # Squares 2 apart are wrapped together when dilated by more than half the gap, and the gap between them is filled
+   wraps = geomFx.shrinkWrapArray(squares, 3, 1)
+   assert len(wraps) == 1
+   assert geomFx.shapely.contains_xy(wraps[0], 11, 5)
+   assert geomFx.shapely.area(wraps[0]) > 2 * 100 + 15
+   assert all(geomFx.shapely.covers(wraps[0], geomFx.shapely.buffer(s, -0.5)) for s in squares)
+   # With a smaller dilation, they stay apart
+   assert len(geomFx.shrinkWrapArray(squares, 0.5, 0.2)) == 2
+
+def test_repairStream():
+   bowTie = polygon([(0, 0), (10, 10), (10, 0), (0, 10), (0, 0)])
+   selfTouching = polygon([(20, 0), (30, 0), (25, 5), (30, 10), (20, 10), (25, 5), (20, 0)])
+   sliver = polygon([(40, 0), (50, 0), (45, 0), (40, 0)])
+   fine = square(60, 0, 70, 10)
+   assert not any(geomFx.shapely.is_valid([bowTie, selfTouching, sliver]))
+   rows = [(bowTie, 'a'), (geomFx.toWKB([selfTouching])[0], 'b'), (sliver, 'c'), (None, 'd'), (fine, 'e')]
+   stats = geomFx.RepairStats()
+   out = list(geomFx.repairStream(rows, stats))
+   # Every part comes back a valid polygon, with the attributes of its feature
+   assert all(geomFx.shapely.is_valid(p) and geomFx.shapely.get_type_id(p) == 3 for p, attrs in out)
+   areas = {}
+   for p, attrs in out:
+      areas[attrs] = areas.get(attrs, 0) + geomFx.shapely.area(p)
+   # The bow tie and the self-touching ring each split in two; the sliver collapses and is dropped, like the null geometry
+   assert areas == pytest.approx({'a': 50, 'b': 50, 'e': 100})
+   assert len(out) == 5
+   assert (stats.read, stats.repaired, stats.exploded, stats.dropped) == (5, 3, 2, 2)
+   assert stats.written == len(out)
+   # The same input gives the same output, however it is chunked
+   wkb = geomFx.toWKB([p for p, attrs in out])
+   for chunkSize in (1, 2, 1024):
+      again = list(geomFx.repairStream(rows, chunkSize=chunkSize))
+      assert geomFx.toWKB([p for p, attrs in again]) == wkb
+      assert [attrs for p, attrs in again] == [attrs for p, attrs in out]
@@ -0,0 +1,157 @@
+import threading
+import numpy as np
+import gridFx
+
+def makeCache(arr, tileSize, maxBytes = 2**30):
+   grid = gridFx.GridSpec(0.0, float(arr.shape[0]), 1.0, arr.shape[0], arr.shape[1])
+   return gridFx.TileCache(lambda r0, r1, c0, c1: np.array(arr[r0:r1, c0:c1]), grid, tileSize, maxBytes)
+
+def test_tileCacheThreads():
+   arr = np.arange(60 * 50, dtype=np.int32).reshape(60, 50)
+   cache = makeCache(arr, 8, maxBytes=20 * 8 * 8 * 4)
+   windows = [(r, r + 13, c, c + 11) for r in range(-5, 60, 7) for c in range(-5, 50, 9)]
+   errors = []
+   def reader():
+      for r0, r1, c0, c1 in windows:
+         block = cache.read(r0, r1, c0, c1)
+         rr0, rr1, cc0, cc1 = max(r0, 0), min(r1, 60), max(c0, 0), min(c1, 50)
+         if not np.array_equal(block[rr0 - r0:rr1 - r0, cc0 - c0:cc1 - c0], arr[rr0:rr1, cc0:cc1]):
+            errors.append((r0, c0))
+   threads = [threading.Thread(target=reader) for i in range(4)]
+   for t in threads:
+      t.start()
+   for t in threads:
+      t.join()
+   assert not errors
+   # Counters and the byte total stay consistent when several threads share the cache
+   assert cache.nbytes == sum(t.nbytes for t in cache.tiles.values())
+   assert cache.nbytes <= cache.maxBytes
+
+def test_tileCacheReadOutside():
+   arr = np.arange(20 * 30, dtype=np.uint8).reshape(20, 30)
+   # A block entirely outside the grid still comes back in the grid's type, even before any tile is read
+   grid = makeCache(arr, 8).grid
+   for cache, dtype in ((makeCache(arr, 8), np.uint8), (gridFx.TileCache(lambda r0, r1, c0, c1: arr[r0:r1, c0:c1], grid, 8, dtype=np.int16), np.int16)):
+      block = cache.read(-10, -2, 40, 45)
+      assert block.shape == (8, 5)
+      assert block.dtype == dtype
+      assert (block == 0).all()
+      assert cache.read(-2, 3, 0, 3).dtype == dtype
+
+def test_labelGridOverlaps():
+   grid = gridFx.GridSpec(0.0, 40.0, 1.0, 40, 40)
+   square = lambda x0, y0, x1, y1: [[(x0, y0), (x0, y1), (x1, y1), (x1, y0), (x0, y0)]]
+   # Two overlapping squares, a triangle over both, and a square with a hole in which a fifth sits
+   feats = {1: square(2, 2, 20, 20), 2: square(10.5, 10.5, 30, 30), 3: [[(5, 25), (35, 5), (35, 35), (5, 25)]],
+            4: square(3, 3, 18, 18) + square(8, 8, 12, 12), 5: square(9, 9, 11, 11)}
+   for allTouched in (False, True):
+      labels = gridFx.rasterizeLabels(feats, grid, allTouched)
+      zoneCells = labels.zoneCells()
+      # Every zone gets all of its cells, including those it shares, as if burned on its own
+      for myID, rings in feats.items():
+         assert np.array_equal(zoneCells[myID], gridFx.rasterizeRings(rings, grid, allTouched))
+      counts = {}
+      for cells in zoneCells.values():
+         for c in cells.tolist():
+            counts[c] = counts.get(c, 0) + 1
+      shared = sorted(c for c, n in counts.items() if n > 1)
+      assert len(shared) > 0
+      assert np.array_equal(labels.overlapCells, shared)
+      assert (labels.array().ravel()[shared] == -1).all()
+
+def test_strIndexQuery():
+   rng = np.random.RandomState(9)
+   xy = rng.rand(500, 2) * 1000
+   boxes = np.column_stack([xy, xy + rng.rand(500, 2) * 60])
+   # Same as testing every envelope, boxes touching the query at an edge included
+   brute = lambda x0, y0, x1, y1: np.nonzero((boxes[:,0] <= x1) & (boxes[:,2] >= x0) & (boxes[:,1] <= y1) & (boxes[:,3] >= y0))[0]
+   for nodeSize in (4, 16):
+      index = gridFx.STRIndex(boxes, nodeSize)
+      assert len(index) == len(boxes)
+      for q in range(100):
+         x0, y0 = rng.rand(2) * 1100 - 50
+         w, h = rng.rand(2) * 200
+         assert np.array_equal(index.query(x0, y0, x0 + w, y0 + h), brute(x0, y0, x0 + w, y0 + h))
+      assert np.array_equal(index.query(*boxes[7]), brute(*boxes[7]))
+   assert len(gridFx.STRIndex(np.zeros((0, 4))).query(0, 0, 1, 1)) == 0
+
+def test_tileCacheLRU():
+   arr = np.arange(32 * 32, dtype=np.int32).reshape(32, 32)
+   # Room for three 8 x 8 tiles of 4-byte cells
+   cache = makeCache(arr, 8, maxBytes=3 * 8 * 8 * 4)
+   for tr, tc in [(0, 0), (0, 1), (0, 2), (0, 0), (0, 3), (0, 1), (0, 0), (0, 2)]:
+      assert np.array_equal(cache.getTile(tr, tc), arr[tr * 8:(tr + 1) * 8, tc * 8:(tc + 1) * 8])
+   # Rereading (0, 0) kept it over (0, 1), which went first; (0, 2) and (0, 3) followed
+   assert (cache.hits, cache.misses, cache.evictions) == (2, 6, 3)
+   assert list(cache.tiles.keys()) == [(0, 1), (0, 0), (0, 2)]
+   assert cache.nbytes == 3 * 8 * 8 * 4
+   # Cycling over more tiles than fit misses every time, and the cache stays within its bound
+   for rep in range(3):
+      for tc in range(4):
+         cache.getTile(1, tc)
+   assert (cache.hits, cache.misses) == (2, 18)
+   assert cache.nbytes == sum(t.nbytes for t in cache.tiles.values()) <= cache.maxBytes
+   # A window over four tiles reads them once, then is served from memory
+   cache = makeCache(arr, 8, maxBytes=4 * 8 * 8 * 4)
+   for rep in range(3):
+      assert np.array_equal(cache.read(4, 12, 4, 12), arr[4:12, 4:12])
+   assert (cache.hits, cache.misses, cache.evictions) == (8, 4, 0)
+
+def test_hilbertOrder():
+   # On a full 16 x 16 lattice, the Hilbert curve visits every point once, moving one cell at a time
+   rng = np.random.RandomState(4)
+   xs, ys = [a.ravel() for a in np.meshgrid(np.arange(16.0), np.arange(16.0))]
+   shuffle = rng.permutation(len(xs))
+   xs, ys = xs[shuffle], ys[shuffle]
+   order = gridFx.hilbertOrder(xs, ys, bits=4)
+   assert np.array_equal(np.sort(order), np.arange(len(xs)))
+   assert (np.abs(np.diff(xs[order])) + np.abs(np.diff(ys[order])) == 1).all()
+   # Random points in Hilbert order are much closer to the next one than in random order
+   xs, ys = rng.rand(2, 2000) * 1000
+   order = gridFx.hilbertOrder(xs, ys)
+   assert np.array_equal(np.sort(order), np.arange(2000))
+   step = lambda o: np.hypot(np.diff(xs[o]), np.diff(ys[o])).mean()
+   assert step(order) < step(np.arange(2000)) / 5
+
+def blobMask(nrows, ncols, seed):
+   # Random blobs with holes, lone cells and parts touching only at corners
+   rng = np.random.RandomState(seed)
+   mask = rng.rand(nrows, ncols) < 0.45
+   for i in range(2):
+      mask = (mask.astype(int) + gridFx.dilate(mask) + gridFx.erode(mask)) >= 2
+   return mask
+
+def test_cellsToRegions():
+   grid = gridFx.GridSpec(500.0, 800.0, 2.5, 40, 50)
+   for seed in range(4):
+      mask = blobMask(40, 50, seed)
+      cells = np.nonzero(mask.ravel())[0]
+      regions = gridFx.cellsToRegions(cells, grid)
+      # One region per edge-connected group of cells, in the same order, each as large as its cells
+      comp, ncomp = gridFx.labelComponents(mask, 4)
+      assert len(regions) == ncomp
+      sizes = np.bincount(comp[mask])
+      for k, rings in enumerate(regions):
+         area = -gridFx.ringArea(rings[0]) - sum(gridFx.ringArea(r) for r in rings[1:])
+         assert np.isclose(area, sizes[k] * grid.cellSize ** 2)
+         # Burned back by cell center, the region gives back exactly its cells
+         assert np.array_equal(gridFx.rasterizeRings(rings, grid, False), np.nonzero((comp == k).ravel())[0])
+      total = sum(-gridFx.ringArea(rings[0]) - sum(gridFx.ringArea(r) for r in rings[1:]) for rings in regions)
+      assert np.isclose(total, len(cells) * grid.cellSize ** 2)
+
+def test_eliminateParts():
+   mask = np.zeros((30, 30), dtype=bool)
+   mask[1:16, 1:16] = True # 225 cells
+   mask[3:6, 3:8] = False # hole of 15 cells
+   mask[10, 10:13] = False # hole of 3 cells
+   mask[16, 16] = True # touches the big part at a corner, so belongs to it
+   mask[20:22, 20:22] = True # part of 4 cells
+   mask[20:23, 1:5] = True # part of 12 cells
+   # Outer area of 225 + 1 + 4 + 12 cells; parts and holes under 10 cells go
+   out = gridFx.eliminateParts(mask, 10.0 / 242)
+   expected = mask.copy()
+   expected[20:22, 20:22] = False
+   expected[10, 10:13] = True
+   assert np.array_equal(out, expected)
+   # Nothing is removed at a threshold below the smallest part and hole
+   assert np.array_equal(gridFx.eliminateParts(mask, 2.0 / 242), mask)
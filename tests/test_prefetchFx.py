@@ -0,0 +1,69 @@
+import threading, time
+import pytest
+import prefetchFx
+
+def slowLoad(item):
+   # Later items load faster, so that with several threads they finish out of order
+   time.sleep(0.002 * (10 - item % 10))
+   return item * 10
+
+def test_order():
+   items = list(range(40))
+   for depth, numThreads in ((1, 1), (3, 4), (8, 3)):
+      prefetcher = prefetchFx.Prefetcher(slowLoad, items, depth, numThreads)
+      got = [(item, fetch()) for item, fetch in prefetcher]
+      assert got == [(i, i * 10) for i in items]
+      st = prefetcher.stats()
+      assert st['items'] == len(items)
+      assert st['maxDepth'] <= depth
+
+def test_loadError():
+   def load(item):
+      if item == 3:
+         raise ValueError('bad item %s' % item)
+      return item
+   for depth, numThreads in ((0, 1), (2, 1), (4, 3)):
+      got = []
+      for item, fetch in prefetchFx.Prefetcher(load, range(8), depth, numThreads):
+         # The error comes back with its own item, and the others are unaffected
+         if item == 3:
+            with pytest.raises(ValueError, match='bad item 3'):
+               fetch()
+         else:
+            got.append(fetch())
+      assert got == [0, 1, 2, 4, 5, 6, 7]
+
+def test_earlyBreak():
+   loaded = []
+   def load(item):
+      time.sleep(0.01)
+      loaded.append(item)
+      return item
+   def consume():
+      for item, fetch in prefetchFx.Prefetcher(load, range(100), 4, 3):
+         if fetch() == 2:
+            break
+   before = threading.active_count()
+   consumer = threading.Thread(target=consume)
+   consumer.daemon = True
+   consumer.start()
+   consumer.join(5)
+   # Breaking out stops and joins the producers, rather than hanging or loading everything
+   assert not consumer.is_alive()
+   assert threading.active_count() == before
+   assert len(loaded) < 20
+
+def test_depthZero():
+   threads = []
+   events = []
+   def load(item):
+      threads.append(threading.current_thread())
+      events.append(('load', item))
+      return item
+   prefetcher = prefetchFx.Prefetcher(load, range(5), 0)
+   for item, fetch in prefetcher:
+      events.append(('use', fetch()))
+   # Each item is loaded in the consumer's thread, only once the one before it has been used
+   assert all(t is threading.current_thread() for t in threads)
+   assert events == [(e, i) for i in range(5) for e in ('load', 'use')]
+   assert prefetcher.stats()['waits'] == 5
@@ -0,0 +1,35 @@
+import time
+import numpy as np
+import profileFx
+
+def test_nestedPeaks():
+   prof = profileFx.Profiler(traceMemory=True, sampleSec=0.005)
+   with prof.stage('outer'):
+      with prof.stage('big'):
+         a = np.ones(2**23)
+         a += 1
+         time.sleep(0.05)
+         del a
+      with prof.stage('small'):
+         b = np.ones(2**10)
+         time.sleep(0.02)
+   prof.close()
+   recs = dict((r['stage'], r) for r in prof.records)
+   # The peak of each stage is its own, not that of the stage before it; an enclosing stage takes the peaks of the stages within it
+   if prof.traceMemory:
+      assert recs['big']['pyPeakMB'] >= 60
+      assert recs['small']['pyPeakMB'] < 30
+      assert recs['outer']['pyPeakMB'] >= recs['big']['pyPeakMB']
+   if prof.sampleSec:
+      assert recs['big']['peakMB'] >= recs['big']['memMB']
+      assert recs['outer']['peakMB'] >= recs['big']['peakMB']
+   rows = dict((r['stage'], r) for r in prof.summary())
+   assert rows['outer']['peakMaxMB'] == recs['outer']['peakMB']
+   assert 'Peak (MB)' in prof.summaryTable()
+
+def test_samplerStops():
+   prof = profileFx.activate(profileFx.Profiler(sampleSec=0.005))
+   with profileFx.stage('run'):
+      pass
+   assert profileFx.deactivate() is prof
+   assert prof._sampler is None
@@ -0,0 +1,13 @@
+import numpy as np
+import rankFx
+
+def test_rankTopKTies():
+   rng = np.random.RandomState(0)
+   n = 200
+   # Few distinct values, so that many SCUs tie
+   table = rankFx.SCUTable(np.arange(n) + 1, rng.randint(1, 6, n), {'WtrshdInteg': rng.randint(0, 3, n), 'ConsPrior': rng.randint(0, 2, n), 'Vuln': np.ones(n)})
+   fullIdx, fullScores = table.rank(lo_BRANK='B4')
+   for k in (1, 5, 17, 60, len(fullIdx), len(fullIdx) + 5):
+      idx, scores = table.rank(lo_BRANK='B4', k=k)
+      assert np.array_equal(idx, fullIdx[:k])
+      assert np.array_equal(scores, fullScores[:k])
@@ -0,0 +1,36 @@
+import os, time
+import scuBench
+
+def crashCase(numFeats):
+   os._exit(3)
+
+def slowCase(numFeats):
+   time.sleep(30)
+   return numFeats
+
+def test_smoke():
+   results = scuBench.runBenchmarks([40, 80], ['delineate', 'zonal', 'sensitivity', 'coverage'], timeout=120)
+   assert results
+   for res in results:
+      assert 'error' not in res, res
+      assert res['features'] > 0 and res['seconds'] >= 0
+   assert 'Features/s' in scuBench.reportTable(results)
+
+def test_crash():
+   res = scuBench.runCase(crashCase, 10)
+   assert 'exit code 3' in res['error']
+
+def test_timeout():
+   t0 = time.time()
+   res = scuBench.runCase(slowCase, 10, timeout=1)
+   assert 'timed out' in res['error']
+   assert time.time() - t0 < 10
+
+def test_compareResults():
+   baseline = [{'benchmark': 'zonal', 'backend': 'numpy', 'size': 100, 'seconds': 1.0},
+               {'benchmark': 'coverage', 'backend': 'numpy', 'size': 100, 'seconds': 1.0}]
+   results = [{'benchmark': 'zonal', 'backend': 'numpy', 'size': 100, 'seconds': 1.2},
+              {'benchmark': 'coverage', 'backend': 'numpy', 'size': 100, 'error': 'MemoryError: '},
+              {'benchmark': 'delineate', 'backend': 'numpy', 'size': 100, 'seconds': 5.0}]
+   assert scuBench.compareResults(results, baseline) == ['coverage (numpy) with 100 features failed: MemoryError: ']
+   assert len(scuBench.compareResults(results, baseline, 0.1)) == 2
@@ -0,0 +1,90 @@
+import json, types
+import pytest
+import profileFx, scuFX
+
+class FakeSR(object):
+   Name = 'NAD_1983_Albers'
+   linearUnitName = 'Meter'
+
+def patchDelineation(monkeypatch, process):
+   '''Replaces the geoprocessing around the delineation in scuFX with stand-ins, so that delineatePolyCatchments can run without arcpy. Returns the list of workspaces deleted.'''
+   fake = types.SimpleNamespace(Describe=lambda x: types.SimpleNamespace(spatialReference=FakeSR()), CopyFeatures_management=lambda a, b: None)
+   deleted = []
+   monkeypatch.setattr(scuFX, 'arcpy', fake)
+   monkeypatch.setattr(scuFX, 'rasterProperties', lambda r: ('30', FakeSR()))
+   monkeypatch.setattr(scuFX, 'createTmpWorkspace', lambda tag=None: 'workGDB')
+   monkeypatch.setattr(scuFX, 'garbagePickup', lambda trash: deleted.extend(trash))
+   monkeypatch.setattr(scuFX, 'printMsg', lambda msg: None)
+   monkeypatch.setattr(scuFX, 'printWrng', lambda msg: None)
+   monkeypatch.setattr(scuFX, 'processCatchments', process)
+   def write(*args):
+      with profileFx.stage('writeBatch'):
+         pass
+   monkeypatch.setattr(scuFX, 'writeCatchments', write)
+   return deleted
+
+def test_profileWrite(monkeypatch, tmp_path):
+   def process(*args):
+      with profileFx.stage('trace', feature=1, cells=10):
+         pass
+      return [], [[]], [{}]
+   patchDelineation(monkeypatch, process)
+   out = str(tmp_path / 'profile.json')
+   scuFX.delineatePolyCatchments('feats', 'ID', 'fdir', 'catch', backend='numpy', profileOut=out)
+   # Writing the catchments is profiled along with the delineation
+   stages = [r['stage'] for r in json.load(open(out))['records']]
+   assert 'trace' in stages
+   assert 'write' in stages
+   assert 'writeBatch' in stages
+   assert profileFx.active() is None
+
+def test_workCleanup(monkeypatch):
+   def process(*args):
+      raise RuntimeError('trace failed')
+   deleted = patchDelineation(monkeypatch, process)
+   # The working copy is deleted even though the delineation failed
+   with pytest.raises(RuntimeError):
+      scuFX.delineatePolyCatchments('feats', 'ID', 'fdir', 'catch', backend='numpy')
+   assert deleted == ['workGDB']
+
+def failingBatch(args):
+   '''Stands in for catchBatchWorker, failing on the third batch'''
+   if args[0] == 2:
+      raise RuntimeError('worker died')
+   return (args[0], 'ws%s' % args[0], [], [[]], [{}], [])
+
+def test_poolCleanup(monkeypatch):
+   deleted = patchDelineation(monkeypatch, None)
+   feats = [(i, (float(i), 0.0)) for i in range(8)]
+   scuFX.arcpy.Describe = lambda x: types.SimpleNamespace(catalogPath=x)
+   scuFX.arcpy.da = types.SimpleNamespace(SearchCursor=lambda fc, flds: iter(feats))
+   monkeypatch.setattr(scuFX, 'catchBatchWorker', failingBatch)
+   # With one worker, batches finish in order, so the two before the failure have scratch geodatabases to delete
+   with pytest.raises(RuntimeError):
+      scuFX.delineateParallel('feats', 'ID', 'fdir', '500 METERS', 'in_memory', 'numpy', 'buffer', 1)
+   assert sorted(deleted) == ['ws0', 'ws1']
+
+def test_catchmentKeys():
+   one = scuFX.catchmentKeys(b'wkb', ['500 METERS'], 30, 'print', 'buffer', 'vector', 'numpy', 'shapely')
+   two = scuFX.catchmentKeys(b'wkb', ['500 METERS', '1000 METERS'], 30, 'print', 'buffer', 'vector', 'numpy', 'shapely')
+   # In buffer mode, the 500 m catchment traced in a 3000 m window is not the one traced in a 1500 m window
+   assert len(two) == 2
+   assert one[0] != two[0]
+   assert two == scuFX.catchmentKeys(b'wkb', ['500 METERS', '1000 METERS'], 30, 'print', 'buffer', 'vector', 'numpy', 'shapely')
+   # With flow distance truncation, each catchment depends on its own distance only
+   one = scuFX.catchmentKeys(b'wkb', ['500 METERS'], 30, 'print', 'flowdist', 'vector', 'numpy', 'shapely')
+   two = scuFX.catchmentKeys(b'wkb', ['500 METERS', '1000 METERS'], 30, 'print', 'flowdist', 'vector', 'numpy', 'shapely')
+   assert one[0] == two[0]
+
+def test_distanceList():
+   assert scuFX.distanceList('500 METERS') == ['500 METERS']
+   assert scuFX.distanceList("500 METERS;'1 KILOMETERS'; 2000 METERS") == ['500 METERS', '1 KILOMETERS', '2000 METERS']
+   assert scuFX.distanceList(['500 METERS', ' 1000 METERS ']) == ['500 METERS', '1000 METERS']
+   assert scuFX.distanceList('') == []
+
+def test_thresholdName():
+   assert scuFX.thresholdName('C:/out.gdb/scuCatch', '500 METERS') == 'C:/out.gdb/scuCatch_500_METERS'
+   assert scuFX.thresholdName('C:/out/scuCatch.shp', '1.5 KILOMETERS') == 'C:/out/scuCatch_1_5_KILOMETERS.shp'
+   assert scuFX.thresholdName('C:/out/scu.gpkg', '500 METERS') == 'C:/out/scu_500_METERS.gpkg'
+   # A dot in a geodatabase path is not taken for an extension
+   assert scuFX.thresholdName('C:/out.gdb/scuCatch.v2', '500 METERS') == 'C:/out.gdb/scuCatch.v2_500_METERS'
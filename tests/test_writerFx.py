@@ -0,0 +1,51 @@
+import os, struct, sqlite3
+import writerFx
+
+albers = 'PROJCS["NAD_1983_Albers",GEOGCS["GCS_North_American_1983"]];-16901100 -6972200 10000;-100000 10000;0.001;0.001;IsHighPrecision'
+
+def square(x0, y0, size):
+   ring = [(x0, y0), (x0 + size, y0), (x0 + size, y0 + size), (x0, y0 + size), (x0, y0)]
+   return struct.pack('<BII', 1, 3, 1) + struct.pack('<I', len(ring)) + b''.join(struct.pack('<2d', *p) for p in ring)
+
+def writeLayer(path, crsWKT, epsg, shapes):
+   with writerFx.openWriter(path, [('lngID', 'LONG')], crsWKT, epsg, batchSize=2) as writer:
+      for i, wkb in enumerate(shapes):
+         writer.add(wkb, [i])
+
+def test_wkbEnvelope():
+   assert writerFx.wkbEnvelope(square(2, 3, 4)) == (2, 6, 3, 7)
+   multi = struct.pack('<BII', 1, 6, 2) + square(0, 0, 1) + square(5, -2, 1)
+   assert writerFx.wkbEnvelope(multi) == (0, 6, -2, 1)
+   pointZ = struct.pack('<BIddd', 1, 1001, 3, 4, 5)
+   assert writerFx.wkbEnvelope(pointZ) == (3, 3, 4, 4)
+   assert writerFx.wkbEnvelope(struct.pack('<BII', 1, 3, 0)) is None
+
+def test_geopackageCoordinateSystems(tmpdir):
+   gpkg = os.path.join(str(tmpdir), 'out.gpkg')
+   writeLayer(gpkg + '/a', albers, 0, [square(0, 0, 1)])
+   writeLayer(gpkg + '/b', 'PROJCS["Other"]', 0, [square(0, 0, 1)])
+   writeLayer(gpkg + '/c', albers, 0, [square(0, 0, 1)])
+   writeLayer(gpkg + '/d', albers, 26917, [square(0, 0, 1)])
+   conn = sqlite3.connect(gpkg)
+   srs = dict((t, s) for t, s in conn.execute('SELECT table_name, srs_id FROM gpkg_geometry_columns'))
+   defs = dict(conn.execute('SELECT srs_id, definition FROM gpkg_spatial_ref_sys'))
+   # Custom coordinate systems get their own IDs, reused when the definition matches, and lose arcpy's domain suffix
+   assert srs['a'] == srs['c'] != srs['b']
+   assert defs[srs['a']] == albers.split(';')[0]
+   assert defs[srs['b']] == 'PROJCS["Other"]'
+   assert srs['d'] == 26917
+   conn.close()
+
+def test_geopackageSpatialIndex(tmpdir):
+   gpkg = os.path.join(str(tmpdir), 'out.gpkg')
+   writeLayer(gpkg, albers, 0, [square(i, 2 * i, 1) for i in range(5)] + [None])
+   conn = sqlite3.connect(gpkg)
+   assert conn.execute('SELECT count(*) FROM out').fetchone()[0] == 6
+   index = conn.execute('SELECT id, minx, maxx, miny, maxy FROM rtree_out_geom ORDER BY id').fetchall()
+   assert index == [(i + 1, i, i + 1, 2 * i, 2 * i + 1) for i in range(5)]
+   assert conn.execute('SELECT extension_name FROM gpkg_extensions WHERE table_name = ?', ('out',)).fetchall() == [('gpkg_rtree_index',)]
+   assert conn.execute('SELECT min_x, min_y, max_x, max_y FROM gpkg_contents').fetchone() == (0, 0, 5, 9)
+   # Geometry blobs carry their envelope
+   blob = conn.execute('SELECT geom FROM out WHERE fid = 2').fetchone()[0]
+   assert struct.unpack_from('<2sBBi4d', blob) == (b'GP', 0, 3, 100000, 1, 2, 2, 3)
+   conn.close()
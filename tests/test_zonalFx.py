@@ -0,0 +1,38 @@
+import numpy as np
+import gridFx, zonalFx
+
+def bruteStats(values, cellSets, nodata):
+   '''Statistics of each zone from its own cells, one zone at a time'''
+   flat = values.ravel()
+   out = {}
+   for z, cells in cellSets.items():
+      vals = flat[np.asarray(cells, dtype=np.int64)]
+      vals = vals[~np.isnan(vals) & (vals != nodata)]
+      if len(vals):
+         out[z] = (len(vals), vals.sum(), vals.mean(), vals.min(), vals.max())
+      else:
+         out[z] = (0, 0.0, np.nan, np.nan, np.nan)
+   return out
+
+def test_zonalStats():
+   rng = np.random.RandomState(3)
+   grid = gridFx.GridSpec(0.0, 50.0, 1.0, 50, 40)
+   values = rng.rand(50, 40) * 100
+   values[rng.rand(50, 40) < 0.1] = -9999
+   values[rng.rand(50, 40) < 0.05] = np.nan
+   # Overlapping zones of random cells, one sharing every cell of another, and one with only NoData cells
+   cellSets = dict((z, rng.choice(values.size, rng.randint(1, 300), replace=False)) for z in range(1, 9))
+   cellSets[9] = cellSets[1]
+   values.ravel()[[7, 8, 9]] = -9999
+   cellSets[10] = np.array([7, 8, 9])
+   membership = zonalFx.ZoneMembership.fromCellSets(grid, cellSets)
+   readBlock = lambda r0, r1, c0, c1: values[r0:r1, c0:c1]
+   expected = bruteStats(values, cellSets, -9999)
+   # Blocks of all sizes give the same result, whether or not a zone's cells straddle them
+   for blockRows in (1, 7, 512):
+      stats = zonalFx.zonalStats(membership, readBlock, blockRows, -9999)
+      for i, z in enumerate(stats['ids']):
+         got = (stats['count'][i], stats['sum'][i], stats['mean'][i], stats['min'][i], stats['max'][i])
+         assert got[0] == expected[z][0]
+         assert np.allclose(got[1:], expected[z][1:], equal_nan=True)
+   assert stats['count'][stats['ids'].index(10)] == 0
@@ -0,0 +1,360 @@
+# ----------------------------------------------------------------------------------------
+# writerFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# Batched feature writers for several output formats: ArcGIS feature classes (file geodatabase or shapefile), GeoPackage, GeoParquet and FlatGeobuf. Rows are gathered in memory and written in bulk, one insert pass or transaction per batch, instead of one cursor update per feature.
+
+# Usage Tips:
+# Use openWriter, which picks the writer from the output path, and add rows as WKB geometry plus a list of attribute values:
+#    with writerFx.openWriter(path, [('lngID', 'LONG'), ('Suspect', 'SHORT')], sr.exportToString(), sr.factoryCode) as writer:
+#       writer.add(wkb, [myID, 0])
+# The coordinate system may be given as arcpy's SpatialReference.exportToString(): its WKT is used outside arcpy, without the domain and tolerance arcpy appends after it. An authority code (factoryCode), when there is one, is preferred to the WKT for GeoParquet and FlatGeobuf, and is recorded in GeoPackages.
+# Field types are given as in arcpy: SHORT, LONG, DOUBLE, TEXT, or DATE (written as ISO 8601 text outside arcpy).
+# A GeoPackage path may name the layer after the file, as ArcGIS does (e.g. C:\out\scu.gpkg\catch or C:\out\scu.gpkg\main.catch); otherwise the layer is named after the file. Several layers may be written to one GeoPackage.
+# Existing outputs are replaced.
+
+# Dependencies:
+# Python standard library for GeoPackage. arcpy for feature classes, pyarrow for GeoParquet (with pyproj, if installed, to record the coordinate system), and GDAL (osgeo.ogr) for FlatGeobuf. The module imports without any of these, but the writers that need them will raise ImportError.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, json, struct, sqlite3, datetime
+try:
+   import pyarrow, pyarrow.parquet
+except ImportError:
+   pyarrow = None
+try:
+   import pyproj
+except ImportError:
+   pyproj = None
+try:
+   from osgeo import ogr, osr
+except ImportError:
+   ogr = None
+
+class FeatureWriter(object):
+   '''Base class for the writers. Gathers rows of (WKB geometry, attribute values) in memory and hands them to _write in batches of batchSize. Subclasses set up the output in _open and finish it in _close.
+   fields: list of (name, type) pairs for the attribute fields, in the order of the values given to add
+   crsWKT, epsg: the coordinate system of the geometries, as WKT (or arcpy's SpatialReference.exportToString()) and/or an EPSG or Esri code (0 or None if it has none)'''
+   def __init__(self, path, fields, crsWKT = None, epsg = None, batchSize = 1000):
+      self.path = path
+      self.fields = list(fields)
+      # arcpy appends the domain, resolution and tolerance to the WKT after a ";"; only arcpy can read those
+      self.crsString = crsWKT or None
+      self.crsWKT = crsWKT.split(';')[0] if crsWKT else None
+      self.epsg = epsg or None
+      self.batchSize = batchSize
+      self.rows = []
+      self.written = 0
+      self.batches = 0
+      self._open()
+
+   def add(self, wkb, values):
+      '''Adds one feature, writing out the batch if it is full'''
+      self.rows.append((None if wkb is None else bytes(wkb), list(values)))
+      if len(self.rows) >= self.batchSize:
+         self.flush()
+
+   def flush(self):
+      '''Writes out the rows gathered so far'''
+      if self.rows:
+         self._write(self.rows)
+         self.written += len(self.rows)
+         self.batches += 1
+         self.rows = []
+
+   def close(self):
+      '''Writes out any remaining rows and finishes the output. Returns the output path.'''
+      self.flush()
+      self._close()
+      return self.path
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, excType, excValue, tb):
+      self.close()
+
+   @property
+   def authority(self):
+      '''Returns the authority of the coordinate system code: "EPSG", or "ESRI" for the codes of 100000 and up that only Esri defines'''
+      if not self.epsg:
+         return None
+      return 'EPSG' if self.epsg < 100000 else 'ESRI'
+
+   def _textValues(self, values):
+      # For formats without a date type, dates are written as ISO 8601 text
+      return [v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v for v in values]
+
+   def _open(self):
+      pass
+
+   def _write(self, rows):
+      raise NotImplementedError
+
+   def _close(self):
+      pass
+
+class ArcpyWriter(FeatureWriter):
+   '''Writes a new feature class (file geodatabase or shapefile) with one InsertCursor pass per batch'''
+   def _open(self):
+      global arcpy
+      import arcpy
+      if arcpy.Exists(self.path):
+         arcpy.Delete_management(self.path)
+      self.sr = arcpy.SpatialReference()
+      if self.crsString:
+         self.sr.loadFromString(self.crsString)
+      elif self.epsg:
+         self.sr = arcpy.SpatialReference(self.epsg)
+      else:
+         self.sr = None
+      folder, fcName = os.path.split(self.path)
+      arcpy.CreateFeatureclass_management(folder, fcName, "POLYGON", "", "", "", self.sr)
+      for name, ftype in self.fields:
+         if ftype == 'TEXT':
+            arcpy.AddField_management(self.path, name, ftype, "", "", 255)
+         else:
+            arcpy.AddField_management(self.path, name, ftype)
+
+   def _write(self, rows):
+      cursor = arcpy.da.InsertCursor(self.path, ["SHAPE@WKB"] + [f[0] for f in self.fields])
+      for wkb, values in rows:
+         cursor.insertRow([None if wkb is None else bytearray(wkb)] + values)
+      del cursor
+
+class GeoPackageWriter(FeatureWriter):
+   '''Writes a GeoPackage feature table with sqlite3, one transaction per batch. Geometries are stored as GeoPackage binary (WKB behind a header holding its envelope), and their envelopes are added to an R-tree spatial index as they are written. The index triggers, which call the ST_ functions GDAL and other GeoPackage readers provide, are only created once all rows are in.'''
+   sqlTypes = {'SHORT': 'SMALLINT', 'LONG': 'INTEGER', 'DOUBLE': 'DOUBLE', 'TEXT': 'TEXT', 'DATE': 'DATETIME'}
+
+   def _open(self):
+      # Split a layer name from the file path, if one follows it
+      lower = self.path.lower()
+      pos = lower.find('.gpkg')
+      self.gpkgPath = self.path[:pos + 5]
+      layer = self.path[pos + 5:].lstrip('\\/')
+      if layer.lower().startswith('main.'):
+         layer = layer[5:]
+      self.table = layer or os.path.splitext(os.path.basename(self.gpkgPath))[0]
+      self.rtree = 'rtree_%s_geom' % self.table
+      self.extent = None
+
+      self.conn = sqlite3.connect(self.gpkgPath)
+      cur = self.conn.cursor()
+      cur.execute('PRAGMA application_id = 1196444487') # "GPKG"
+      cur.execute('PRAGMA user_version = 10300')
+      cur.execute('CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)')
+      cur.execute('CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT \'\', last_change DATETIME NOT NULL DEFAULT (strftime(\'%Y-%m-%dT%H:%M:%fZ\',\'now\')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))')
+      cur.execute('CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))')
+      cur.execute('CREATE TABLE IF NOT EXISTS gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))')
+
+      # The three coordinate systems every GeoPackage must hold
+      srsRows = [('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'), ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'), ('WGS 84 geodetic', 4326, 'EPSG', 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]', 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')]
+      cur.executemany('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', srsRows)
+      self.srsID = self._srsID(cur)
+
+      # Replace the table if it exists
+      cur.execute('DROP TABLE IF EXISTS "%s"' % self.table)
+      cur.execute('DROP TABLE IF EXISTS "%s"' % self.rtree)
+      cur.execute('DELETE FROM gpkg_extensions WHERE table_name = ?', (self.table,))
+      cur.execute('DELETE FROM gpkg_geometry_columns WHERE table_name = ?', (self.table,))
+      cur.execute('DELETE FROM gpkg_contents WHERE table_name = ?', (self.table,))
+      cols = ['fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL', 'geom GEOMETRY'] + ['"%s" %s' % (name, self.sqlTypes[ftype]) for name, ftype in self.fields]
+      cur.execute('CREATE TABLE "%s" (%s)' % (self.table, ', '.join(cols)))
+      cur.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)', (self.table, 'features', self.table, self.srsID))
+      cur.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)', (self.table, 'geom', 'GEOMETRY', self.srsID, 0, 0))
+      try:
+         cur.execute('CREATE VIRTUAL TABLE "%s" USING rtree(id, minx, maxx, miny, maxy)' % self.rtree)
+      except sqlite3.OperationalError:
+         # SQLite built without the R-tree module
+         self.rtree = None
+      self.conn.commit()
+      # Feature IDs are given explicitly, so that the same IDs can go into the spatial index
+      self._insert = 'INSERT INTO "%s" (fid, geom%s) VALUES (?, ?%s)' % (self.table, ''.join(', "%s"' % f[0] for f in self.fields), ', ?' * len(self.fields))
+
+   def _srsID(self, cur):
+      '''Returns the srs_id of the output coordinate system: that of a row already holding the same authority code or, without a code, the same definition, or else a new row. Coordinate systems without a free authority code get the next ID from 100000 up.'''
+      if not (self.epsg or self.crsWKT):
+         return -1
+      if self.epsg:
+         row = cur.execute('SELECT srs_id FROM gpkg_spatial_ref_sys WHERE upper(organization) = ? AND organization_coordsys_id = ?', (self.authority, self.epsg)).fetchone()
+      else:
+         row = cur.execute('SELECT srs_id FROM gpkg_spatial_ref_sys WHERE definition = ?', (self.crsWKT,)).fetchone()
+      if row:
+         return row[0]
+      srsID = self.epsg
+      if not srsID or cur.execute('SELECT 1 FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srsID,)).fetchone():
+         srsID = max(100000, cur.execute('SELECT max(srs_id) FROM gpkg_spatial_ref_sys').fetchone()[0] + 1)
+      if self.epsg:
+         cur.execute('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', ('%s:%s' % (self.authority, self.epsg), srsID, self.authority, self.epsg, self.crsWKT or 'undefined', None))
+      else:
+         cur.execute('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', ('Custom', srsID, 'NONE', srsID, self.crsWKT, None))
+      return srsID
+
+   def _blob(self, wkb, env):
+      # GeoPackage binary header: magic, version 0, flags (little-endian, and either an xy envelope or the empty flag), srs_id, envelope
+      if wkb is None:
+         return None
+      if env is None:
+         return sqlite3.Binary(struct.pack('<2sBBi', b'GP', 0, 0x11, self.srsID) + wkb)
+      return sqlite3.Binary(struct.pack('<2sBBi4d', b'GP', 0, 0x03, self.srsID, *env) + wkb)
+
+   def _write(self, rows):
+      fid0 = self.written + 1
+      envs = [None if wkb is None else wkbEnvelope(wkb) for wkb, values in rows]
+      with self.conn:
+         self.conn.executemany(self._insert, [[fid0 + i, self._blob(wkb, env)] + self._textValues(values) for i, ((wkb, values), env) in enumerate(zip(rows, envs))])
+         if self.rtree:
+            self.conn.executemany('INSERT INTO "%s" VALUES (?, ?, ?, ?, ?)' % self.rtree, [(fid0 + i,) + env for i, env in enumerate(envs) if env is not None])
+      for env in envs:
+         if env is not None:
+            e = self.extent or env
+            self.extent = (min(e[0], env[0]), max(e[1], env[1]), min(e[2], env[2]), max(e[3], env[3]))
+
+   def _close(self):
+      with self.conn:
+         if self.extent:
+            minx, maxx, miny, maxy = self.extent
+            self.conn.execute('UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = ?', (minx, miny, maxx, maxy, self.table))
+         if self.rtree:
+            self.conn.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)', (self.table, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only'))
+            for trigger in rtreeTriggers:
+               self.conn.execute(trigger.format(t=self.table, r=self.rtree))
+      self.conn.close()
+
+# Triggers keeping a GeoPackage R-tree index up to date with later edits, as given by the GeoPackage standard ({t}: feature table, {r}: R-tree table)
+rtreeTriggers = [
+   'CREATE TRIGGER "{r}_insert" AFTER INSERT ON "{t}" WHEN (new.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END',
+   'CREATE TRIGGER "{r}_update1" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END',
+   'CREATE TRIGGER "{r}_update2" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END',
+   'CREATE TRIGGER "{r}_update3" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; INSERT OR REPLACE INTO "{r}" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END',
+   'CREATE TRIGGER "{r}_update4" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "{r}" WHERE id IN (OLD.fid, NEW.fid); END',
+   'CREATE TRIGGER "{r}_delete" AFTER DELETE ON "{t}" WHEN old.geom NOT NULL BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END']
+
+def wkbEnvelope(wkb):
+   '''Returns the (minx, maxx, miny, maxy) envelope of a WKB geometry, or None if it is empty. Reads ISO and extended (PostGIS) WKB, with or without Z and M.'''
+   xs, ys = [], []
+   _readWKB(bytes(wkb), 0, xs, ys)
+   if not xs:
+      return None
+   return (min(xs), max(xs), min(ys), max(ys))
+
+def _readWKB(wkb, pos, xs, ys):
+   # Adds the minimum and maximum x and y of the geometry at pos to xs and ys, and returns the position after it
+   order = '<' if wkb[pos:pos + 1] == b'\x01' else '>'
+   gtype = struct.unpack_from(order + 'I', wkb, pos + 1)[0]
+   pos += 5
+   # ISO WKB adds 1000 for Z, 2000 for M and 3000 for both to the type; extended WKB sets high bits instead
+   iso, base = divmod(gtype & 0x0FFFFFFF, 1000)
+   dims = 2 + (iso in (1, 3)) + (iso in (2, 3)) + bool(gtype & 0x80000000) + bool(gtype & 0x40000000)
+   if gtype & 0x20000000:
+      pos += 4 # SRID
+
+   def points(pos, n):
+      if n:
+         vals = struct.unpack_from('%s%dd' % (order, n * dims), wkb, pos)
+         x, y = vals[0::dims], vals[1::dims]
+         # An empty point is written with NaN coordinates
+         if x[0] == x[0]:
+            xs.extend((min(x), max(x)))
+            ys.extend((min(y), max(y)))
+      return pos + 8 * n * dims
+
+   if base == 1:
+      return points(pos, 1)
+   n = struct.unpack_from(order + 'I', wkb, pos)[0]
+   pos += 4
+   if base == 2:
+      return points(pos, n)
+   for i in range(n):
+      if base == 3:
+         m = struct.unpack_from(order + 'I', wkb, pos)[0]
+         pos = points(pos + 4, m)
+      else:
+         pos = _readWKB(wkb, pos, xs, ys)
+   return pos
+
+class GeoParquetWriter(FeatureWriter):
+   '''Writes a GeoParquet file with pyarrow, one row group per batch. Geometries are stored as WKB. The coordinate system is recorded as PROJJSON if pyproj is installed; otherwise it is left undefined.'''
+   arrowTypes = {'SHORT': 'int16', 'LONG': 'int64', 'DOUBLE': 'float64', 'TEXT': 'string', 'DATE': 'string'}
+
+   def _open(self):
+      if pyarrow is None:
+         raise ImportError('Writing GeoParquet requires pyarrow')
+      crs = None
+      if pyproj is not None and (self.crsWKT or self.epsg):
+         crs = pyproj.CRS.from_user_input('%s:%s' % (self.authority, self.epsg) if self.epsg else self.crsWKT).to_json_dict()
+      geo = {'version': '1.0.0', 'primary_column': 'geometry', 'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Polygon', 'MultiPolygon'], 'crs': crs}}}
+      fields = [pyarrow.field(name, getattr(pyarrow, self.arrowTypes[ftype])()) for name, ftype in self.fields]
+      self.schema = pyarrow.schema(fields + [pyarrow.field('geometry', pyarrow.binary())], metadata={'geo': json.dumps(geo)})
+      if os.path.exists(self.path):
+         os.remove(self.path)
+      self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+   def _write(self, rows):
+      columns = [[self._textValues(values)[i] for wkb, values in rows] for i in range(len(self.fields))]
+      columns.append([wkb for wkb, values in rows])
+      self.writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(c, type=f.type) for c, f in zip(columns, self.schema)], schema=self.schema))
+
+   def _close(self):
+      self.writer.close()
+
+class OGRWriter(FeatureWriter):
+   '''Writes a FlatGeobuf (or other single-layer GDAL format) file with osgeo.ogr, one transaction per batch'''
+   driverName = 'FlatGeobuf'
+   ogrTypes = {'SHORT': 'OFTInteger', 'LONG': 'OFTInteger64', 'DOUBLE': 'OFTReal', 'TEXT': 'OFTString', 'DATE': 'OFTString'}
+
+   def _open(self):
+      if ogr is None:
+         raise ImportError('Writing %s requires GDAL (osgeo.ogr)' % self.driverName)
+      ogr.UseExceptions()
+      driver = ogr.GetDriverByName(self.driverName)
+      if os.path.exists(self.path):
+         driver.DeleteDataSource(self.path)
+      sr = None
+      if self.crsWKT or self.epsg:
+         sr = osr.SpatialReference()
+         if self.authority == 'EPSG' or not self.crsWKT:
+            sr.ImportFromEPSG(self.epsg)
+         else:
+            sr.ImportFromWkt(self.crsWKT)
+      self.ds = driver.CreateDataSource(self.path)
+      self.layer = self.ds.CreateLayer(os.path.splitext(os.path.basename(self.path))[0], sr, ogr.wkbUnknown)
+      for name, ftype in self.fields:
+         self.layer.CreateField(ogr.FieldDefn(name, getattr(ogr, self.ogrTypes[ftype])))
+      self.defn = self.layer.GetLayerDefn()
+
+   def _write(self, rows):
+      self.layer.StartTransaction()
+      for wkb, values in rows:
+         feat = ogr.Feature(self.defn)
+         if wkb is not None:
+            feat.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+         for i, v in enumerate(self._textValues(values)):
+            if v is not None:
+               feat.SetField(i, v)
+         self.layer.CreateFeature(feat)
+      self.layer.CommitTransaction()
+
+   def _close(self):
+      self.layer = None
+      self.ds = None
+
+def outputFormat(path):
+   '''Returns the format writerFx uses for an output path: "gpkg", "parquet", "fgb", or "arcpy" for anything else'''
+   lower = path.lower()
+   if '.gpkg' in lower:
+      return 'gpkg'
+   if lower.endswith('.parquet') or lower.endswith('.geoparquet'):
+      return 'parquet'
+   if lower.endswith('.fgb'):
+      return 'fgb'
+   return 'arcpy'
+
+def openWriter(path, fields, crsWKT = None, epsg = None, batchSize = 1000):
+   '''Returns a writer for path, chosen by outputFormat'''
+   writers = {'gpkg': GeoPackageWriter, 'parquet': GeoParquetWriter, 'fgb': OGRWriter, 'arcpy': ArcpyWriter}
+   return writers[outputFormat(path)](path, fields, crsWKT, epsg, batchSize)
@@ -0,0 +1,126 @@
+# ----------------------------------------------------------------------------------------
+# zonalFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-16
+# Last Edit: 2026-10-16
+
+# Summary:
+# A library of NumPy functions for zonal statistics over overlapping zones, such as SCU catchments. Zones are burned into a grid once, as a sparse cell -> zone membership list, and each value raster is then read a single time in blocks.
+
+# Usage Tips:
+# Zonal Statistics as Table cannot handle overlapping zones in one call, so it has to be run once per zone. Here every zone is handled in the same pass: a cell belonging to several zones simply appears several times in the membership list.
+# Values are read through a function readBlock(row0, row1, col0, col1) returning a 2D array, so the same code works for arcpy rasters, memory-mapped arrays, or a gridFx.TileCache.
+
+# Dependencies:
+# numpy 1.7 or later, as shipped with ArcGIS 10.3.1. Does not require arcpy.
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import numpy as np
+import gridFx
+
+class ZoneMembership(object):
+   '''Sparse cell -> zone membership over a grid. Holds parallel arrays of cells (flat indices, sorted) and zone numbers (indices into zoneIDs), with one pair for every cell of every zone, so zones may overlap freely.'''
+   def __init__(self, grid, zoneIDs, cells, zones):
+      self.grid = grid
+      self.zoneIDs = list(zoneIDs)
+      order = np.argsort(cells, kind='mergesort')
+      self.cells = np.asarray(cells, dtype=np.int64)[order]
+      self.zones = np.asarray(zones, dtype=np.int32)[order]
+
+   @classmethod
+   def fromCellSets(cls, grid, cellSets):
+      '''Builds the membership from a dictionary of zone ID -> flat cell indices'''
+      zoneIDs = list(cellSets.keys())
+      cells = [np.asarray(cellSets[z], dtype=np.int64) for z in zoneIDs]
+      zones = [np.zeros(len(c), dtype=np.int32) + i for i, c in enumerate(cells)]
+      if not cells:
+         return cls(grid, [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32))
+      return cls(grid, zoneIDs, np.concatenate(cells), np.concatenate(zones))
+
+   @classmethod
+   def fromPolygons(cls, grid, polys):
+      '''Builds the membership from a dictionary of zone ID -> polygon rings. Cells are assigned by cell center, as Zonal Statistics does when it converts zone features to raster. All polygons are burned in a single pass (see gridFx.rasterizeLabels).'''
+      return cls.fromLabelGrid(gridFx.rasterizeLabels(polys, grid, False))
+
+   @classmethod
+   def fromLabelGrid(cls, labelGrid):
+      '''Builds the membership from a gridFx.LabelGrid, taking cells covered by several zones from its overlap table'''
+      cells, zones = labelGrid.pairs()
+      return cls(labelGrid.grid, labelGrid.ids, cells, zones)
+
+   def __len__(self):
+      return len(self.cells)
+
+   def rowRange(self):
+      '''Returns the (row0, row1, col0, col1) window holding all member cells'''
+      if len(self.cells) == 0:
+         return (0, 0, 0, 0)
+      rows, cols = self.grid.flatToRowCol(self.cells)
+      return (int(rows[0]), int(rows[-1]) + 1, int(cols.min()), int(cols.max()) + 1)
+
+def zonalStats(membership, readBlock, blockRows = 512, nodata = None):
+   '''Computes the count, sum, mean, minimum and maximum of a value grid within every zone, reading the grid once in blocks of rows. Cells equal to nodata, or NaN, are skipped. Returns a dictionary of arrays ordered as membership.zoneIDs, plus the zone IDs themselves under "ids"; zones with no valid cells get a mean, minimum and maximum of NaN.'''
+   nz = len(membership.zoneIDs)
+   count = np.zeros(nz, dtype=np.int64)
+   total = np.zeros(nz)
+   vmin = np.empty(nz)
+   vmin.fill(np.inf)
+   vmax = -vmin
+   ncols = membership.grid.ncols
+   r0, r1, c0, c1 = membership.rowRange()
+
+   for br0 in range(r0, r1, blockRows):
+      br1 = min(br0 + blockRows, r1)
+      # Member pairs falling in this block; cells are sorted, so they form a contiguous run
+      a = np.searchsorted(membership.cells, br0 * ncols, 'left')
+      b = np.searchsorted(membership.cells, br1 * ncols, 'left')
+      if a == b:
+         continue
+      cells = membership.cells[a:b]
+      zones = membership.zones[a:b]
+      block = np.asarray(readBlock(br0, br1, c0, c1), dtype=float)
+      vals = block[cells // ncols - br0, cells % ncols - c0]
+      ok = ~np.isnan(vals)
+      if nodata is not None:
+         ok &= vals != nodata
+      vals, zones = vals[ok], zones[ok]
+      if len(vals) == 0:
+         continue
+
+      # Sums and counts by bincount; minima and maxima by reducing runs of each zone
+      count += np.bincount(zones, minlength=nz)
+      total += np.bincount(zones, weights=vals, minlength=nz)
+      order = np.argsort(zones, kind='mergesort')
+      zs, vs = zones[order], vals[order]
+      starts = np.concatenate([[0], np.nonzero(np.diff(zs))[0] + 1])
+      z = zs[starts]
+      vmin[z] = np.minimum(vmin[z], np.minimum.reduceat(vs, starts))
+      vmax[z] = np.maximum(vmax[z], np.maximum.reduceat(vs, starts))
+
+   empty = count == 0
+   with np.errstate(invalid='ignore', divide='ignore'):
+      mean = total / count
+   mean[empty] = np.nan
+   vmin[empty] = np.nan
+   vmax[empty] = np.nan
+   return {'ids': membership.zoneIDs, 'count': count, 'sum': total, 'mean': mean, 'min': vmin, 'max': vmax}
+
+def cellValues(membership, readBlock, blockRows = 512, nodata = None):
+   '''Reads the value of a grid at every member cell, reading the grid once in blocks of rows, as zonalStats does. Returns an array of values parallel to membership.cells and membership.zones, with NaN where the grid holds nodata.'''
+   vals = np.empty(len(membership.cells))
+   vals.fill(np.nan)
+   ncols = membership.grid.ncols
+   r0, r1, c0, c1 = membership.rowRange()
+   for br0 in range(r0, r1, blockRows):
+      br1 = min(br0 + blockRows, r1)
+      a = np.searchsorted(membership.cells, br0 * ncols, 'left')
+      b = np.searchsorted(membership.cells, br1 * ncols, 'left')
+      if a == b:
+         continue
+      cells = membership.cells[a:b]
+      block = np.asarray(readBlock(br0, br1, c0, c1), dtype=float)
+      vals[a:b] = block[cells // ncols - br0, cells % ncols - c0]
+   if nodata is not None:
+      vals[vals == nodata] = np.nan
+   return vals